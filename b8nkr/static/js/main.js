@@ -20,6 +20,39 @@ function toggleBot() {
         });
 }
 
+function restartBot() {
+    fetch('/restart_bot', {
+        method: 'POST',
+    })
+        .then(response => response.json())
+        .then(data => {
+            showAlert(data.success ? 'Rolling restart started' : 'Bot is not running or already restarting',
+                data.success ? 'info' : 'warning');
+        });
+}
+
+// Worker Status
+function refreshWorkers() {
+    const table = document.getElementById('workerTable');
+    if (!table) return;
+
+    fetch('/workers')
+        .then(response => response.json())
+        .then(data => {
+            table.innerHTML = '';
+            data.workers.forEach(worker => {
+                const row = document.createElement('tr');
+                [worker.slot, worker.pid || '', worker.state, worker.cpu_percent === undefined ? '' : worker.cpu_percent + '%',
+                    worker.memory_mb === undefined ? '' : worker.memory_mb, worker.restarts].forEach(value => {
+                    const cell = document.createElement('td');
+                    cell.textContent = value;
+                    row.appendChild(cell);
+                });
+                table.appendChild(row);
+            });
+        });
+}
+
 // Command Usage Chart
 function initializeCommandChart() {
     const ctx = document.getElementById('commandChart');
@@ -55,6 +88,65 @@ function initializeCommandChart() {
         });
 }
 
+// Latency Table
+function initializeLatencyTable() {
+    const table = document.getElementById('latencyTable');
+    if (!table) return;
+
+    fetch('/traces')
+        .then(response => response.json())
+        .then(data => {
+            table.innerHTML = '';
+            data.spans.forEach(span => {
+                const row = document.createElement('tr');
+                [span.kind, span.route, span.p50, span.p95, span.p99].forEach(value => {
+                    const cell = document.createElement('td');
+                    cell.textContent = value === undefined ? '' : value;
+                    row.appendChild(cell);
+                });
+                table.appendChild(row);
+            });
+        });
+}
+
+// Profiler
+function loadProfiles() {
+    const list = document.getElementById('profileList');
+    if (!list) return;
+
+    fetch('/profiles')
+        .then(response => response.json())
+        .then(data => {
+            list.innerHTML = '';
+            data.profiles.forEach(name => {
+                const item = document.createElement('li');
+                const link = document.createElement('a');
+                link.href = '/profiles/' + encodeURIComponent(name);
+                link.textContent = name;
+                item.appendChild(link);
+                list.appendChild(item);
+            });
+        });
+}
+
+function startProfile() {
+    const seconds = document.getElementById('profileSeconds').value;
+    const formData = new FormData();
+    formData.append('seconds', seconds);
+
+    fetch('/profile', {
+        method: 'POST',
+        body: formData
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                showAlert(`Profiling for ${data.seconds}s, the flamegraph file appears below when done`, 'info');
+                setTimeout(loadProfiles, (data.seconds + 5) * 1000);
+            }
+        });
+}
+
 // Configuration Management
 function saveConfig(event) {
     event.preventDefault();
@@ -119,6 +211,12 @@ function initializeLogStream() {
 // Initialize components when DOM is loaded
 document.addEventListener('DOMContentLoaded', function () {
     initializeCommandChart();
+    initializeLatencyTable();
+    loadProfiles();
+    refreshWorkers();
+    if (document.getElementById('workerTable')) {
+        setInterval(refreshWorkers, 5000);
+    }
     initializeLogStream();
 
     // Initialize tooltips
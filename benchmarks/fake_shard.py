@@ -0,0 +1,12 @@
+"""Shard worker for offline benchmarks: bot.py's shard mode over the fake Bot API transport
+
+Pass as the ingress's command, e.g. Ingress(shards, command=[sys.executable, "-m", "benchmarks.fake_shard"]).
+"""
+import asyncio
+
+import bot
+from benchmarks.fake_telegram import FakeTelegramRequest
+from ingress import serve_shard
+
+if __name__ == "__main__":
+    asyncio.run(serve_shard(bot.build_application(request=FakeTelegramRequest())))
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+from typing import Callable, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'B8NKR', 'username': 'b8nkr_bot'}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Bot API transport that answers locally, for offline benchmarks
+
+    `on_call(method, params, timestamp)` is invoked for every API call so a
+    harness can measure when replies leave the bot.
+    """
+
+    def __init__(self, on_call: Optional[Callable[[str, dict, float], None]] = None, latency: float = 0.0):
+        self.on_call = on_call
+        self.latency = latency
+        self.calls = 0
+        self._message_id = 0
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.on_call is not None:
+            self.on_call(api_method, params, time.perf_counter())
+        return 200, json.dumps({'ok': True, 'result': self._result(api_method, params)}).encode()
+
+    def _result(self, api_method: str, params: dict):
+        if api_method == 'getMe':
+            return BOT_USER
+        if api_method == 'getUpdates':
+            return []
+        if api_method in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            chat_id = params.get('chat_id', 0)
+            return {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        return True
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> dict:
+    """Synthetic private-chat message update"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> dict:
+    """Synthetic callback query update on a bot message"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'menu',
+            },
+        },
+    }
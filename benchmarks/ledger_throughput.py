@@ -0,0 +1,97 @@
+"""Measure group-committed ledger transfer throughput
+
+    python -m benchmarks.ledger_throughput --accounts 1000 --transfers 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from ledger import Ledger
+
+# What Ledger.get_profile ran before account summaries were materialized
+AGGREGATE_PROFILE = (
+    "SELECT COALESCE(SUM(CASE WHEN e.amount < 0 THEN -e.amount END), 0), "
+    "COALESCE(SUM(CASE WHEN e.amount > 0 AND t.kind = 'transfer' THEN e.amount END), 0), "
+    "MAX(CASE WHEN t.kind = 'transfer' THEN e.created_at END) "
+    "FROM entries e JOIN transactions t ON t.tx_id = e.tx_id WHERE e.account_id = ?"
+)
+PENDING_REQUESTS = "SELECT COUNT(*) FROM transactions WHERE debit_account = ? AND status = 'pending'"
+
+
+async def run(accounts: int, transfers: int, concurrency: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = Ledger(os.path.join(tmp, "bench.db"), opening_balance=1_000_000)
+        await ledger.start()
+        phones = [f"+1555{i:07d}" for i in range(accounts)]
+        for phone in phones:
+            await ledger.open_account(phone)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        rng = random.Random(42)
+        pairs = [rng.sample(phones, 2) for _ in range(transfers)]
+
+        async def transfer(i: int) -> None:
+            source, target = pairs[i]
+            async with semaphore:
+                await ledger.transfer(f"bench:{i}", source, target, rng.randint(1, 5000))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(transfer(i) for i in range(transfers)))
+        elapsed = time.perf_counter() - started
+        stats = ledger.stats()
+        print(f"{transfers} transfers in {elapsed:.2f}s ({transfers / elapsed:.0f}/s), "
+              f"{stats['commits']} commits (avg batch {stats['operations'] / stats['commits']:.0f})")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(transfer(i) for i in range(min(transfers, 1000))))
+        print(f"replay of 1000 idempotent transfers: {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        started = time.perf_counter()
+        for phone in phones[:1000]:
+            await ledger.get_balance(phone)
+        print(f"balance read: {(time.perf_counter() - started) / min(accounts, 1000) * 1e6:.1f}us")
+
+        # /profile: the aggregate scan it used to run, the stored summary, and the cached summary
+        conn = sqlite3.connect(ledger.path)
+        ids = [conn.execute("SELECT account_id FROM accounts WHERE phone = ?", (phone,)).fetchone()[0]
+               for phone in phones[:1000]]
+        started = time.perf_counter()
+        for account_id in ids:
+            conn.execute(AGGREGATE_PROFILE, (account_id,)).fetchone()
+            conn.execute(PENDING_REQUESTS, (account_id,)).fetchone()
+        aggregate = (time.perf_counter() - started) / len(ids) * 1e6
+        conn.close()
+        ledger.cache_size = 0
+        started = time.perf_counter()
+        for phone in phones[:1000]:
+            await ledger.get_profile(phone)
+        stored = (time.perf_counter() - started) / len(ids) * 1e6
+        ledger.cache_size = 1000
+        for phone in phones[:1000]:
+            await ledger.get_profile(phone)
+        started = time.perf_counter()
+        for phone in phones[:1000]:
+            await ledger.get_profile(phone)
+        cached = (time.perf_counter() - started) / len(ids) * 1e6
+        print(f"profile read ({transfers * 2 // accounts} entries per account): aggregate scan {aggregate:.1f}us, "
+              f"summary {stored:.1f}us, cached summary {cached:.1f}us")
+        mismatches = await ledger.check_summaries()
+        print(f"summaries differing from history: {len(mismatches)}")
+        await ledger.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--transfers", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.accounts, args.transfers, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
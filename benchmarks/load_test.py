@@ -0,0 +1,164 @@
+"""Load-test the full user flow against the real Application, offline
+
+Builds the bot's Application with a fake Bot API transport and a fake SMS
+gateway, then lets synthetic users arrive at a fixed rate and each run
+/start -> verify_phone -> phone -> OTP -> menu -> balance -> transfer.
+Updates go through the same update processor as in production. Reports
+throughput, per-step latency percentiles and memory per active user.
+
+    python -m benchmarks.load_test --users 2000 --arrival-rate 100
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import os
+import random
+import re
+import tempfile
+import time
+from collections import defaultdict
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def configure(tmp: str, telegram_limits: bool) -> None:
+    """Environment for the bot module; must run before it is imported"""
+    os.environ.setdefault("SMS_GATEWAY", "fake")
+    os.environ.setdefault("PERSISTENCE_PATH", "")
+    os.environ.setdefault("STATE_SNAPSHOT_PATH", "")
+    os.environ.setdefault("METRICS_PATH", "")
+    os.environ["LEDGER_PATH"] = os.path.join(tmp, "ledger.db")
+    os.environ.setdefault("LOG_PATH", os.path.join(tmp, "bot.log"))
+    if not telegram_limits:
+        # Measure the bot, not the flood limits it deliberately stays under
+        os.environ["OUTBOUND_MAX_PER_SECOND"] = "1000000"
+        os.environ["OUTBOUND_MAX_PER_CHAT"] = "1000000"
+
+
+async def run(users: int, arrival_rate: float, think: float, api_latency: float, sms_latency: float) -> None:
+    import psutil
+    from telegram import Update
+
+    import bot
+    from benchmarks.fake_telegram import FakeTelegramRequest, make_callback_update, make_message_update
+    from sms import FakeSmsGateway
+
+    class CapturingSmsGateway(FakeSmsGateway):
+        """Hands each OTP to the synthetic user waiting for it"""
+
+        def __init__(self, latency: float):
+            super().__init__(latency)
+            self.waiting = {}
+
+        async def send(self, to: str, body: str) -> None:
+            await super().send(to, body)
+            future = self.waiting.pop(to, None)
+            if future is not None and not future.done():
+                future.set_result(re.search(r'\d{6}', body).group())
+
+    gateway = bot.sms_dispatcher.gateway = CapturingSmsGateway(sms_latency)
+    application = bot.build_application(token="123456:BENCHMARK", request=FakeTelegramRequest(latency=api_latency))
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+
+    update_ids = itertools.count(1)
+    latencies = defaultdict(list)
+    verified_phones = []
+    failures = defaultdict(int)
+
+    async def send(step: str, data: dict) -> None:
+        update = Update.de_json(data, application.bot)
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[step].append(time.perf_counter() - started)
+        if think:
+            await asyncio.sleep(think)
+
+    async def message(step: str, user_id: int, text: str) -> None:
+        await send(step, make_message_update(next(update_ids), user_id, text))
+
+    async def callback(step: str, user_id: int, data: str) -> None:
+        await send(step, make_callback_update(next(update_ids), user_id, data))
+
+    async def user_flow(i: int) -> None:
+        user_id = 100_000 + i
+        phone = f"+1555{i:07d}"
+        await message("start", user_id, "/start")
+        await callback("verify_phone", user_id, "verify_phone")
+        code = gateway.waiting[phone] = asyncio.get_running_loop().create_future()
+        await message("phone", user_id, phone)
+        try:
+            otp = await asyncio.wait_for(code, timeout=30)
+        except asyncio.TimeoutError:
+            failures["otp_timeout"] += 1
+            return
+        await message("otp", user_id, otp)
+        if not application.user_data[user_id].get("verified"):
+            failures["not_verified"] += 1
+            return
+        await message("menu", user_id, "/menu")
+        await callback("balance", user_id, "balance")
+        if verified_phones:
+            await callback("transfer", user_id, "transfer")
+            await callback("send_money", user_id, "send_money")
+            await message("recipient", user_id, random.choice(verified_phones))
+            await message("amount", user_id, "1.00")
+            await callback("confirm", user_id, "transfer_confirm")
+        verified_phones.append(phone)
+
+    gc.collect()
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    started = time.perf_counter()
+    tasks = []
+    for i in range(users):
+        delay = started + i / arrival_rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(user_flow(i)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    rss_after = process.memory_info().rss
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{users} users, {total} updates in {elapsed:.2f}s ({total / elapsed:.0f} updates/s), "
+          f"{len(verified_phones)} verified, failures: {dict(failures) or 'none'}")
+    print(f"{'step':<14}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    every = []
+    for step, values in latencies.items():
+        every.extend(values)
+        print(f"{step:<14}{len(values):>8}{percentile(values, 50) * 1000:>10.2f}{percentile(values, 95) * 1000:>10.2f}"
+              f"{percentile(values, 99) * 1000:>10.2f}{max(values) * 1000:>10.2f}")
+    print(f"{'all':<14}{len(every):>8}{percentile(every, 50) * 1000:>10.2f}{percentile(every, 95) * 1000:>10.2f}"
+          f"{percentile(every, 99) * 1000:>10.2f}{max(every) * 1000:>10.2f}")
+    print(f"memory: {(rss_after - rss_before) / 1024 / 1024:.1f}MB RSS growth, "
+          f"{(rss_after - rss_before) / max(1, users) / 1024:.1f}KB per active user")
+
+    await application.stop()
+    await bot.post_shutdown(application)
+    await application.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--arrival-rate", type=float, default=100, help="new users per second")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each user waits between steps")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API round trip (seconds)")
+    parser.add_argument("--sms-latency", type=float, default=0.05, help="simulated SMS provider latency (seconds)")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep the outbound flood-limit throttling from the environment")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(tmp, args.telegram_limits)
+        asyncio.run(run(args.users, args.arrival_rate, args.think, args.api_latency, args.sms_latency))
+
+
+if __name__ == "__main__":
+    main()
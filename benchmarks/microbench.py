@@ -0,0 +1,87 @@
+"""Microbenchmark the bot's per-update state operations at growing store sizes
+
+Fills a fresh in-memory state backend with N pending OTPs (half of them
+already expired) and N rate-limit entries, then times the bot's own helpers
+against it.
+
+    python -m benchmarks.microbench --sizes 10000,100000,1000000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("SMS_GATEWAY", "fake")
+os.environ.setdefault("PERSISTENCE_PATH", "")
+os.environ.setdefault("STATE_SNAPSHOT_PATH", "")
+os.environ.setdefault("METRICS_PATH", "")
+os.environ.setdefault("LOG_PATH", os.path.join(tempfile.gettempdir(), "b8nkr-bench.log"))
+
+import bot  # noqa: E402
+from outbound import OutboundScheduler  # noqa: E402
+from rate_limiter import load_limits_from_env  # noqa: E402
+from state_backend import create_state_backend  # noqa: E402
+from update_processor import PerUserUpdateProcessor  # noqa: E402
+
+PHONES = ["+15551234567", "+442071838750", "12345", "+1555123456789012", "+0123456789"]
+
+
+async def fill(state, size: int) -> None:
+    for user_id in range(size):
+        await state.store_otp(user_id, f"+1555{user_id:07d}", "123456", -1 if user_id % 2 == 0 else 300)
+        await state.rate_limit('otp_request', user_id)
+
+
+async def per_call_us(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        await func(i)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def phone_check_us(iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        bot.is_valid_phone_number(PHONES[i % len(PHONES)])
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(sizes, iterations: int) -> None:
+    # cleanup_expired_data only reads stats from the application and the outbound scheduler
+    context = SimpleNamespace(
+        application=SimpleNamespace(update_processor=PerUserUpdateProcessor()),
+        bot=SimpleNamespace(rate_limiter=OutboundScheduler())
+    )
+    print(f"{'entries':>10}{'fill':>10}{'check_rate_limit':>18}{'verify_otp':>12}"
+          f"{'is_valid_phone':>16}{'cleanup':>12}")
+    for size in sizes:
+        bot.state = state = create_state_backend('memory', load_limits_from_env())
+        started = time.perf_counter()
+        await fill(state, size)
+        fill_s = time.perf_counter() - started
+
+        live = size // 2
+        rate = await per_call_us(lambda i: bot.check_rate_limit(i % size, 'otp_verify'), iterations)
+        # Wrong codes against live OTPs, so every call does the full lookup and nothing is consumed
+        verify = await per_call_us(lambda i: bot.verify_otp(2 * (i % live) + 1, "000000"), iterations)
+        phone = phone_check_us(iterations)
+
+        started = time.perf_counter()
+        await bot.cleanup_expired_data(context)
+        cleanup_ms = (time.perf_counter() - started) * 1000
+        print(f"{size:>10}{fill_s:>9.1f}s{rate:>16.2f}us{verify:>10.2f}us{phone:>14.2f}us{cleanup_ms:>10.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated numbers of OTP and rate-limit entries")
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(run([int(size) for size in args.sizes.split(",")], args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Measure SQLitePersistence write-behind flush cost and lazy-load latency
+
+    python -m benchmarks.persistence_flush --users 100000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from persistence import SQLitePersistence
+
+
+def make_session(user_id: int) -> dict:
+    return {
+        'verified': True,
+        'verified_phone': f"+1555{user_id:07d}",
+        'awaiting_otp': False,
+        'transfer_state': None,
+    }
+
+
+async def run(users: int, max_batch: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        persistence = SQLitePersistence(path, max_batch=max_batch)
+        await persistence.get_user_data()
+
+        started = time.perf_counter()
+        for i in range(users):
+            await persistence.update_user_data(i, make_session(i))
+        buffered = time.perf_counter() - started
+        started = time.perf_counter()
+        await persistence._flush_dirty()
+        flushed = time.perf_counter() - started
+        print(f"buffer {users} sessions: {buffered * 1000:.1f}ms ({buffered / users * 1e6:.2f}us per update)")
+        print(f"flush {users} sessions in {persistence.flushes} batches: {flushed * 1000:.1f}ms "
+              f"({users / flushed:.0f} sessions/s, last batch {persistence.last_flush_seconds * 1000:.1f}ms)")
+
+        started = time.perf_counter()
+        for i in range(0, users, 100):
+            await persistence.update_user_data(i, make_session(i))
+        await persistence._flush_dirty()
+        print(f"incremental flush of {users // 100} dirty sessions: {(time.perf_counter() - started) * 1000:.1f}ms")
+        await persistence.flush()
+
+        reopened = SQLitePersistence(path)
+        started = time.perf_counter()
+        await reopened.get_user_data()
+        print(f"startup: {(time.perf_counter() - started) * 1000:.2f}ms")
+        samples = 1000
+        started = time.perf_counter()
+        for i in range(samples):
+            await reopened.refresh_user_data(i * (users // samples), {})
+        print(f"lazy load: {(time.perf_counter() - started) / samples * 1e6:.1f}us per user")
+        await reopened.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--max-batch", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.max_batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare phone validation and normalization against the previous regex check
+
+Times the old `is_valid_phone_number` (a regex compiled through re's cache
+on every call), the new parser without and with its LRU cache, and the
+batch API, on a contact-import sized list in mixed formats and on the same
+numbers already in E.164. Also reports how many of the inputs each accepts.
+
+    python -m benchmarks.phone_validation --contacts 100000
+"""
+import argparse
+import random
+import time
+
+import phone_numbers
+
+FORMATS = [
+    "+1{0:010d}",
+    "+1 ({0:03d}) {1:03d}-{2:04d}",
+    "1-{0:03d}-{1:03d}-{2:04d}",
+    "+44 20 {1:04d} {2:04d}",
+    "0049 30 {1:04d}{2:04d}",
+    "+91 {1:05d} {2:05d}",
+    "+33 6 {1:02d} {2:02d} {3:02d} {4:02d}",
+    "{0:03d}-{1:04d}",
+    "+0{0:09d}",
+]
+
+
+def legacy_is_valid(phone: str) -> bool:
+    """The bot's check before the phone_numbers module"""
+    import re
+    pattern = r'^\+[1-9]\d{6,14}$'
+    return bool(re.match(pattern, phone))
+
+
+def contacts(count: int, distinct: int) -> list:
+    rng = random.Random(42)
+    pool = []
+    for _ in range(distinct):
+        fields = [rng.randrange(200, 1000), rng.randrange(1000), rng.randrange(10000), rng.randrange(100),
+                  rng.randrange(100)]
+        fields[0] = rng.randrange(2000000000, 9999999999) if rng.random() < 0.3 else fields[0]
+        pool.append(rng.choice(FORMATS).format(*fields))
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def per_call_us(func, phones: list) -> float:
+    started = time.perf_counter()
+    for phone in phones:
+        func(phone)
+    return (time.perf_counter() - started) / len(phones) * 1e6
+
+
+def run(name: str, phones: list) -> None:
+    legacy = per_call_us(legacy_is_valid, phones)
+    print(f"{name:<10}{'legacy regex':<20}{legacy:>10.2f}us{sum(map(legacy_is_valid, phones)):>10}")
+    uncached = per_call_us(phone_numbers._parse, phones)
+    accepted = sum(phone is not None for phone in map(phone_numbers._parse, phones))
+    print(f"{name:<10}{'parser, uncached':<20}{uncached:>10.2f}us{accepted:>10}")
+    phone_numbers.normalize.cache_clear()
+    per_call_us(phone_numbers.normalize, phones)
+    cached = per_call_us(phone_numbers.normalize, phones)
+    print(f"{name:<10}{'normalize, cached':<20}{cached:>10.2f}us{accepted:>10}")
+    started = time.perf_counter()
+    phone_numbers.normalize_many(phones)
+    batch = (time.perf_counter() - started) / len(phones) * 1e6
+    print(f"{name:<10}{'normalize_many':<20}{batch:>10.2f}us{accepted:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contacts", type=int, default=100000, help="numbers in the batch")
+    parser.add_argument("--distinct", type=int, default=20000, help="distinct numbers among them")
+    args = parser.parse_args()
+    mixed = contacts(args.contacts, args.distinct)
+    canonical = [phone for phone in map(phone_numbers._parse, mixed) if phone is not None]
+
+    print(f"{'input':<10}{'check':<20}{'per number':>12}{'accepted':>10}")
+    run('e164', canonical)
+    run('mixed', mixed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Measure update throughput of the sharded bot at 1, 2, 4... shard workers, offline
+
+Starts the real ingress with shard workers running the bot's Application
+over the fake Bot API transport (benchmarks.fake_shard) and the fake SMS
+gateway, pushes synthetic updates from many users through it as fast as the
+shards accept them, and counts handled updates from the shards' metrics files. Throughput should grow with the shard count
+up to the number of CPU cores.
+
+    python -m benchmarks.shard_scaling --shards 1,2,4 --users 2000 --updates 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+
+def configure(tmp: str) -> None:
+    """Environment for the ingress and the shard workers it starts"""
+    os.environ.setdefault("SMS_GATEWAY", "fake")
+    os.environ.setdefault("PERSISTENCE_PATH", "")
+    os.environ.setdefault("STATE_SNAPSHOT_PATH", "")
+    os.environ["METRICS_PATH"] = os.path.join(tmp, "metrics.bin")
+    os.environ["LEDGER_PATH"] = os.path.join(tmp, "ledger.db")
+    os.environ.setdefault("LOG_PATH", os.path.join(tmp, "bot.log"))
+    os.environ["OUTBOUND_MAX_PER_SECOND"] = "1000000"
+    os.environ["OUTBOUND_MAX_PER_CHAT"] = "1000000"
+    # Shards publish their handled-update counts with the other metrics; count them promptly
+    os.environ["METRICS_INTERVAL"] = "0.05"
+
+
+def handled_updates(path: str) -> int:
+    from metrics import HISTOGRAM, read_all_metrics
+
+    snapshot = read_all_metrics(path)
+    if snapshot is None:
+        return 0
+    return int(sum(series.values[-1] for series in snapshot.series
+                   if series.name == 'b8nkr_update_seconds' and series.kind == HISTOGRAM))
+
+
+async def run_once(shards: int, users: int, updates: int, metrics_path: str) -> float:
+    from benchmarks.fake_telegram import make_callback_update, make_message_update
+    from ingress import Ingress
+
+    # Shards run bot.py's shard mode with the fake Bot API transport injected
+    ingress = Ingress(shards, command=[sys.executable, "-m", "benchmarks.fake_shard"])
+    await ingress.start()
+    steps = [
+        lambda update_id, user_id: make_message_update(update_id, user_id, "/start"),
+        lambda update_id, user_id: make_callback_update(update_id, user_id, "balance"),
+        lambda update_id, user_id: make_message_update(update_id, user_id, "/help"),
+        lambda update_id, user_id: make_callback_update(update_id, user_id, "back_to_main"),
+    ]
+    started = time.perf_counter()
+    for i in range(updates):
+        await ingress.dispatch(steps[(i // users) % len(steps)](i + 1, 100_000 + i % users))
+    while handled_updates(metrics_path) < updates:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await ingress.stop()
+    return elapsed
+
+
+async def run(shard_counts, users: int, updates: int) -> None:
+    print(f"{os.cpu_count()} CPUs, {users} users, {updates} updates per run")
+    print(f"{'shards':>6}{'seconds':>10}{'updates/s':>12}{'speedup':>10}")
+    baseline = None
+    for shards in shard_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Fresh ledger and metrics per run
+            os.environ["METRICS_PATH"] = os.path.join(tmp, "metrics.bin")
+            os.environ["LEDGER_PATH"] = os.path.join(tmp, "ledger.db")
+            elapsed = await run_once(shards, users, updates, os.environ["METRICS_PATH"])
+        rate = updates / elapsed
+        baseline = baseline or rate
+        print(f"{shards:>6}{elapsed:>10.2f}{rate:>12.0f}{rate / baseline:>9.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", default="1,2,4", help="comma-separated shard counts")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(tmp)
+        asyncio.run(run([int(n) for n in args.shards.split(",")], args.users, args.updates))
+
+
+if __name__ == "__main__":
+    main()
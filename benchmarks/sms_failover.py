@@ -0,0 +1,95 @@
+"""Measure OTP SMS delivery through a degrading primary provider with and without failover and hedging
+
+Sends messages at a steady rate through local fake providers while the
+primary goes through three phases: healthy, a brownout where a share of its
+sends stall, and an outage where every send fails. The backup provider is
+healthy but slower. Reports ack latency percentiles, failed messages and
+extra provider sends (hedges and failovers) per configuration and phase.
+
+    python -m benchmarks.sms_failover --rate 100 --phase-seconds 5
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from sms import FailoverSmsGateway, FakeSmsGateway
+
+PHASES = [
+    ('healthy', dict(slow_rate=0.0, failure_rate=0.0)),
+    ('brownout', dict(slow_rate=0.2, failure_rate=0.0)),
+    ('outage', dict(slow_rate=0.0, failure_rate=1.0)),
+]
+
+CONFIGS = [
+    ('primary only', dict(failover=False, hedge=False)),
+    ('failover', dict(failover=True, hedge=False)),
+    ('failover+hedge', dict(failover=True, hedge=True)),
+]
+
+
+def pct(ordered, p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000 if ordered else 0.0
+
+
+async def run_config(failover: bool, hedge: bool, rate: float, phase_seconds: float, stall: float) -> dict:
+    primary = FakeSmsGateway(latency=0.05, slow_latency=stall, name='primary')
+    backup = FakeSmsGateway(latency=0.12, slow_rate=0.01, slow_latency=0.5, name='backup')
+    gateway = FailoverSmsGateway([primary, backup] if failover else [primary], hedge=hedge)
+    await gateway.start()
+    results = defaultdict(lambda: {'latencies': [], 'failed': 0, 'messages': 0})
+    tasks = []
+
+    async def deliver(phase: str, i: int) -> None:
+        started = time.perf_counter()
+        try:
+            await gateway.send(f"+1555{i:07d}", f"Your B8NKR verification code is: {i % 1000000:06d}")
+            results[phase]['latencies'].append(time.perf_counter() - started)
+        except Exception:
+            results[phase]['failed'] += 1
+
+    counter = 0
+    for phase, knobs in PHASES:
+        for name, value in knobs.items():
+            setattr(primary, name, value)
+        extra_before = gateway.hedged + gateway.failovers
+        deadline = time.perf_counter() + phase_seconds
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.create_task(deliver(phase, counter)))
+            results[phase]['messages'] += 1
+            counter += 1
+            await asyncio.sleep(1 / rate)
+        # Let this phase's messages finish before counting its extra sends
+        await asyncio.gather(*tasks)
+        tasks.clear()
+        results[phase]['extra'] = gateway.hedged + gateway.failovers - extra_before
+    await gateway.close()
+    return results
+
+
+async def run(rate: float, phase_seconds: float, stall: float) -> None:
+    print(f"{'config':<16}{'phase':<10}{'messages':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'failed':>8}{'extra':>8}")
+    for config, options in CONFIGS:
+        results = await run_config(options['failover'], options['hedge'], rate, phase_seconds, stall)
+        for phase, _ in PHASES:
+            result = results[phase]
+            ordered = sorted(result['latencies'])
+            extra = result['extra'] / result['messages'] * 100 if result['messages'] else 0.0
+            print(f"{config:<16}{phase:<10}{result['messages']:>9}{pct(ordered, 0.5):>7.0f}ms"
+                  f"{pct(ordered, 0.95):>7.0f}ms{pct(ordered, 0.99):>7.0f}ms{result['failed']:>8}{extra:>7.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=100, help="messages per second")
+    parser.add_argument("--phase-seconds", type=float, default=5)
+    parser.add_argument("--stall", type=float, default=3.0, help="latency of the primary's stalled sends")
+    args = parser.parse_args()
+    # Every failed provider send is logged; only the table matters here
+    logging.getLogger('sms').setLevel(logging.CRITICAL)
+    asyncio.run(run(args.rate, args.phase_seconds, args.stall))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Check that the memory and Redis state backends behave alike, and time their operations
+
+Runs the same scenario against the in-memory backend and the Redis backend:
+store an OTP, a second user's claim on the same phone, a phone switch that
+releases the old claim, verify (wrong code, right code, replay), cancelling
+an undelivered code and the OTP request rate limit. Redis defaults to an in-process fakeredis server (see
+requirements-dev.txt); pass --redis-url to use a real server. Exits non-zero
+if a backend gets any step wrong.
+
+    python -m benchmarks.state_backends --iterations 5000
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from state_backend import InMemoryStateBackend, RedisStateBackend
+
+LIMITS = {'otp_request': (3, 300.0), 'otp_verify': (5, 300.0)}
+
+
+async def check(state) -> list:
+    """Names of the scenario steps the backend got wrong"""
+    failures = []
+
+    def expect(step: str, actual, wanted) -> None:
+        if actual != wanted:
+            failures.append(f"{step}: got {actual!r}, wanted {wanted!r}")
+
+    expect("store", await state.store_otp(1, "+15550001111", "123456", 300), True)
+    expect("pending owner", await state.get_phone_owner("+15550001111"), (1, False))
+    expect("claim conflict", await state.store_otp(2, "+15550001111", "654321", 300), False)
+    expect("resend to own pending phone", await state.store_otp(1, "+15550001111", "123456", 300), True)
+
+    expect("switch phone", await state.store_otp(3, "+15550002222", "111111", 300), True)
+    expect("switch phone", await state.store_otp(3, "+15550003333", "222222", 300), True)
+    expect("old claim released", await state.get_phone_owner("+15550002222"), None)
+    expect("new claim pending", await state.get_phone_owner("+15550003333"), (3, False))
+
+    expect("wrong code", await state.verify_otp(1, "000000"), None)
+    expect("right code", await state.verify_otp(1, "123456"), "+15550001111")
+    expect("verified owner", await state.get_phone_owner("+15550001111"), (1, True))
+    expect("replayed code", await state.verify_otp(1, "123456"), None)
+    expect("claim on verified phone", await state.store_otp(2, "+15550001111", "654321", 300), False)
+
+    expect("cancel replaced code", await state.cancel_otp(3, "111111"), False)
+    expect("cancel", await state.cancel_otp(3, "222222"), True)
+    expect("cancelled claim released", await state.get_phone_owner("+15550003333"), None)
+    expect("cancelled code", await state.verify_otp(3, "222222"), None)
+
+    decisions = [await state.rate_limit('otp_request', 9) for _ in range(4)]
+    expect("rate limit allows", [decision.allowed for decision in decisions], [True, True, True, False])
+    expect("rate limit remaining", [decision.remaining for decision in decisions[:3]], [2, 1, 0])
+    expect("rate limit retry_after", decisions[3].retry_after > 0, True)
+    expect("rate limit per user", (await state.rate_limit('otp_request', 10)).allowed, True)
+    expect("unlimited action", (await state.rate_limit('unknown', 9)).allowed, True)
+    return failures
+
+
+async def per_call_us(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        await func(i)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(iterations: int, redis_url: str) -> bool:
+    if redis_url:
+        redis_state = RedisStateBackend(LIMITS, url=redis_url, prefix=f"b8nkr-check:{time.time_ns()}:")
+    else:
+        import fakeredis
+        redis_state = RedisStateBackend(LIMITS, client=fakeredis.FakeAsyncRedis(decode_responses=True))
+    ok = True
+    print(f"{'backend':<10}{'store_otp':>12}{'verify_otp':>12}{'rate_limit':>12}  check")
+    for name, state in (('memory', InMemoryStateBackend(LIMITS)), ('redis', redis_state)):
+        await state.start()
+        try:
+            failures = await check(state)
+            store = await per_call_us(lambda i: state.store_otp(1000 + i, f"+1555{i:07d}", "123456", 300), iterations)
+            verify = await per_call_us(lambda i: state.verify_otp(1000 + i, "123456"), iterations)
+            limit = await per_call_us(lambda i: state.rate_limit('otp_request', 1000 + i), iterations)
+        finally:
+            await state.stop()
+        print(f"{name:<10}{store:>10.1f}us{verify:>10.1f}us{limit:>10.1f}us  {'ok' if not failures else 'FAILED'}")
+        for failure in failures:
+            print(f"    {failure}")
+        ok = ok and not failures
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--redis-url", default="", help="real Redis server to use instead of fakeredis")
+    args = parser.parse_args()
+    if not asyncio.run(run(args.iterations, args.redis_url)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Measure memory per user of the in-memory OTP and rate-limit state at 1M pending verifications
+
+Each synthetic user has one pending OTP, a claimed phone number and one
+otp_request rate-limit hit. Allocations are counted with tracemalloc for
+the current compact backend and for the two layouts it replaced: dicts of
+strings with datetime expiries, and dicts with monotonic float expiries plus
+one expiry heap entry per OTP and per rate-limit key.
+
+    python -m benchmarks.state_memory --users 1000000
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from expiry import ExpiryEngine
+from rate_limiter import GcraLimit, load_limits_from_env
+from state_backend import InMemoryStateBackend
+
+OTP_TTL = 300
+
+
+def phone(i: int) -> str:
+    return f"+1555{i:07d}"
+
+
+def otp(i: int) -> str:
+    return f"{i * 7919 % 1000000:06d}"
+
+
+def fill_datetime_dicts(users: int) -> tuple:
+    """otp_store/rate_limit_store as dicts of dicts with datetime timestamps"""
+    otp_store, rate_limit_store = {}, {}
+    for i in range(users):
+        user_id = 100_000 + i
+        otp_store[user_id] = {'otp': otp(i), 'phone': phone(i), 'expiry': datetime.now() + timedelta(seconds=OTP_TTL)}
+        rate_limit_store[user_id] = {'otp_request': {'count': 1, 'timestamp': datetime.now()}}
+    return otp_store, rate_limit_store
+
+
+class DictRecords:
+    """Dict records with float deadlines, tuple phone owners and a heap entry per OTP and rate-limit key"""
+
+    def __init__(self):
+        self.expiry = ExpiryEngine()
+        self.limit = GcraLimit(3, 300, clock=self.expiry.clock)
+        self.otp_store = {}
+        self.phone_index = {}
+
+    def add(self, i: int) -> None:
+        user_id = 100_000 + i
+        number = phone(i)
+        self.phone_index[number] = (user_id, False)
+        self.otp_store[user_id] = {'otp': otp(i), 'phone': number, 'expiry': self.expiry.clock() + OTP_TTL}
+        self.expiry.schedule(('otp', user_id), OTP_TTL, self._evict_otp)
+        decision = self.limit.hit(user_id)
+        self.expiry.schedule(('rate', 'otp_request', user_id), decision.reset_after, self._evict_rate_limit)
+
+    def _evict_otp(self, key) -> bool:
+        return self.otp_store.pop(key[1], None) is not None
+
+    def _evict_rate_limit(self, key) -> bool:
+        return self.limit.expire(key[2])
+
+
+def fill_dict_records(users: int) -> DictRecords:
+    state = DictRecords()
+    for i in range(users):
+        state.add(i)
+    return state
+
+
+def fill_compact(users: int) -> InMemoryStateBackend:
+    state = InMemoryStateBackend(load_limits_from_env())
+
+    async def fill() -> None:
+        for i in range(users):
+            user_id = 100_000 + i
+            await state.store_otp(user_id, phone(i), otp(i), OTP_TTL)
+            await state.rate_limit('otp_request', user_id)
+
+    asyncio.run(fill())
+    return state
+
+
+def measure(fill, users: int) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    state = fill(users)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del state
+    return size, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+    layouts = [
+        ("datetime dicts", fill_datetime_dicts),
+        ("dict records", fill_dict_records),
+        ("compact", fill_compact),
+    ]
+    print(f"{args.users} pending verifications (fill time includes tracemalloc overhead)")
+    print(f"{'layout':<16}{'total MB':>10}{'bytes/user':>12}{'fill':>9}")
+    for name, fill in layouts:
+        size, elapsed = measure(fill, args.users)
+        print(f"{name:<16}{size / 1024 / 1024:>10.1f}{size / args.users:>12.0f}{elapsed:>8.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure snapshot and warm-start times of the in-memory state backend
+
+Fills a backend with N pending verifications (OTP, claimed phone and one
+rate-limit hit each), writes a snapshot, appends a few seconds' worth of
+journal records, then starts a fresh backend from the files. Reports the
+time the snapshot holds the event loop, the total snapshot time, the
+restore time and the cost of the first lookups of restored users.
+
+    python -m benchmarks.warm_start --users 1000000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from rate_limiter import load_limits_from_env
+from state_backend import InMemoryStateBackend
+
+
+async def run(users: int, journal_records: int, path: str) -> None:
+    limits = load_limits_from_env()
+    state = InMemoryStateBackend(limits, snapshot_path=path, snapshot_interval=3600)
+    await state.start()
+    started = time.perf_counter()
+    for i in range(users):
+        await state.store_otp(100_000 + i, f"+1555{i:07d}", f"{i % 1000000:06d}", 300)
+        await state.rate_limit('otp_request', 100_000 + i)
+    print(f"filled {users} users in {time.perf_counter() - started:.1f}s")
+
+    # How long other tasks wait while the snapshot runs
+    stalls = []
+
+    async def ticker() -> None:
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - tick)
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    size = await state.snapshot()
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    print(f"snapshot: {size / 1024 / 1024:.1f}MB in {elapsed * 1000:.0f}ms, "
+          f"longest event loop stall {max(stalls, default=0) * 1000:.1f}ms")
+
+    for i in range(journal_records):
+        await state.store_otp(10_000_000 + i, f"+1666{i:07d}", "123456", 300)
+    # Simulate a crash: the journal is fsync'd, nothing else is saved
+    state.journal.flush()
+    state.journal.close()
+    state.journal = None
+    await state.stop()
+
+    restored = InMemoryStateBackend(limits, snapshot_path=path)
+    started = time.perf_counter()
+    await restored.start()
+    restore_ms = (time.perf_counter() - started) * 1000
+    stats = await restored.stats()
+    print(f"warm start: {restore_ms:.1f}ms for {stats['otp_store']} OTPs, {stats['phone_index']} phones, "
+          f"{stats['rate_limiter']} rate limits ({journal_records} journal records)")
+
+    samples = min(users, 10000)
+    started = time.perf_counter()
+    for i in range(samples):
+        await restored.verify_otp(100_000 + i * (users // samples), "000000")
+    print(f"first lookup of a restored user: {(time.perf_counter() - started) / samples * 1e6:.2f}us")
+    restored.journal.close()
+    restored.journal = None
+    await restored.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--journal-records", type=int, default=5000,
+                        help="OTPs stored after the snapshot, replayed from the journal")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args.users, args.journal_records, os.path.join(tmp, "state.snap")))
+
+
+if __name__ == "__main__":
+    main()
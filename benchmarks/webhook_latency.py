@@ -0,0 +1,120 @@
+"""Measure end-to-end webhook handling latency against a local Bot API stand-in
+
+Starts the bot's Application in webhook mode on localhost with a fake Telegram
+transport, POSTs synthetic updates and times each one from the POST until the
+bot's reply reaches the transport.
+
+    python -m benchmarks.webhook_latency --updates 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+SECRET = "benchmark-secret"
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def configure(tmp: str, telegram_limits: bool) -> None:
+    """Environment for the bot module; must run before it is imported"""
+    os.environ.setdefault("SMS_GATEWAY", "fake")
+    os.environ.setdefault("PERSISTENCE_PATH", "")
+    os.environ.setdefault("STATE_SNAPSHOT_PATH", "")
+    os.environ.setdefault("METRICS_PATH", "")
+    os.environ["LEDGER_PATH"] = os.path.join(tmp, "ledger.db")
+    os.environ.setdefault("LOG_PATH", os.path.join(tmp, "bot.log"))
+    if not telegram_limits:
+        # Measure the bot, not the flood limits it deliberately stays under
+        os.environ["OUTBOUND_MAX_PER_SECOND"] = "1000000"
+        os.environ["OUTBOUND_MAX_PER_CHAT"] = "1000000"
+
+
+async def run(updates: int, concurrency: int, port: int, text: str) -> None:
+    import bot
+    from benchmarks.fake_telegram import FakeTelegramRequest, make_message_update
+
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def on_call(method: str, params: dict, timestamp: float) -> None:
+        if method == 'sendMessage' and params.get('chat_id') in sent_at:
+            latencies.append(timestamp - sent_at.pop(params['chat_id']))
+            if len(latencies) == updates:
+                done.set()
+
+    application = bot.build_application(token="123456:BENCHMARK", request=FakeTelegramRequest(on_call))
+    await application.initialize()
+    await bot.post_init(application)
+    await application.updater.start_webhook(
+        listen="127.0.0.1",
+        port=port,
+        url_path="telegram",
+        webhook_url=f"http://127.0.0.1:{port}/telegram",
+        secret_token=SECRET,
+        allowed_updates=bot.get_allowed_updates(application)
+    )
+    await application.start()
+
+    url = f"http://127.0.0.1:{port}/telegram"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    limits = httpx.Limits(max_keepalive_connections=concurrency, max_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(limits=limits) as client:
+            rejected = await client.post(url, json=make_message_update(0, 1, text), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            print(f"Wrong secret token -> HTTP {rejected.status_code}")
+
+            semaphore = asyncio.Semaphore(concurrency)
+            ack_times = []
+
+            async def post(i: int) -> None:
+                user_id = 10_000 + i
+                async with semaphore:
+                    posted = sent_at[user_id] = time.perf_counter()
+                    response = await client.post(url, json=make_message_update(i + 1, user_id, text), headers=headers)
+                    ack_times.append(time.perf_counter() - posted)
+                    response.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(i) for i in range(updates)))
+            await asyncio.wait_for(done.wait(), timeout=60)
+            elapsed = time.perf_counter() - started
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+
+    print(f"{updates} updates in {elapsed:.2f}s ({updates / elapsed:.0f} updates/s)")
+    print(f"ack latency   p50={statistics.median(ack_times) * 1000:.2f}ms p99={percentile(ack_times, 99) * 1000:.2f}ms")
+    print(
+        f"reply latency p50={statistics.median(latencies) * 1000:.2f}ms "
+        f"p95={percentile(latencies, 95) * 1000:.2f}ms p99={percentile(latencies, 99) * 1000:.2f}ms "
+        f"max={max(latencies) * 1000:.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--text", default="/help", help="message text sent by each synthetic user")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep the outbound flood-limit throttling from the environment")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(tmp, args.telegram_limits)
+        asyncio.run(run(args.updates, args.concurrency, args.port, args.text))
+
+
+if __name__ == "__main__":
+    main()
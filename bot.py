@@ -1,14 +1,30 @@
+import asyncio
+import itertools
 import logging
 import random
-import json
-import hmac
-import hashlib
+import signal
 import os
-from datetime import datetime, timedelta
-from telegram import WebAppInfo, Chat, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
-from twilio.rest import Client
 from dotenv import load_dotenv
+from sms import FailoverSmsGateway, FakeSmsGateway, HttpSmsGateway, SmsDispatcher, TwilioSmsGateway
+from rate_limiter import load_limits_from_env
+from state_backend import create_state_backend
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from ledger import TRANSFER_STATUSES, Ledger
+from logging_setup import setup_logging
+from router import CallbackRouter
+from outbound import OutboundScheduler, PRIORITY_HIGH
+from metrics import MetricsWriter
+from tracing import Tracer, SamplingProfiler, take_profile_request
+from worker_channel import WorkerChannel
+from ingress import Ingress, serve_shard
+import phone_numbers
+import screens
 
 # Load environment variables
 load_dotenv()
@@ -16,26 +32,128 @@ load_dotenv()
 # Deploy token for webapp validation
 deploy_token = os.getenv("TELEGRAM_TOKEN", "f396a67a498f2ac86deff58f4871452a3517115ee8bdafcb275aafccc597e2c5")
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
-    level=logging.INFO,
-    filename='bot.log'
+# Set for shard workers started by the ingress (BOT_SHARDS > 1)
+BOT_SHARD_ID = os.getenv("BOT_SHARD_ID")
+
+# Enable logging: JSON lines written and rotated on a background thread
+setup_logging(
+    os.getenv("LOG_PATH", "bot.log"),
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "10")),
+    rotate_interval=float(os.getenv("LOG_ROTATE_HOURS", "24")) * 3600,
+    # Shards append to the same file; only the ingress rotates it
+    rotate=BOT_SHARD_ID is None
 )
 logger = logging.getLogger(__name__)
 
-# Store OTPs and rate limiting data
-otp_store = {}
-rate_limit_store = {}
+# OTPs, the phone uniqueness index and rate limits live in a shared state backend
+OTP_TTL_SECONDS = 300
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# The memory backend snapshots to this file (plus a journal) so restarts keep pending OTPs and rate limits
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", "bot_state.snap")
+if STATE_SNAPSHOT_PATH and BOT_SHARD_ID is not None:
+    STATE_SNAPSHOT_PATH = f"{STATE_SNAPSHOT_PATH}.shard{BOT_SHARD_ID}"
+state = create_state_backend(
+    STATE_BACKEND,
+    load_limits_from_env(),
+    algorithm=os.getenv("RATE_LIMIT_ALGORITHM", "gcra"),
+    redis_url=REDIS_URL,
+    snapshot_path=STATE_SNAPSHOT_PATH or None,
+    snapshot_interval=float(os.getenv("STATE_SNAPSHOT_INTERVAL", "60"))
+)
 
 # Load configuration
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://bfcd0268e6.tapps.global/latest")
-
-# Initialize Twilio client
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "bot_state.db")
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "10"))
+LEDGER_PATH = os.getenv("LEDGER_PATH", "ledger.db")
+LEDGER_CACHE_SIZE = int(os.getenv("LEDGER_CACHE_SIZE", "10000"))
+PAYMENT_REQUEST_TTL = float(os.getenv("PAYMENT_REQUEST_TTL_HOURS", "168")) * 3600
+MAX_TRANSFER_AMOUNT = Decimal(os.getenv("MAX_TRANSFER_AMOUNT", "1000"))
+OPENING_BALANCE = Decimal(os.getenv("OPENING_BALANCE", "1000"))
+SMS_GATEWAY = os.getenv("SMS_GATEWAY", "twilio")
+SMS_CONCURRENCY = int(os.getenv("SMS_CONCURRENCY", "8"))
+SMS_MAX_RETRIES = int(os.getenv("SMS_MAX_RETRIES", "2"))
+SMS_PROVIDERS = [name.strip() for name in (os.getenv("SMS_PROVIDERS") or SMS_GATEWAY).split(",") if name.strip()]
+SMS_HTTP_URL = os.getenv("SMS_HTTP_URL", "")
+SMS_HTTP_TOKEN = os.getenv("SMS_HTTP_TOKEN", "")
+SMS_HTTP_FROM = os.getenv("SMS_HTTP_FROM", "")
+SMS_HEDGE = os.getenv("SMS_HEDGE", "true").lower() == "true"
+SMS_HEDGE_MAX_DELAY = float(os.getenv("SMS_HEDGE_MAX_DELAY", "5"))
+OUTBOUND_MAX_PER_SECOND = int(os.getenv("OUTBOUND_MAX_PER_SECOND", "30"))
+OUTBOUND_MAX_PER_CHAT = float(os.getenv("OUTBOUND_MAX_PER_CHAT", "1"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+METRICS_PATH = os.getenv("METRICS_PATH", "bot_metrics.bin")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))
+ACTIVE_SESSION_WINDOW = 15 * 60
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+HEARTBEAT_INTERVAL = 5
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", "1"))
+if BOT_SHARD_ID is not None:
+    # Shards share Telegram's global flood limit and each write their own metrics file
+    OUTBOUND_MAX_PER_SECOND = max(1, OUTBOUND_MAX_PER_SECOND // BOT_SHARDS)
+    if METRICS_PATH:
+        METRICS_PATH = f"{METRICS_PATH}.shard{BOT_SHARD_ID}"
+
+def build_sms_gateway():
+    """Create the SMS providers listed in SMS_PROVIDERS, in priority order, behind failover and hedging"""
+    providers = []
+    for name in SMS_PROVIDERS:
+        if name == "fake":
+            logger.warning("Using fake SMS gateway, no messages will be delivered")
+            providers.append(FakeSmsGateway())
+        elif name == "twilio":
+            providers.append(TwilioSmsGateway(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER))
+        elif name == "http":
+            providers.append(HttpSmsGateway(SMS_HTTP_URL, SMS_HTTP_TOKEN, SMS_HTTP_FROM))
+        else:
+            raise ValueError(f"Unknown SMS provider: {name}")
+    return FailoverSmsGateway(providers, hedge=SMS_HEDGE, hedge_max=SMS_HEDGE_MAX_DELAY)
+
+# Balances and transfers, amounts in cents
+ledger = Ledger(LEDGER_PATH, opening_balance=int(OPENING_BALANCE * 100), cache_size=LEDGER_CACHE_SIZE)
+HISTORY_PAGE_SIZE = 5
+
+# Inline button callbacks, dispatched by the prefix of their data
+router = CallbackRouter()
+
+# Counters and gauges in shared memory, read by the dashboard and /metrics
+metrics = MetricsWriter(METRICS_PATH)
+# Per-event counters over their fixed label values, registered once so handlers only do a store
+OTP_SMS_COUNTERS = {result: metrics.counter('b8nkr_otp_sms_total', result=result)
+                    for result in ('sent', 'failed', 'rejected')}
+OTP_VERIFY_COUNTERS = {result: metrics.counter('b8nkr_otp_verify_total', result=result)
+                       for result in ('ok', 'invalid', 'rate_limited')}
+TRANSFER_COUNTERS = {(kind, status): metrics.counter('b8nkr_transfers_total', type=kind, status=status)
+                     for kind in ('send', 'request', 'pay', 'decline') for status in TRANSFER_STATUSES}
+
+# Latency spans per handler, Bot API call and SMS send; profiling runs only when requested
+tracer = Tracer() if TRACING_ENABLED else None
+profiler = SamplingProfiler(PROFILE_DIR)
+
+# Set when started by the dashboard's supervisor
+worker_channel = WorkerChannel.from_env()
+
+# SMS delivery runs on a worker pool so handlers never wait on the provider
+sms_dispatcher = SmsDispatcher(
+    build_sms_gateway(),
+    concurrency=SMS_CONCURRENCY,
+    max_retries=SMS_MAX_RETRIES,
+    tracer=tracer
+)
 
 def generate_otp() -> str:
     """Generate a secure 6-digit OTP using cryptographic random"""
@@ -47,10 +165,8 @@ def generate_otp() -> str:
         return ''.join([str(random.randint(0, 9)) for _ in range(6)])
 
 def is_valid_phone_number(phone: str) -> bool:
-    """Validate phone number format"""
-    import re
-    pattern = r'^\+[1-9]\d{6,14}$'
-    return bool(re.match(pattern, phone))
+    """Validate phone number against the lengths allowed for its country calling code"""
+    return phone_numbers.is_valid(phone)
 
 def format_phone_number(phone: str) -> str:
     """Format phone number for display (hide middle digits)"""
@@ -58,126 +174,150 @@ def format_phone_number(phone: str) -> str:
         return phone
     return f"{phone[:3]}{'*' * (len(phone) - 6)}{phone[-3:]}"
 
-def check_rate_limit(user_id: int, action: str) -> bool:
-    """Check if user has exceeded rate limit"""
-    current_time = datetime.now()
-    user_limits = rate_limit_store.get(user_id, {})
-    
-    limits = {
-        'otp_request': {'count': 3, 'window': 300},  # 3 requests per 5 minutes
-        'otp_verify': {'count': 5, 'window': 300},   # 5 attempts per 5 minutes
-    }
-    
-    if action not in limits:
-        return True
-        
-    user_limits = {
-        k: v for k, v in user_limits.items()
-        if (current_time - v['timestamp']).total_seconds() < limits[k]['window']
-    }
-    
-    action_data = user_limits.get(action, {'count': 0, 'timestamp': current_time})
-    if action_data['count'] >= limits[action]['count']:
-        return False
-        
-    action_data['count'] += 1
-    action_data['timestamp'] = current_time
-    user_limits[action] = action_data
-    rate_limit_store[user_id] = user_limits
-    
-    return True
-
-def store_otp(user_id: int, phone_number: str, otp: str):
-    """Store OTP with 5-minute expiry"""
-    expiry_time = datetime.now() + timedelta(minutes=5)
-    otp_store[user_id] = {
-        'otp': otp,
-        'phone': phone_number,
-        'expiry': expiry_time
-    }
-
-def verify_otp(user_id: int, otp: str) -> bool:
+def parse_amount(text: str):
+    """Parse a user-entered dollar amount into cents, or None if invalid"""
+    try:
+        amount = Decimal(text.strip().lstrip('$').replace(',', ''))
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or amount <= 0 or amount != amount.quantize(Decimal('0.01')):
+        return None
+    return int(amount * 100)
+
+def format_amount(cents: int) -> str:
+    """Format cents for display"""
+    return f"${cents / 100:,.2f}"
+
+def normalize_phone_number(phone: str) -> str:
+    """Normalize phone number to E.164, the key used by the phone index and the ledger (invalid input is only stripped)"""
+    return phone_numbers.normalize(phone) or phone.strip()
+
+async def is_phone_taken(phone: str, user_id: int) -> bool:
+    """Check in O(1) whether another user holds this phone number"""
+    owner = await state.get_phone_owner(normalize_phone_number(phone))
+    return owner is not None and owner[0] != user_id
+
+async def check_rate_limit(user_id: int, action: str):
+    """Consume one hit of the action's rate limit; the decision carries remaining and retry_after"""
+    return await state.rate_limit(action, user_id)
+
+def format_retry_after(seconds: float) -> str:
+    """Format a retry-after delay for users"""
+    seconds = int(seconds) + 1
+    if seconds < 60:
+        return f"{seconds} seconds"
+    return f"{(seconds + 59) // 60} minutes"
+
+async def get_state_metrics() -> dict:
+    """Store sizes and backend counters"""
+    return await state.stats()
+
+async def store_otp(user_id: int, phone_number: str, otp: str) -> bool:
+    """Store OTP with 5-minute expiry; False if another user claimed the phone first"""
+    return await state.store_otp(user_id, normalize_phone_number(phone_number), otp, OTP_TTL_SECONDS)
+
+async def verify_otp(user_id: int, otp: str) -> bool:
     """Verify OTP and check if it's still valid"""
-    if user_id not in otp_store:
-        return False
-    
-    stored_data = otp_store[user_id]
-    if datetime.now() > stored_data['expiry']:
-        del otp_store[user_id]
-        return False
-    
-    if otp == stored_data['otp']:
-        del otp_store[user_id]
-        return True
-    return False
+    return await state.verify_otp(user_id, otp) is not None
+
+async def cancel_otp(user_id: int, otp: str) -> None:
+    """Drop an OTP that was never delivered, releasing the phone it claimed, unless a newer one replaced it"""
+    await state.cancel_otp(user_id, otp)
+
+def send_otp_sms(phone_number: str, otp: str, callback=None) -> bool:
+    """Queue OTP SMS for delivery; callback is awaited with the delivery outcome"""
+    return sms_dispatcher.submit(
+        phone_number,
+        f"Your B8NKR verification code is: {otp}",
+        callback
+    )
 
-def send_otp_sms(phone_number: str, otp: str):
-    """Send OTP via Twilio SMS"""
-    try:
-        message = twilio_client.messages.create(
-            to=phone_number,
-            from_=TWILIO_PHONE_NUMBER,
-            body=f"Your B8NKR verification code is: {otp}"
-        )
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send SMS: {str(e)}")
-        return False
+async def reply_high_priority(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, **kwargs):
+    """Reply ahead of menus and other queued outbound messages"""
+    return await context.bot.send_message(update.effective_chat.id, text, rate_limit_args=PRIORITY_HIGH, **kwargs)
 
 async def verify_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle phone number verification"""
     try:
         user_id = update.effective_user.id
         
-        if not check_rate_limit(user_id, 'otp_request'):
-            await update.message.reply_text(
+        decision = await check_rate_limit(user_id, 'otp_request')
+        if not decision.allowed:
+            await reply_high_priority(
+                update, context,
                 "⚠️ Too many OTP requests.\n"
-                "Please wait a few minutes before trying again."
+                f"Please wait {format_retry_after(decision.retry_after)} before trying again."
             )
             return
 
-        phone_number = update.message.text.strip()
+        phone_number = normalize_phone_number(update.message.text)
         
         if not is_valid_phone_number(phone_number):
-            await update.message.reply_text(
+            await reply_high_priority(
+                update, context,
                 "❌ Invalid phone number format!\n"
-                "Please provide your number in international format (e.g., +1234567890)"
+                "Please provide your number in international format (e.g., +14155552671)"
             )
             return
 
-        for stored_id, data in otp_store.items():
-            if stored_id != user_id and data.get('phone') == phone_number:
-                logger.warning(f"Phone number {format_phone_number(phone_number)} already in use")
-                await update.message.reply_text(
-                    "❌ This phone number is already in use.\n"
-                    "Please use a different number or contact support."
-                )
-                return
+        if await is_phone_taken(phone_number, user_id):
+            logger.warning("Phone number %s already in use", format_phone_number(phone_number))
+            await reply_high_priority(
+                update, context,
+                "❌ This phone number is already in use.\n"
+                "Please use a different number or contact support."
+            )
+            return
 
         otp = generate_otp()
-        store_otp(user_id, phone_number, otp)
-        
-        if send_otp_sms(phone_number, otp):
-            logger.info(f"OTP sent to {format_phone_number(phone_number)} for user {user_id}")
-            await update.message.reply_text(
-                f"✅ Verification code sent to {format_phone_number(phone_number)}!\n"
-                "Please enter the 6-digit code.\n"
-                "⏱️ You have 5 minutes to enter the code."
+        if not await store_otp(user_id, phone_number, otp):
+            logger.warning("Phone number %s claimed concurrently", format_phone_number(phone_number))
+            await reply_high_priority(
+                update, context,
+                "❌ This phone number is already in use.\n"
+                "Please use a different number or contact support."
             )
+            return
+        chat_id = update.effective_chat.id
+
+        async def on_sms_sent(success: bool) -> None:
+            OTP_SMS_COUNTERS['sent' if success else 'failed'].inc()
+            if success:
+                logger.info("OTP sent to %s for user %s", format_phone_number(phone_number), user_id)
+                await context.bot.send_message(
+                    chat_id,
+                    f"✅ Verification code sent to {format_phone_number(phone_number)}!\n"
+                    "Please enter the 6-digit code.\n"
+                    "⏱️ You have 5 minutes to enter the code.",
+                    rate_limit_args=PRIORITY_HIGH
+                )
+            else:
+                logger.error("Failed to send OTP to %s", format_phone_number(phone_number))
+                # Runs outside the user's update ordering, so user_data is left alone: a code
+                # typed now fails verification because the OTP is gone
+                await cancel_otp(user_id, otp)
+                await context.bot.send_message(
+                    chat_id,
+                    "❌ Failed to send verification code.\n"
+                    "Please check the number and try again later.",
+                    rate_limit_args=PRIORITY_HIGH
+                )
+
+        if send_otp_sms(phone_number, otp, on_sms_sent):
             context.user_data['awaiting_otp'] = True
             context.user_data['phone_number'] = phone_number
         else:
-            logger.error(f"Failed to send OTP to {format_phone_number(phone_number)}")
-            await update.message.reply_text(
+            logger.error("SMS queue unavailable for %s", format_phone_number(phone_number))
+            OTP_SMS_COUNTERS['rejected'].inc()
+            await cancel_otp(user_id, otp)
+            await reply_high_priority(
+                update, context,
                 "❌ Failed to send verification code.\n"
                 "Please check the number and try again later."
             )
     except Exception as e:
-        logger.error(f"Error in verify_phone for user {user_id}: {str(e)}")
-        await update.message.reply_text(
-            "❌ An error occurred.\n"
-            "Please try again or contact support if the problem persists."
-        )
+        logger.error("Error in verify_phone for user %s: %s", user_id, e)
+        await reply_high_priority(update, context, screens.ERROR_TEXT)
 
 async def verify_otp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle OTP verification"""
@@ -186,226 +326,294 @@ async def verify_otp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         phone_number = context.user_data.get('phone_number')
         
         if not phone_number:
-            logger.error(f"No phone number found for user {user_id}")
-            await update.message.reply_text(
+            logger.error("No phone number found for user %s", user_id)
+            await reply_high_priority(
+                update, context,
                 "❌ Session expired.\n"
                 "Please start over with /start"
             )
             context.user_data['awaiting_otp'] = False
             return
         
-        if not check_rate_limit(user_id, 'otp_verify'):
-            await update.message.reply_text(
+        decision = await check_rate_limit(user_id, 'otp_verify')
+        if not decision.allowed:
+            OTP_VERIFY_COUNTERS['rate_limited'].inc()
+            await reply_high_priority(
+                update, context,
                 "⚠️ Too many verification attempts.\n"
-                "Please wait a few minutes before trying again."
+                f"Please wait {format_retry_after(decision.retry_after)} before trying again."
             )
             return
 
         user_otp = update.message.text.strip()
         
         if not user_otp.isdigit() or len(user_otp) != 6:
-            await update.message.reply_text(
+            await reply_high_priority(
+                update, context,
                 "❌ Invalid code format!\n"
                 "Please enter the 6-digit code sent to your phone."
             )
             return
         
-        if verify_otp(user_id, user_otp):
-            logger.info(f"OTP verified successfully for {format_phone_number(phone_number)}")
+        if await verify_otp(user_id, user_otp):
+            OTP_VERIFY_COUNTERS['ok'].inc()
+            logger.info("OTP verified successfully for %s", format_phone_number(phone_number))
             context.user_data['verified'] = True
             context.user_data['awaiting_otp'] = False
             context.user_data['verified_phone'] = phone_number
+            await ledger.open_account(normalize_phone_number(phone_number))
             
-            keyboard = [
-                [InlineKeyboardButton("👤 My Profile", callback_data="profile")],
-                [InlineKeyboardButton("💰 Check Balance", callback_data="balance")],
-                [InlineKeyboardButton("📤 Transfer Money", callback_data="transfer")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
+            await reply_high_priority(
+                update, context,
                 f"✅ Success! Phone number {format_phone_number(phone_number)} verified.\n\n"
                 "🎉 Welcome to B8NKR! You now have full access to all features.\n"
                 "What would you like to do?",
-                reply_markup=reply_markup,
+                reply_markup=screens.MAIN_MENU_KEYBOARD,
                 parse_mode='Markdown'
             )
         else:
-            remaining_attempts = 5 - len([
-                action for action, data in rate_limit_store.get(user_id, {}).items()
-                if action == 'otp_verify'
-            ])
+            OTP_VERIFY_COUNTERS['invalid'].inc()
+            remaining_attempts = decision.remaining
             
-            logger.warning(f"Invalid OTP attempt from user {user_id} ({remaining_attempts} attempts remaining)")
-            await update.message.reply_text(
+            logger.warning("Invalid OTP attempt from user %s (%s attempts remaining)", user_id, remaining_attempts)
+            await reply_high_priority(
+                update, context,
                 "❌ Invalid or expired verification code.\n"
                 f"You have {remaining_attempts} attempts remaining.\n\n"
                 "Please try again or use /start to request a new code."
             )
     except Exception as e:
-        logger.error(f"Error in verify_otp_handler for user {user_id}: {str(e)}")
-        await update.message.reply_text(
-            "❌ An error occurred.\n"
-            "Please try again or contact support if the problem persists."
-        )
+        logger.error("Error in verify_otp_handler for user %s: %s", user_id, e)
+        await reply_high_priority(update, context, screens.ERROR_TEXT)
+
+async def respond(update: Update, text: str, reply_markup=None, parse_mode=None) -> None:
+    """Show a screen: edit the message in place for callbacks, reply for commands"""
+    query = update.callback_query
+    if query is None:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        return
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except BadRequest as e:
+        # Pressing a button that leads to the screen already shown
+        if "not modified" not in str(e):
+            raise
+
+async def require_verified(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Tell unverified users to verify first; True if the user is verified"""
+    if context.user_data.get('verified', False):
+        return True
+    await respond(update, screens.NOT_VERIFIED_TEXT)
+    return False
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Start the bot and show authentication options"""
-    user_id = update.effective_user.id
-    
     if context.user_data.get('verified', False):
-        keyboard = [
-            [InlineKeyboardButton("👤 My Profile", callback_data="profile")],
-            [InlineKeyboardButton("💰 Check Balance", callback_data="balance")],
-            [InlineKeyboardButton("📤 Transfer Money", callback_data="transfer")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"👋 Welcome back!\n\n"
-            "🏦 *B8NKR Main Menu*\n"
-            "What would you like to do?",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+        await respond(update, screens.WELCOME_BACK_TEXT, screens.MAIN_MENU_KEYBOARD, 'Markdown')
         return
-
-    keyboard = [
-        [InlineKeyboardButton("📱 Verify Phone Number", callback_data="verify_phone")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        "🎉 *Welcome to B8NKR!*\n\n"
-        "To get started, please verify your identity:\n\n"
-        "1️⃣ Click the button below to verify your phone number\n\n"
-        "💡 Your security is our priority.",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    await respond(update, screens.WELCOME_TEXT, screens.VERIFY_KEYBOARD, 'Markdown')
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show help information"""
-    await update.message.reply_text(
-        "🔍 *Available Commands*\n\n"
-        "/start - Begin verification process\n"
-        "/menu - Show main menu\n"
-        "/profile - View your profile\n"
-        "/balance - Check your balance\n"
-        "/transfer - Send or request money\n"
-        "/history - View transaction history\n"
-        "/cancel - Cancel current operation\n"
-        "/help - Show this help message\n\n"
-        "💡 *Tips*:\n"
-        "• Keep your phone number up to date\n"
-        "• Never share your OTP with anyone\n"
-        "• Contact support if you notice suspicious activity",
-        parse_mode='Markdown'
-    )
+    await respond(update, screens.HELP_TEXT, parse_mode='Markdown')
+
+@router.route("verify_phone")
+async def verify_phone_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Ask for the phone number to verify"""
+    # Sent as a new message so the verify button stays available
+    await update.effective_message.reply_text(screens.ENTER_PHONE_TEXT)
+    context.user_data['awaiting_phone'] = True
 
-async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+@router.route("balance")
+async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
     """Show user balance"""
-    if not context.user_data.get('verified', False):
-        await update.message.reply_text(
-            "⚠️ Please verify your phone number first!\n"
-            "Use /start to begin verification."
-        )
+    if not await require_verified(update, context):
         return
 
-    balance = 1000.00  # Mock balance
+    account = await ledger.open_account(normalize_phone_number(context.user_data['verified_phone']))
 
-    await update.message.reply_text(
-        f"💰 Your current balance is: `${balance:,.2f}`",
-        parse_mode='Markdown'
+    await respond(
+        update,
+        f"💰 Your current balance is: `{format_amount(account.balance)}`",
+        screens.BACK_TO_MENU_KEYBOARD if update.callback_query else None,
+        'Markdown'
     )
 
-async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+@router.route("profile")
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
     """Show user profile and transaction summary"""
-    if not context.user_data.get('verified', False):
-        await update.message.reply_text(
-            "⚠️ Please verify your phone number first!\n"
-            "Use /start to begin verification."
-        )
+    if not await require_verified(update, context):
         return
 
     phone = context.user_data.get('verified_phone', 'Unknown')
     
-    profile_data = {
-        'balance': 1000.00,
-        'total_sent': 250.00,
-        'total_received': 150.00,
-        'pending_requests': 1,
-        'join_date': '2024-01-01',
-        'last_transfer': '2024-01-15'
-    }
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📊 Transaction History", callback_data="transfer_history"),
-            InlineKeyboardButton("✏️ Edit Profile", callback_data="edit_profile")
-        ],
-        [InlineKeyboardButton("« Back to Menu", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    profile_data = await ledger.get_profile(normalize_phone_number(phone))
+    if profile_data is None:
+        # Verified before the ledger existed
+        await ledger.open_account(normalize_phone_number(phone))
+        profile_data = await ledger.get_profile(normalize_phone_number(phone))
+    join_date = datetime.fromtimestamp(profile_data['join_date']).strftime('%Y-%m-%d')
+    last_transfer = (
+        datetime.fromtimestamp(profile_data['last_transfer']).strftime('%Y-%m-%d')
+        if profile_data['last_transfer'] else "Never"
+    )
     
-    await update.message.reply_text(
+    await respond(
+        update,
         "👤 *Your Profile*\n\n"
         f"📱 Phone: `{format_phone_number(phone)}`\n"
-        f"💰 Balance: `${profile_data['balance']:,.2f}`\n"
-        f"📅 Member since: {profile_data['join_date']}\n\n"
+        f"💰 Balance: `{format_amount(profile_data['balance'])}`\n"
+        f"📅 Member since: {join_date}\n\n"
         "*Transaction Summary*\n"
-        f"📤 Total Sent: `${profile_data['total_sent']:,.2f}`\n"
-        f"📥 Total Received: `${profile_data['total_received']:,.2f}`\n"
+        f"📤 Total Sent: `{format_amount(profile_data['total_sent'])}`\n"
+        f"📥 Total Received: `{format_amount(profile_data['total_received'])}`\n"
         f"⏳ Pending Requests: {profile_data['pending_requests']}\n"
-        f"🕒 Last Transfer: {profile_data['last_transfer']}\n\n"
+        f"🕒 Last Transfer: {last_transfer}\n\n"
         "Select an option below:",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
+        screens.PROFILE_KEYBOARD,
+        'Markdown'
     )
 
-async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Show main menu"""
-    if not context.user_data.get('verified', False):
-        await update.message.reply_text(
-            "⚠️ Please verify your phone number first!\n"
-            "Use /start to begin verification."
-        )
+async def render_requests(phone: str):
+    """Build the text and pay/decline keyboard for the oldest pending requests"""
+    requests = await ledger.pending_requests(phone, HISTORY_PAGE_SIZE)
+    if not requests:
+        return "⏳ *Pending Requests*\n\nNo one is waiting for a payment from you.", screens.BACK_TO_MENU_KEYBOARD
+    lines, buttons = [], []
+    for request in requests:
+        when = datetime.fromtimestamp(request.created_at).strftime('%Y-%m-%d %H:%M')
+        lines.append(f"📥 {when} `{format_phone_number(request.requester)}` asks for `{format_amount(request.amount)}`")
+        buttons.append([
+            InlineKeyboardButton(f"✅ Pay {format_amount(request.amount)}", callback_data=f"req_pay:{request.tx_id}"),
+            InlineKeyboardButton("❌ Decline", callback_data=f"req_decline:{request.tx_id}")
+        ])
+    buttons.append([screens.BACK_TO_MENU_BUTTON])
+    return "⏳ *Pending Requests*\n\n" + "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+@router.route("requests")
+async def requests_command(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Show the money requests waiting for this user to pay or decline"""
+    if not await require_verified(update, context):
+        return
+    text, reply_markup = await render_requests(normalize_phone_number(context.user_data['verified_phone']))
+    await respond(update, text, reply_markup, 'Markdown')
+
+@router.route("req_pay", "req_decline")
+async def settle_request(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Pay or decline a pending request, then show the remaining ones"""
+    if not await require_verified(update, context):
+        return
+    own_phone = normalize_phone_number(context.user_data['verified_phone'])
+    pay = update.callback_query.data.startswith("req_pay:")
+    try:
+        request_id = int(payload)
+    except ValueError:
+        return
+    if pay:
+        result = await ledger.pay_request(own_phone, request_id)
+    else:
+        result = await ledger.decline_request(own_phone, request_id)
+    TRANSFER_COUNTERS['pay' if pay else 'decline', result.status].inc()
+
+    if result.ok:
+        logger.info("Request %s %s by %s", request_id, "paid" if pay else "declined", format_phone_number(own_phone))
+        notice = "✅ Request paid." if pay else "✅ Request declined."
+    elif result.status == 'insufficient_funds':
+        notice = f"❌ Insufficient funds.\n💰 Your balance is `{format_amount(result.balance)}`."
+    else:
+        notice = "ℹ️ That request is no longer pending."
+    text, reply_markup = await render_requests(own_phone)
+    await respond(update, f"{notice}\n\n{text}", reply_markup, 'Markdown')
+
+def encode_history_cursor(newer: bool, cursor: tuple) -> str:
+    """Encode a history keyset cursor as callback data (well under Telegram's 64 bytes)"""
+    return f"hist:{'n' if newer else 'o'}:{cursor[0]!r}:{cursor[1]}"
+
+def decode_history_cursor(payload: str):
+    """Decode the payload of a `hist:` route into (newer, cursor), or None"""
+    try:
+        direction, created_at, entry_id = payload.split(':')
+        return direction == 'n', (float(created_at), int(entry_id))
+    except ValueError:
+        return None
+
+async def render_history(phone: str, cursor=None, newer: bool = False):
+    """Build the text and paging keyboard for one page of history"""
+    page = await ledger.get_history(phone, HISTORY_PAGE_SIZE, cursor, newer)
+    if not page.entries:
+        text = "📊 *Transaction History*\n\nNo transactions yet."
+    else:
+        lines = []
+        for entry in page.entries:
+            when = datetime.fromtimestamp(entry.created_at).strftime('%Y-%m-%d %H:%M')
+            if entry.kind == 'opening':
+                lines.append(f"🏦 {when} Opening balance `{format_amount(entry.amount)}`")
+            elif entry.amount < 0:
+                lines.append(f"📤 {when} To `{format_phone_number(entry.counterparty)}` `-{format_amount(-entry.amount)}`")
+            else:
+                lines.append(f"📥 {when} From `{format_phone_number(entry.counterparty)}` `+{format_amount(entry.amount)}`")
+        text = "📊 *Transaction History*\n\n" + "\n".join(lines)
+
+    paging = []
+    if page.newer:
+        paging.append(InlineKeyboardButton("« Newer", callback_data=encode_history_cursor(True, page.newer)))
+    if page.older:
+        paging.append(InlineKeyboardButton("Older »", callback_data=encode_history_cursor(False, page.older)))
+    if not paging:
+        return text, screens.BACK_TO_MENU_KEYBOARD
+    return text, InlineKeyboardMarkup([paging, [screens.BACK_TO_MENU_BUTTON]])
+
+@router.route("transfer_history", "hist")
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Show a page of transaction history; paging buttons edit the message in place"""
+    if not await require_verified(update, context):
         return
 
-    keyboard = [
-        [InlineKeyboardButton("👤 My Profile", callback_data="profile")],
-        [InlineKeyboardButton("💰 Check Balance", callback_data="balance")],
-        [InlineKeyboardButton("📤 Transfer Money", callback_data="transfer")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "🏦 *Welcome to B8NKR*\n"
-        "What would you like to do?",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
+    newer, cursor = False, None
+    decoded = decode_history_cursor(payload) if payload else None
+    if decoded:
+        newer, cursor = decoded
+    text, reply_markup = await render_history(
+        normalize_phone_number(context.user_data['verified_phone']), cursor, newer
     )
+    await respond(update, text, reply_markup, 'Markdown')
+
+@router.route("back_to_main")
+async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Show main menu"""
+    if not await require_verified(update, context):
+        return
+    await respond(update, screens.MENU_TEXT, screens.MAIN_MENU_KEYBOARD, 'Markdown')
 
-async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+@router.route("transfer")
+async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
     """Initiate money transfer process"""
-    if not context.user_data.get('verified', False):
-        await update.message.reply_text(
-            "⚠️ Please verify your phone number first!\n"
-            "Use /start to begin verification."
-        )
+    if not await require_verified(update, context):
         return
+    await respond(update, screens.TRANSFER_TEXT, screens.TRANSFER_KEYBOARD, 'Markdown')
 
-    keyboard = [
-        [InlineKeyboardButton("💸 Send Money", callback_data="send_money")],
-        [InlineKeyboardButton("📥 Request Money", callback_data="request_money")],
-        [InlineKeyboardButton("« Back to Menu", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "💸 *Transfer Money*\n\n"
-        "Choose an option:",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+@router.route("send_money")
+async def send_money(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Ask for the recipient of a transfer"""
+    if not await require_verified(update, context):
+        return
+    context.user_data['transfer_state'] = 'awaiting_recipient'
+    await respond(update, screens.ENTER_RECIPIENT_TEXT)
+
+@router.route("request_money")
+async def request_money(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Ask who a money request goes to"""
+    if not await require_verified(update, context):
+        return
+    context.user_data['transfer_state'] = 'awaiting_sender'
+    await respond(update, screens.ENTER_SENDER_TEXT)
+
+@router.route("transfer_cancel")
+async def cancel_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Drop the pending transfer"""
+    context.user_data.pop('transfer_state', None)
+    context.user_data.pop('transfer_data', None)
+    await respond(update, screens.TRANSFER_CANCELLED_TEXT)
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Cancel current operation"""
@@ -414,46 +622,131 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     context.user_data.pop('awaiting_phone', None)
     context.user_data.pop('awaiting_otp', None)
     
-    await update.message.reply_text(
-        "🔄 Current operation cancelled.\n"
-        "Type /menu to see available options."
-    )
+    await respond(update, screens.CANCELLED_TEXT)
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle button callbacks"""
-    query = update.callback_query
-    await query.answer()
+async def handle_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drive the transfer state machine: counterparty -> amount -> confirmation"""
+    if not context.user_data.get('verified', False):
+        context.user_data.pop('transfer_state', None)
+        await respond(update, screens.NOT_VERIFIED_TEXT)
+        return
 
-    if query.data == "verify_phone":
-        await query.message.reply_text(
-            "📱 Please send your phone number in international format\n"
-            "Example: +1234567890\n\n"
-            "ℹ️ Your number will only be used for verification."
-        )
-        context.user_data['awaiting_phone'] = True
-    elif query.data == "profile":
-        await profile_command(update, context)
-    elif query.data == "balance":
-        await balance_command(update, context)
-    elif query.data == "transfer":
-        await transfer_command(update, context)
-    elif query.data == "back_to_main":
-        await menu_command(update, context)
-    elif query.data == "send_money":
-        context.user_data['transfer_state'] = 'awaiting_recipient'
-        await query.message.edit_text(
-            "📱 Enter recipient's phone number:\n"
-            "Example: +1234567890\n\n"
+    transfer_state = context.user_data.get('transfer_state')
+    own_phone = normalize_phone_number(context.user_data['verified_phone'])
+    text = update.message.text.strip()
+
+    if transfer_state in ('awaiting_recipient', 'awaiting_sender'):
+        phone = normalize_phone_number(text)
+        if not is_valid_phone_number(phone):
+            await update.message.reply_text(
+                "❌ Invalid phone number format!\n"
+                "Please provide the number in international format (e.g., +14155552671)"
+            )
+            return
+        if phone == own_phone:
+            await update.message.reply_text(
+                "❌ You can't send money to or request money from yourself.\n"
+                "Please enter a different number or type /cancel."
+            )
+            return
+        if await ledger.get_account(phone) is None:
+            await update.message.reply_text(
+                f"❌ No B8NKR account found for {format_phone_number(phone)}.\n"
+                "Please check the number or type /cancel."
+            )
+            return
+        context.user_data['transfer_data'] = {
+            'type': 'send' if transfer_state == 'awaiting_recipient' else 'request',
+            'counterparty': phone
+        }
+        context.user_data['transfer_state'] = 'awaiting_amount'
+        await update.message.reply_text(
+            "💵 Enter the amount in dollars:\n"
+            f"Maximum per transaction: {format_amount(int(MAX_TRANSFER_AMOUNT * 100))}\n\n"
             "Type /cancel to cancel"
         )
-    elif query.data == "request_money":
-        context.user_data['transfer_state'] = 'awaiting_sender'
-        await query.message.edit_text(
-            "📱 Enter sender's phone number:\n"
-            "Example: +1234567890\n\n"
-            "Type /cancel to cancel"
+    elif transfer_state == 'awaiting_amount':
+        amount = parse_amount(text)
+        if amount is None:
+            await update.message.reply_text(
+                "❌ Invalid amount!\n"
+                "Please enter a positive amount, e.g. 25 or 25.50"
+            )
+            return
+        if amount > MAX_TRANSFER_AMOUNT * 100:
+            await update.message.reply_text(
+                f"❌ The maximum per transaction is {format_amount(int(MAX_TRANSFER_AMOUNT * 100))}.\n"
+                "Please enter a smaller amount."
+            )
+            return
+        transfer_data = context.user_data['transfer_data']
+        transfer_data['amount'] = amount
+        # Keyed by the update that fixed the amount so a replayed confirmation is applied once
+        transfer_data['key'] = f"{update.effective_user.id}:{update.update_id}"
+        context.user_data['transfer_state'] = 'awaiting_confirmation'
+
+        action = "Send" if transfer_data['type'] == 'send' else "Request"
+        direction = "to" if transfer_data['type'] == 'send' else "from"
+        await update.message.reply_text(
+            f"🧾 *Confirm {action}*\n\n"
+            f"{action} `{format_amount(amount)}` {direction} `{format_phone_number(transfer_data['counterparty'])}`?",
+            reply_markup=screens.CONFIRM_TRANSFER_KEYBOARD,
+            parse_mode='Markdown'
+        )
+    else:
+        await update.message.reply_text(
+            "⏳ Please confirm or cancel the pending transfer using the buttons above,\n"
+            "or type /cancel."
         )
 
+@router.route("transfer_confirm")
+async def confirm_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str = "") -> None:
+    """Post a confirmed transfer or money request to the ledger"""
+    transfer_data = context.user_data.get('transfer_data')
+    if context.user_data.get('transfer_state') != 'awaiting_confirmation' or not transfer_data:
+        await respond(
+            update,
+            "ℹ️ There is no pending transfer to confirm.\n"
+            "Type /transfer to start a new one."
+        )
+        return
+
+    own_phone = normalize_phone_number(context.user_data['verified_phone'])
+    counterparty = transfer_data['counterparty']
+    amount = transfer_data['amount']
+    if transfer_data['type'] == 'send':
+        result = await ledger.transfer(transfer_data['key'], own_phone, counterparty, amount)
+    else:
+        result = await ledger.request_payment(transfer_data['key'], own_phone, counterparty, amount)
+    context.user_data.pop('transfer_state', None)
+    context.user_data.pop('transfer_data', None)
+    TRANSFER_COUNTERS[transfer_data['type'], result.status].inc()
+
+    if result.ok:
+        logger.info(
+            "%s of %s between %s and %s (tx %s)", transfer_data['type'].capitalize(), format_amount(amount),
+            format_phone_number(own_phone), format_phone_number(counterparty), result.tx_id
+        )
+        if transfer_data['type'] == 'send':
+            text = (
+                f"✅ Sent `{format_amount(amount)}` to `{format_phone_number(counterparty)}`.\n"
+                f"💰 New balance: `{format_amount(result.balance)}`"
+            )
+        else:
+            text = f"✅ Requested `{format_amount(amount)}` from `{format_phone_number(counterparty)}`."
+    elif result.status == 'insufficient_funds':
+        text = (
+            "❌ Insufficient funds.\n"
+            f"💰 Your balance is `{format_amount(result.balance)}`."
+        )
+    else:
+        logger.warning("Transfer %s rejected: %s", transfer_data['key'], result.status)
+        text = (
+            "❌ The transfer could not be completed.\n"
+            "Please try again or contact support."
+        )
+    await respond(update, text, parse_mode='Markdown')
+
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle incoming messages"""
     try:
@@ -465,78 +758,245 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         elif context.user_data.get('transfer_state'):
             await handle_transfer(update, context)
         else:
-            await update.message.reply_text(
-                "❓ I don't understand that command.\n"
-                "Use /menu to see available options."
-            )
+            await update.message.reply_text(screens.UNKNOWN_MESSAGE_TEXT)
     except Exception as e:
-        logger.error(f"Error in message_handler: {str(e)}")
+        logger.error("Error in message_handler: %s", e)
         await update.message.reply_text(
             "❌ An error occurred processing your request.\n"
             "Please try again or use /menu to start over."
         )
 
 async def cleanup_expired_data(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Cleanup expired OTPs and rate limit data"""
+    """Fallback sweep for expired OTPs and rate limit data missed by the state backend"""
     try:
-        current_time = datetime.now()
-        
-        expired_otps = [
-            user_id for user_id, data in otp_store.items()
-            if current_time > data['expiry']
-        ]
-        for user_id in expired_otps:
-            del otp_store[user_id]
-            
-        expired_limits = []
-        for user_id, limits in rate_limit_store.items():
-            expired_actions = [
-                action for action, data in limits.items()
-                if (current_time - data['timestamp']).total_seconds() > 3600
-            ]
-            for action in expired_actions:
-                del limits[action]
-            if not limits:
-                expired_limits.append(user_id)
-                
-        for user_id in expired_limits:
-            del rate_limit_store[user_id]
+        expired_otps, expired_limits = await state.sweep()
             
-        logger.info(f"Cleanup: Removed {len(expired_otps)} expired OTPs and {len(expired_limits)} expired rate limits")
+        logger.info("Cleanup: Removed %d expired OTPs and %d expired rate limits", expired_otps, expired_limits)
+        if BOT_SHARD_ID in (None, "0"):
+            # The ledger is shared, so one shard expires requests
+            logger.info("Cleanup: Expired %d payment requests", await ledger.expire_requests(PAYMENT_REQUEST_TTL))
+        logger.info("State metrics: %s", await get_state_metrics())
+        logger.info("Update processor: %s", context.application.update_processor.stats())
+        outbound = context.bot.rate_limiter
+        outbound.purge()
+        logger.info("Outbound messages: %s", outbound.stats())
+        if isinstance(sms_dispatcher.gateway, FailoverSmsGateway):
+            logger.info("SMS providers: %s", sms_dispatcher.gateway.stats())
         
     except Exception as e:
-        logger.error(f"Error in cleanup task: {str(e)}")
+        logger.error("Error in cleanup task: %s", e)
+
+async def record_metrics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Refresh the gauges shown on the dashboard"""
+    try:
+        if BOT_SHARD_ID in (None, "0"):
+            # The ledger is shared, so one shard reports it
+            metrics.gauge('b8nkr_accounts').set(await ledger.count_accounts())
+        for name, value in (await get_state_metrics()).items():
+            if isinstance(value, int):
+                metrics.gauge('b8nkr_state_entries', store=name).set(value)
+            elif name == 'expiry':
+                metrics.gauge('b8nkr_expiry_scheduled').set(value['scheduled'])
+                for kind, count in value['evicted'].items():
+                    metrics.gauge('b8nkr_evictions_total', kind=kind).set(count)
+        processor = context.application.update_processor
+        processor.publish()
+        metrics.gauge('b8nkr_active_sessions').set(processor.active_users(ACTIVE_SESSION_WINDOW))
+        metrics.gauge('b8nkr_updates_queued').set(processor.queued)
+        metrics.gauge('b8nkr_updates_running').set(processor.running)
+        outbound = context.bot.rate_limiter.stats()
+        metrics.gauge('b8nkr_outbound_queued').set(outbound['queued'])
+        metrics.gauge('b8nkr_outbound_latency_p95_seconds').set(outbound['latency_p95'])
+        for (kind, route), span in (tracer.stats() if tracer else {}).items():
+            for quantile in ('p50', 'p95', 'p99'):
+                metrics.gauge('b8nkr_span_seconds', kind=kind, route=route, quantile=quantile).set(span[quantile])
+        if isinstance(sms_dispatcher.gateway, FailoverSmsGateway):
+            sms = sms_dispatcher.gateway.stats()
+            for name in ('hedged', 'failovers', 'deduplicated'):
+                metrics.gauge('b8nkr_sms_sends', kind=name).set(sms[name])
+            for name, health in sms['providers'].items():
+                metrics.gauge('b8nkr_sms_provider_sends', provider=name, result='sent').set(health['sent'])
+                metrics.gauge('b8nkr_sms_provider_sends', provider=name, result='failed').set(health['failed'])
+                metrics.gauge('b8nkr_sms_provider_open', provider=name).set(health['state'] != 'closed')
+                metrics.gauge('b8nkr_sms_provider_seconds', provider=name, quantile='p95').set(health['p95'])
+    except Exception as e:
+        logger.error("Error recording metrics: %s", e)
+
+async def check_profile_request(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Start a profiling window requested from the dashboard"""
+    duration = take_profile_request(PROFILE_DIR)
+    if duration and not profiler.start(duration):
+        logger.warning("Profile requested while one is already running")
+
+async def send_heartbeat(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Tell the supervisor the event loop is still responsive"""
+    worker_channel.send("heartbeat")
+
+async def post_init(application) -> None:
+    """Start background services once the event loop is running"""
+    await ledger.start()
+    await sms_dispatcher.start()
+    if worker_channel is not None:
+        # Runs before updates are fetched: a held worker waits here, warmed up
+        await worker_channel.ready()
+    # Only once released: until then the worker being replaced still owns the state and saves it on exit
+    await state.start()
+
+async def post_shutdown(application) -> None:
+    """Stop background services"""
+    await sms_dispatcher.stop()
+    await ledger.stop()
+    await state.stop()
+
+def get_allowed_updates(application) -> list:
+    """Update types consumed by the registered handlers, so Telegram sends nothing else"""
+    allowed = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CallbackQueryHandler):
+                allowed.add(Update.CALLBACK_QUERY)
+            elif isinstance(handler, (CommandHandler, MessageHandler)):
+                allowed.add(Update.MESSAGE)
+    return sorted(allowed)
+
+def build_application(token: str = deploy_token, request=None):
+    """Build the Application with all handlers and jobs registered"""
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, metrics=metrics))
+        .rate_limiter(OutboundScheduler(
+            OUTBOUND_MAX_PER_SECOND,
+            max_per_chat=OUTBOUND_MAX_PER_CHAT,
+            max_retries=OUTBOUND_MAX_RETRIES,
+            tracer=tracer
+        ))
+    )
+    if PERSISTENCE_PATH:
+        builder = builder.persistence(
+            SQLitePersistence(PERSISTENCE_PATH, update_interval=PERSISTENCE_FLUSH_INTERVAL)
+        )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("menu", menu_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("balance", balance_command))
+    application.add_handler(CommandHandler("transfer", transfer_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("requests", requests_command))
+    application.add_handler(CommandHandler("help", help_command))
+    
+    application.add_handler(CallbackQueryHandler(router.dispatch))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    # Only registered commands and routes become metric and span labels; anything users make up is 'other'
+    application.update_processor.known_handlers = frozenset(
+        [f"/{command}" for handler in application.handlers[0] if isinstance(handler, CommandHandler)
+         for command in handler.commands]
+        + [f"callback:{prefix}" for prefix in router.routes] + ['message']
+    )
+    if tracer is not None:
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = tracer.wrap(handler.callback)
+
+    job_queue = application.job_queue
+    job_queue.run_repeating(cleanup_expired_data, interval=900, first=10)
+    job_queue.run_repeating(record_metrics, interval=METRICS_INTERVAL, first=1)
+    job_queue.run_repeating(check_profile_request, interval=2, first=2)
+    if worker_channel is not None:
+        job_queue.run_repeating(send_heartbeat, interval=HEARTBEAT_INTERVAL, first=1)
+    logger.info("Scheduled cleanup and metrics jobs")
+
+    return application
+
+async def run_ingress() -> None:
+    """Receive updates once and route them to BOT_SHARDS shard workers by user id"""
+    if STATE_BACKEND == "memory":
+        logger.warning("Sharded with STATE_BACKEND=memory: phone uniqueness is only enforced within a shard")
+    if METRICS_PATH:
+        # Drop metrics files left by an earlier run with more shards
+        for index in itertools.count(BOT_SHARDS):
+            if not os.path.exists(f"{METRICS_PATH}.shard{index}"):
+                break
+            os.remove(f"{METRICS_PATH}.shard{index}")
+    ingress = Ingress(BOT_SHARDS)
+    heartbeat = None
+    if worker_channel is not None:
+        # Shards restore their state on start, so a held ingress starts them only once released
+        await worker_channel.ready()
+
+        async def send_heartbeats() -> None:
+            while True:
+                worker_channel.send("heartbeat")
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+        heartbeat = asyncio.create_task(send_heartbeats())
+    await ingress.start()
+
+    allowed_updates = get_allowed_updates(build_application())
+    if BOT_MODE == "webhook":
+        logger.info("Starting ingress webhook on %s:%d/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        source = asyncio.create_task(ingress.serve_webhook(
+            deploy_token, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+            f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}", WEBHOOK_SECRET or None, allowed_updates
+        ))
+    else:
+        logger.info("Starting ingress polling...")
+        source = asyncio.create_task(ingress.poll(deploy_token, allowed_updates))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    stop_wait = asyncio.create_task(stopping.wait())
+    await asyncio.wait((source, stop_wait), return_when=asyncio.FIRST_COMPLETED)
+    logger.info("Stopping ingress, draining shards...")
+    for task in (source, stop_wait, heartbeat):
+        if task is not None:
+            task.cancel()
+    await asyncio.gather(stop_wait, *([heartbeat] if heartbeat else []), return_exceptions=True)
+    await ingress.stop()
+    if not source.cancelled() and source.done() and source.exception() is not None:
+        raise source.exception()
 
 def main() -> None:
     """Start the bot"""
+    if BOT_SHARD_ID is not None:
+        asyncio.run(serve_shard(build_application()))
+        return
     try:
-        application = (
-            ApplicationBuilder()
-            .token(deploy_token)
-            .build()
-        )
+        if BOT_MODE == "webhook" and not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+        if BOT_SHARDS > 1:
+            asyncio.run(run_ingress())
+            return
+        application = build_application()
         logger.info("Bot initialized successfully")
 
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("menu", menu_command))
-        application.add_handler(CommandHandler("profile", profile_command))
-        application.add_handler(CommandHandler("cancel", cancel_command))
-        application.add_handler(CommandHandler("balance", balance_command))
-        application.add_handler(CommandHandler("transfer", transfer_command))
-        application.add_handler(CommandHandler("help", help_command))
-        
-        application.add_handler(CallbackQueryHandler(button_handler))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
-
-        job_queue = application.job_queue
-        job_queue.run_repeating(cleanup_expired_data, interval=900, first=10)
-        logger.info("Scheduled cleanup job")
-
-        logger.info("Starting bot polling...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        allowed_updates = get_allowed_updates(application)
+        if BOT_MODE == "webhook":
+            logger.info("Starting bot webhook on %s:%d/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+            # PTB acks each POST as soon as the update is queued; handlers run in the background
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=allowed_updates
+            )
+        else:
+            logger.info("Starting bot polling...")
+            application.run_polling(allowed_updates=allowed_updates)
         
     except Exception as e:
-        logger.error(f"Error running bot: {str(e)}")
+        logger.error("Error running bot: %s", e)
         raise
 
 if __name__ == "__main__":
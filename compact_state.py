@@ -0,0 +1,251 @@
+import math
+from array import array
+from bisect import bisect_left
+from functools import partial
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+def pack_otp(otp: str) -> Optional[int]:
+    """OTP digits as one int, keeping leading zeros ('0123' -> 10123); None if not a digit string"""
+    if not otp or len(otp) > 18 or not (otp.isascii() and otp.isdigit()):
+        return None
+    return int('1' + otp)
+
+
+def pack_phone(phone: str) -> Optional[int]:
+    """E.164 number as an int ('+15551234567' -> 15551234567); None if not E.164"""
+    digits = phone[1:]
+    if phone[:1] != '+' or not 0 < len(digits) <= 15 or not (digits.isascii() and digits.isdigit()) \
+            or digits[0] == '0':
+        return None
+    return int(digits)
+
+
+def unpack_phone(number: int) -> str:
+    return f"+{number}"
+
+
+class OtpRecord(NamedTuple):
+    code: int           # pack_otp
+    phone: int          # pack_phone
+    deadline: float     # on the monotonic clock
+
+
+# Skips NamedTuple.__new__'s argument handling on the per-update path
+_record = partial(tuple.__new__, OtpRecord)
+
+
+class ColdKeys:
+    """Sorted keys loaded from a snapshot, found by bisection until taken over or dropped
+
+    The position of a key is its row in the columns loaded with it.
+    """
+
+    def __init__(self, keys: array):
+        self.keys = keys
+        self.dead = bytearray(len(keys))
+        self.live = len(keys)
+
+    def find(self, key: int) -> int:
+        """Row of a live key, or -1"""
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key and not self.dead[i]:
+            return i
+        return -1
+
+    def kill(self, i: int) -> None:
+        if not self.dead[i]:
+            self.dead[i] = 1
+            self.live -= 1
+
+    def rows(self):
+        """(row, key) of live keys"""
+        dead = self.dead
+        return ((i, key) for i, key in enumerate(self.keys) if not dead[i])
+
+
+class OtpTable:
+    """Pending OTPs stored column-wise in fixed-width arrays indexed by slot
+
+    A record costs 20 bytes of columns plus one dict entry mapping the user
+    id to its slot, instead of a dict holding strings and a float per user.
+    Freed slots are reused before the columns grow. Deadlines are kept as
+    whole seconds after `epoch`, rounded up.
+
+    A table restored from a snapshot starts with every record cold: rows are
+    found by bisecting the sorted user ids and moved into the dict on first
+    touch, so restoring costs a copy of the columns and nothing per record.
+    """
+
+    def __init__(self, epoch: float = 0.0):
+        self.epoch = epoch
+        self._slots: Dict[int, int] = {}
+        self._codes = array('Q')
+        self._phones = array('Q')
+        self._deadlines = array('I')
+        self._free = array('I')
+        self._cold: Optional[ColdKeys] = None
+
+    @classmethod
+    def from_columns(cls, users: array, codes: array, phones: array, deadlines: array, epoch: float) -> "OtpTable":
+        """Table whose records are the given columns, sorted by user id"""
+        table = cls(epoch)
+        table._codes, table._phones, table._deadlines = codes, phones, deadlines
+        if users:
+            table._cold = ColdKeys(users)
+        return table
+
+    def __len__(self) -> int:
+        return len(self._slots) + (self._cold.live if self._cold else 0)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._slot(user_id) is not None
+
+    def _slot(self, user_id: int) -> Optional[int]:
+        slot = self._slots.get(user_id)
+        if slot is None and self._cold is not None:
+            row = self._cold.find(user_id)
+            if row >= 0:
+                self._cold.kill(row)
+                if not self._cold.live:
+                    self._cold = None
+                slot = self._slots[user_id] = row
+        return slot
+
+    def get(self, user_id: int) -> Optional[OtpRecord]:
+        slot = self._slot(user_id)
+        if slot is None:
+            return None
+        return _record((self._codes[slot], self._phones[slot], self.epoch + self._deadlines[slot]))
+
+    def deadline(self, user_id: int) -> Optional[float]:
+        slot = self._slot(user_id)
+        return None if slot is None else self.epoch + self._deadlines[slot]
+
+    def put(self, user_id: int, code: int, phone: int, deadline: float) -> None:
+        slot = self._slot(user_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._codes)
+                self._codes.append(0)
+                self._phones.append(0)
+                self._deadlines.append(0)
+            self._slots[user_id] = slot
+        self._codes[slot] = code
+        self._phones[slot] = phone
+        self._deadlines[slot] = max(0, math.ceil(deadline - self.epoch))
+
+    def pop(self, user_id: int) -> Optional[OtpRecord]:
+        if self._slot(user_id) is None:
+            return None
+        slot = self._slots.pop(user_id)
+        self._free.append(slot)
+        return _record((self._codes[slot], self._phones[slot], self.epoch + self._deadlines[slot]))
+
+    def expired(self, now: float) -> List[int]:
+        """User ids whose deadline has passed"""
+        deadlines = self._deadlines
+        due = now - self.epoch
+        expired = [user_id for user_id, slot in self._slots.items() if deadlines[slot] <= due]
+        if self._cold is not None:
+            expired.extend(user_id for row, user_id in self._cold.rows() if deadlines[row] <= due)
+        return expired
+
+    def capture(self) -> tuple:
+        """Copies taken on the event loop, for columns() to sort on another thread"""
+        cold = self._cold
+        return (dict(self._slots), cold.keys if cold else None, bytes(cold.dead) if cold else None,
+                array('Q', self._codes), array('Q', self._phones), array('I', self._deadlines))
+
+    @staticmethod
+    def columns(capture: tuple) -> Tuple[array, array, array, array]:
+        """Live records of a capture as (users, codes, phones, deadlines) sorted by user id"""
+        slots, cold_keys, cold_dead, codes, phones, deadlines = capture
+        rows = list(slots.items())
+        if cold_keys is not None:
+            rows.extend((user_id, row) for row, user_id in enumerate(cold_keys) if not cold_dead[row])
+        rows.sort()
+        return (array('q', [user_id for user_id, _ in rows]), array('Q', [codes[slot] for _, slot in rows]),
+                array('Q', [phones[slot] for _, slot in rows]), array('I', [deadlines[slot] for _, slot in rows]))
+
+
+class PhoneIndex:
+    """Phone number -> (user_id, verified), both packed into a single int per number
+
+    Like OtpTable, a restored index keeps the snapshot's sorted columns and
+    looks numbers up there when they are not in the dict.
+    """
+
+    def __init__(self):
+        self._owners: Dict[int, int] = {}
+        self._cold: Optional[ColdKeys] = None
+        self._cold_owners = array('q')
+
+    @classmethod
+    def from_columns(cls, phones: array, owners: array) -> "PhoneIndex":
+        index = cls()
+        if phones:
+            index._cold, index._cold_owners = ColdKeys(phones), owners
+        return index
+
+    def __len__(self) -> int:
+        return len(self._owners) + (self._cold.live if self._cold else 0)
+
+    def _packed(self, phone: int) -> Optional[int]:
+        owner = self._owners.get(phone)
+        if owner is None and self._cold is not None:
+            row = self._cold.find(phone)
+            if row >= 0:
+                owner = self._cold_owners[row]
+        return owner
+
+    def get(self, phone: int) -> Optional[Tuple[int, bool]]:
+        owner = self._packed(phone)
+        if owner is None:
+            return None
+        return owner >> 1, bool(owner & 1)
+
+    def set(self, phone: int, user_id: int, verified: bool) -> None:
+        self._owners[phone] = user_id << 1 | verified
+        if self._cold is not None:
+            row = self._cold.find(phone)
+            if row >= 0:
+                self._cold.kill(row)
+
+    def release_pending(self, phone: int, user_id: int) -> bool:
+        """Forget the phone if user_id claimed it but never verified it"""
+        if self._owners.get(phone) == user_id << 1:
+            del self._owners[phone]
+            return True
+        if self._cold is not None:
+            row = self._cold.find(phone)
+            if row >= 0 and self._cold_owners[row] == user_id << 1:
+                self._cold.kill(row)
+                return True
+        return False
+
+    def drop(self, phone: int) -> None:
+        if self._owners.pop(phone, None) is None and self._cold is not None:
+            row = self._cold.find(phone)
+            if row >= 0:
+                self._cold.kill(row)
+
+    def capture(self) -> tuple:
+        cold = self._cold
+        return dict(self._owners), cold.keys if cold else None, bytes(cold.dead) if cold else None, self._cold_owners
+
+    @staticmethod
+    def columns(capture: tuple) -> Tuple[array, array]:
+        """Live entries of a capture as (phones, packed owners) sorted by phone"""
+        owners, cold_keys, cold_dead, cold_owners = capture
+        rows = list(owners.items())
+        if cold_keys is not None:
+            rows.extend((phone, cold_owners[row]) for row, phone in enumerate(cold_keys) if not cold_dead[row])
+        rows.sort()
+        return array('Q', [phone for phone, _ in rows]), array('q', [owner for _, owner in rows])
+
+    def set_packed(self, phone: int, owner: int) -> None:
+        """Set an owner as stored by the journal (user_id << 1 | verified)"""
+        self.set(phone, owner >> 1, bool(owner & 1))
@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from array import array
+from collections import Counter
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Invoked with the expired key; returns True (or a count) if something was actually evicted
+EvictCallback = Callable[[Hashable], bool]
+
+
+class ExpiryEngine:
+    """Min-heap of deadlines that evicts entries close to the moment they expire
+
+    Rescheduling a key pushes a new heap entry and leaves the old one behind;
+    stale entries are skipped when popped and compacted away when they
+    outnumber live ones, so schedule and evict stay O(log N).
+    Keys are tuples whose first element names the kind of entry ('otp', 'rate', ...)
+    and is used to break down the eviction metrics.
+
+    Large populations of integer members (user ids) use schedule_member, which
+    buckets them by whole second under a single heap entry.
+    """
+
+    def __init__(self, resolution: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.resolution = resolution
+        self.clock = clock
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        # group key + (second,) -> (members, callback)
+        self._groups = {}
+        self.evicted = Counter()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key: Hashable, ttl: float, callback: EvictCallback) -> None:
+        """Schedule (or reschedule) key to be evicted ttl seconds from now"""
+        self._schedule_at(key, self.clock() + ttl, callback)
+
+    def _schedule_at(self, key: Hashable, deadline: float, callback: EvictCallback) -> None:
+        self._entries[key] = (deadline, callback)
+        heapq.heappush(self._heap, (deadline, next(self._seq), key))
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._compact()
+        if self._wakeup is not None and self._heap[0][2] == key:
+            self._wakeup.set()
+
+    def schedule_member(self, group: tuple, member: int, ttl: float, callback: EvictCallback) -> None:
+        """Schedule callback(member) at the first whole second at least ttl seconds from now
+
+        Members due in the same second share one heap entry and cost 8 bytes
+        each. They cannot be cancelled or rescheduled, so the callback must
+        check whether the member is really due; it runs once per schedule call.
+        """
+        second = math.ceil(self.clock() + ttl)
+        key = group + (second,)
+        bucket = self._groups.get(key)
+        if bucket is None:
+            bucket = self._groups[key] = (array('q'), callback)
+            self._schedule_at(key, second, self._evict_group)
+        bucket[0].append(member)
+
+    def _evict_group(self, key: tuple) -> int:
+        members, callback = self._groups.pop(key)
+        evicted = 0
+        for member in members:
+            try:
+                if callback(member):
+                    evicted += 1
+            except Exception as e:
+                logger.error("Error evicting %s member %s: %s", key[:-1], member, e)
+        return evicted
+
+    def cancel(self, key: Hashable) -> None:
+        """Forget key; its heap entry is dropped lazily"""
+        self._entries.pop(key, None)
+
+    def next_deadline(self) -> Optional[float]:
+        """Deadline of the earliest live entry, or None if nothing is scheduled"""
+        heap = self._heap
+        while heap:
+            deadline, _, key = heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == deadline:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def expire_due(self, now: Optional[float] = None) -> int:
+        """Evict every entry whose deadline has passed; returns the number evicted"""
+        if now is None:
+            now = self.clock()
+        heap = self._heap
+        evicted = 0
+        while heap and heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != deadline:
+                continue
+            del self._entries[key]
+            try:
+                count = int(entry[1](key))
+                if count:
+                    evicted += count
+                    self.evicted[key[0]] += count
+            except Exception as e:
+                logger.error("Error evicting %s: %s", key, e)
+        return evicted
+
+    def stats(self) -> dict:
+        """Scheduled entries, heap size and eviction counts per kind"""
+        return {
+            'scheduled': len(self._entries),
+            'heap_size': len(self._heap),
+            'grouped': sum(len(members) for members, _ in self._groups.values()),
+            'evicted': dict(self.evicted),
+        }
+
+    def start(self) -> None:
+        """Start the background eviction task on the running loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="expiry-engine")
+
+    async def stop(self) -> None:
+        """Stop the background eviction task"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._wakeup = None
+
+    async def _run(self) -> None:
+        while True:
+            self.expire_due()
+            self._wakeup.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(self.resolution, deadline - self.clock())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _compact(self) -> None:
+        self._heap = [
+            item for item in self._heap
+            if item[2] in self._entries and self._entries[item[2]][0] == item[0]
+        ]
+        heapq.heapify(self._heap)
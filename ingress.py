@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+import sys
+import time
+from typing import AsyncIterator, Iterable, List, Optional
+
+import httpx
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Length-prefixed JSON update payloads on each shard's stdin
+_FRAME = struct.Struct('<I')
+
+# Update fields whose object carries the user that caused the update
+_OWNER_FIELDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                 'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+                 'chat_join_request', 'business_message', 'channel_post', 'edited_channel_post')
+
+TELEGRAM_API_URL = "https://api.telegram.org/bot"
+
+
+def update_owner(update: dict) -> Optional[int]:
+    """User (else chat) id of a raw update, matching PerUserUpdateProcessor's key"""
+    for field in _OWNER_FIELDS:
+        body = update.get(field)
+        if body is not None:
+            owner = body.get('from') or body.get('user') or body.get('chat')
+            return owner.get('id') if owner else None
+    return None
+
+
+def shard_for(user_id: Optional[int], shards: int) -> int:
+    return hash(user_id) % shards if user_id is not None else 0
+
+
+async def read_frames(reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    """Yield payloads until the writer closes the stream"""
+    while True:
+        try:
+            header = await reader.readexactly(_FRAME.size)
+            yield await reader.readexactly(_FRAME.unpack(header)[0])
+        except asyncio.IncompleteReadError:
+            return
+
+
+class Shard:
+    """One worker process and the updates waiting to be written to it"""
+
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.ready = asyncio.Event()
+        self.routed = 0
+        self.restarts = 0
+        self.started_at = 0.0
+
+
+class Ingress:
+    """Receives each update once and routes it to one of `shards` worker processes by user id
+
+    Workers run bot.py with BOT_SHARD_ID set and read updates from stdin, so
+    every user's updates, OTPs, rate limits and session live in exactly one
+    process and need no cross-process locking. A worker that dies is
+    restarted with backoff while its updates wait in its queue. Stopping
+    closes the pipes; workers finish what they have queued and exit.
+    """
+
+    def __init__(self, shards: int, command: Optional[List[str]] = None, queue_size: int = 10000,
+                 ready_timeout: float = 60.0, drain_timeout: float = 60.0, backoff_max: float = 30.0):
+        self.command = command or [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")]
+        self.shards = [Shard(index, queue_size) for index in range(shards)]
+        self.ready_timeout = ready_timeout
+        self.drain_timeout = drain_timeout
+        self.backoff_max = backoff_max
+        self._tasks = []
+        self._stopping = False
+
+    def _env(self, index: int) -> dict:
+        env = dict(os.environ, BOT_SHARD_ID=str(index), BOT_SHARDS=str(len(self.shards)))
+        # The supervisor's channel belongs to the ingress
+        for key in ("BOT_STATUS_FD", "BOT_HOLD"):
+            env.pop(key, None)
+        return env
+
+    async def _spawn(self, shard: Shard) -> None:
+        shard.ready.clear()
+        shard.started_at = time.monotonic()
+        shard.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=self._env(shard.index)
+        )
+        logger.info("Started shard %d (pid %d)", shard.index, shard.process.pid)
+
+    async def _watch(self, shard: Shard) -> None:
+        """Track readiness and restart the worker when it exits unexpectedly"""
+        failures = 0
+        while True:
+            process = shard.process
+            async for line in process.stdout:
+                if line.strip() == b"ready":
+                    shard.ready.set()
+            code = await process.wait()
+            if self._stopping:
+                return
+            failures = 0 if time.monotonic() - shard.started_at > 60 else failures + 1
+            delay = min(self.backoff_max, 2 ** failures - 1)
+            logger.error("Shard %d exited with code %s, restarting in %gs", shard.index, code, delay)
+            await asyncio.sleep(delay)
+            shard.restarts += 1
+            await self._spawn(shard)
+
+    async def _pump(self, shard: Shard) -> None:
+        """Write queued payloads to the worker, holding the current one across restarts"""
+        while True:
+            payload = await shard.queue.get()
+            while True:
+                await shard.ready.wait()
+                try:
+                    shard.process.stdin.write(_FRAME.pack(len(payload)) + payload)
+                    await shard.process.stdin.drain()
+                    break
+                except (BrokenPipeError, ConnectionResetError):
+                    # The watcher restarts the worker; retry on the new one
+                    shard.ready.clear()
+            shard.queue.task_done()
+
+    async def start(self) -> None:
+        for shard in self.shards:
+            await self._spawn(shard)
+            self._tasks.append(asyncio.create_task(self._watch(shard), name=f"shard-{shard.index}-watch"))
+            self._tasks.append(asyncio.create_task(self._pump(shard), name=f"shard-{shard.index}-pump"))
+        await asyncio.wait_for(asyncio.gather(*(shard.ready.wait() for shard in self.shards)), self.ready_timeout)
+        logger.info("Ingress routing to %d shards", len(self.shards))
+
+    async def dispatch(self, update: dict) -> None:
+        """Queue a raw update for its owner's shard; waits while that shard's queue is full"""
+        shard = self.shards[shard_for(update_owner(update), len(self.shards))]
+        shard.routed += 1
+        await shard.queue.put(json.dumps(update, separators=(',', ':')).encode())
+
+    async def stop(self) -> None:
+        """Deliver what is queued, then close the pipes and wait for the workers to drain"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(shard.queue.join() for shard in self.shards)), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Ingress stopped with %d updates undelivered", sum(shard.queue.qsize() for shard in self.shards))
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for shard in self.shards:
+            if shard.process is not None and shard.process.returncode is None:
+                shard.process.stdin.close()
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            try:
+                await asyncio.wait_for(shard.process.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Shard %d did not drain in time, killing", shard.index)
+                shard.process.kill()
+                await shard.process.wait()
+
+    async def _call(self, client: httpx.AsyncClient, url: str, method: str, payload: Optional[dict] = None):
+        """Result of a Bot API call, retried until Telegram reports ok, after its retry_after or a backoff"""
+        delay = 1.0
+        while True:
+            try:
+                body = (await client.post(url + method, json=payload)).json()
+            except (httpx.HTTPError, ValueError) as e:
+                logger.error("%s failed: %s", method, e)
+                wait = delay
+            else:
+                if body.get('ok'):
+                    return body.get('result')
+                logger.error("%s failed: %s", method, body.get('description'))
+                wait = (body.get('parameters') or {}).get('retry_after') or delay
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, 30.0)
+
+    async def poll(self, token: str, allowed_updates: Iterable[str], timeout: int = 30,
+                   base_url: str = TELEGRAM_API_URL) -> None:
+        """Long-poll getUpdates and dispatch raw updates; confirms each batch only after it is queued"""
+        url = f"{base_url}{token}/"
+        offset = None
+        async with httpx.AsyncClient(timeout=timeout + 10) as client:
+            await self._call(client, url, "deleteWebhook")
+            while True:
+                updates = await self._call(client, url, "getUpdates", {
+                    'offset': offset, 'timeout': timeout, 'allowed_updates': list(allowed_updates)
+                })
+                for update in updates or []:
+                    await self.dispatch(update)
+                    offset = update['update_id'] + 1
+
+    async def serve_webhook(self, token: str, listen: str, port: int, url_path: str, webhook_url: str,
+                            secret_token: Optional[str], allowed_updates: Iterable[str],
+                            base_url: str = TELEGRAM_API_URL) -> None:
+        """Receive webhook POSTs and dispatch their raw updates; acks once the update is queued"""
+        import tornado.web
+
+        ingress = self
+
+        class WebhookHandler(tornado.web.RequestHandler):
+            async def post(self) -> None:
+                if secret_token and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+                    self.set_status(403)
+                    return
+                try:
+                    update = json.loads(self.request.body)
+                except ValueError:
+                    self.set_status(400)
+                    return
+                await ingress.dispatch(update)
+
+        server = tornado.web.Application([(rf"/{url_path}/?", WebhookHandler)]).listen(port, address=listen)
+        try:
+            async with httpx.AsyncClient() as client:
+                await self._call(client, f"{base_url}{token}/", "setWebhook", {
+                    'url': webhook_url, 'secret_token': secret_token, 'allowed_updates': list(allowed_updates)
+                })
+            await asyncio.Event().wait()
+        finally:
+            server.stop()
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                'shard': shard.index,
+                'pid': shard.process.pid if shard.process else None,
+                'ready': shard.ready.is_set(),
+                'routed': shard.routed,
+                'queued': shard.queue.qsize(),
+                'restarts': shard.restarts,
+            }
+            for shard in self.shards
+        ]
+
+
+async def serve_shard(application) -> None:
+    """Run an Application fed by the ingress on stdin until the ingress closes it"""
+    # The ingress decides when to stop; Ctrl+C in a terminal reaches the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    sys.stdout.write("ready\n")
+    sys.stdout.flush()
+    try:
+        async for payload in read_frames(reader):
+            await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+    finally:
+        # stop() processes everything already queued before returning
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
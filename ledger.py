@@ -0,0 +1,648 @@
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Funds opening balances; the only account allowed to go negative
+SYSTEM_ACCOUNT = "__bank__"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id INTEGER PRIMARY KEY,
+    phone TEXT NOT NULL UNIQUE,
+    balance INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    tx_id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    debit_account INTEGER NOT NULL REFERENCES accounts(account_id),
+    credit_account INTEGER NOT NULL REFERENCES accounts(account_id),
+    amount INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    entry_id INTEGER PRIMARY KEY,
+    tx_id INTEGER NOT NULL REFERENCES transactions(tx_id),
+    account_id INTEGER NOT NULL REFERENCES accounts(account_id),
+    amount INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS account_summaries (
+    account_id INTEGER PRIMARY KEY REFERENCES accounts(account_id),
+    total_sent INTEGER NOT NULL DEFAULT 0,
+    total_received INTEGER NOT NULL DEFAULT 0,
+    pending_requests INTEGER NOT NULL DEFAULT 0,
+    last_transfer_at REAL,
+    last_activity_at REAL
+);
+CREATE INDEX IF NOT EXISTS entries_by_account_time ON entries (account_id, created_at, entry_id);
+CREATE INDEX IF NOT EXISTS pending_by_debit ON transactions (debit_account, status);
+CREATE INDEX IF NOT EXISTS pending_by_age ON transactions (created_at) WHERE status = 'pending';
+"""
+
+
+class Account(NamedTuple):
+    account_id: int
+    phone: str
+    balance: int  # cents
+    created_at: float
+
+
+class AccountSummary(NamedTuple):
+    account_id: int
+    phone: str
+    balance: int                       # cents
+    created_at: float
+    total_sent: int                    # cents
+    total_received: int                # cents, transfers only
+    pending_requests: int              # requests this account has been asked to pay
+    last_transfer_at: Optional[float]
+    last_activity_at: Optional[float]  # last transfer or request either way
+
+
+TRANSFER_STATUSES = ('ok', 'duplicate', 'insufficient_funds', 'unknown_account', 'invalid_amount', 'same_account',
+                     'not_pending')
+
+
+class TransferResult(NamedTuple):
+    status: str            # one of TRANSFER_STATUSES
+    tx_id: Optional[int]
+    balance: Optional[int]  # source balance after the operation, in cents
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ('ok', 'duplicate')
+
+
+class PaymentRequest(NamedTuple):
+    tx_id: int
+    requester: str
+    amount: int  # cents
+    created_at: float
+
+
+class HistoryEntry(NamedTuple):
+    entry_id: int
+    created_at: float
+    amount: int        # signed cents from the account's point of view
+    kind: str
+    counterparty: str
+
+
+class HistoryPage(NamedTuple):
+    entries: List[HistoryEntry]  # newest first
+    older: Optional[tuple]       # keyset cursor for the next older page, or None
+    newer: Optional[tuple]       # keyset cursor for the next newer page, or None
+
+
+class _Operation(NamedTuple):
+    kind: str  # 'transfer', 'request', 'pay' or 'decline'
+    key: str
+    debit_phone: str
+    credit_phone: str
+    amount: int
+    future: asyncio.Future
+    request_id: Optional[int] = None  # the pending request a 'pay' or 'decline' settles
+
+
+class Ledger:
+    """Append-only double-entry ledger on SQLite
+
+    Every posted transaction writes one debit and one credit entry and
+    updates both account balances in the same commit, so balance reads are a
+    primary-key lookup and never sum history. The same goes for the per-account
+    summary shown by /profile (totals, pending requests, last activity), which
+    check_summaries() can verify against the history. A money request stays
+    pending until the payer pays or declines it or expire_requests() ages it
+    out, and only pending requests are counted. Transfers are idempotent
+    on their key. Concurrent transfers are group-committed: operations
+    submitted within `batch_window` seconds share one SQLite transaction on
+    the ledger's writer thread.
+
+    Up to `cache_size` summaries are kept in an LRU cache on the writer
+    thread. Commits drop the accounts they touched, and the whole cache is
+    dropped when another process (a shard) has committed to the file.
+    """
+
+    def __init__(self, path: str = "ledger.db", opening_balance: int = 0, batch_window: float = 0.002,
+                 cache_size: int = 10000):
+        self.path = path
+        self.opening_balance = opening_balance
+        self.batch_window = batch_window
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger")
+        self._conn = None
+        self._pending: List[_Operation] = []
+        self._commit_task = None
+        self._cache: OrderedDict = OrderedDict()
+        self._data_version = None
+        self.commits = 0
+        self.operations = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO accounts (phone, balance, created_at) VALUES (?, 0, ?)",
+                (SYSTEM_ACCOUNT, time.time())
+            )
+            accounts, summaries = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM accounts), (SELECT COUNT(*) FROM account_summaries)"
+            ).fetchone()
+            if accounts != summaries:
+                # A new ledger (the bank account) or one written before summaries existed
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    built = self._write_summaries(self._conn, self._summaries_from_history(self._conn))
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                logger.info("Built account summaries for %d accounts from history", built)
+        return self._conn
+
+    async def start(self) -> None:
+        await self._run(self._connect)
+
+    async def stop(self) -> None:
+        if self._commit_task is not None:
+            await self._commit_task
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    # Reads
+
+    def _get_account(self, phone: str) -> Optional[Account]:
+        row = self._connect().execute(
+            "SELECT account_id, phone, balance, created_at FROM accounts WHERE phone = ?", (phone,)
+        ).fetchone()
+        return Account(*row) if row else None
+
+    async def get_account(self, phone: str) -> Optional[Account]:
+        return await self._run(self._get_account, phone)
+
+    def _count_accounts(self) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM accounts WHERE phone != ?", (SYSTEM_ACCOUNT,)
+        ).fetchone()[0]
+
+    async def count_accounts(self) -> int:
+        return await self._run(self._count_accounts)
+
+    def _get_summary(self, phone: str) -> Optional[AccountSummary]:
+        conn = self._connect()
+        if self.cache_size:
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                # Changes only this connection made don't move data_version; those are invalidated on commit
+                self._cache.clear()
+                self._data_version = version
+            summary = self._cache.get(phone)
+            if summary is not None:
+                self._cache.move_to_end(phone)
+                self.cache_hits += 1
+                return summary
+            self.cache_misses += 1
+        row = conn.execute(
+            "SELECT a.account_id, a.phone, a.balance, a.created_at, s.total_sent, s.total_received, "
+            "s.pending_requests, s.last_transfer_at, s.last_activity_at "
+            "FROM accounts a JOIN account_summaries s ON s.account_id = a.account_id WHERE a.phone = ?",
+            (phone,)
+        ).fetchone()
+        if row is None:
+            return None
+        summary = AccountSummary(*row)
+        if self.cache_size:
+            self._cache[phone] = summary
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return summary
+
+    async def get_summary(self, phone: str) -> Optional[AccountSummary]:
+        """Materialized summary of an account, usually from the cache"""
+        return await self._run(self._get_summary, phone)
+
+    async def get_balance(self, phone: str) -> Optional[int]:
+        summary = await self.get_summary(phone)
+        return summary.balance if summary else None
+
+    async def get_profile(self, phone: str) -> Optional[dict]:
+        """Balance and transaction summary for an account, amounts in cents"""
+        summary = await self.get_summary(phone)
+        if summary is None:
+            return None
+        return {
+            'balance': summary.balance,
+            'total_sent': summary.total_sent,
+            'total_received': summary.total_received,
+            'pending_requests': summary.pending_requests,
+            'join_date': summary.created_at,
+            'last_transfer': summary.last_transfer_at,
+            'last_activity': summary.last_activity_at,
+        }
+
+    def _get_history(self, phone: str, limit: int, cursor: Optional[tuple], newer: bool) -> HistoryPage:
+        account = self._get_account(phone)
+        if account is None:
+            return HistoryPage([], None, None)
+        query = (
+            "SELECT e.entry_id, e.created_at, e.amount, t.kind, c.phone FROM entries e "
+            "JOIN transactions t ON t.tx_id = e.tx_id "
+            "JOIN accounts c ON c.account_id = CASE WHEN e.amount < 0 THEN t.credit_account ELSE t.debit_account END "
+            "WHERE e.account_id = ? "
+        )
+        params = [account.account_id]
+        if cursor is not None:
+            query += "AND (e.created_at, e.entry_id) > (?, ?) " if newer else "AND (e.created_at, e.entry_id) < (?, ?) "
+            params.extend(cursor)
+        query += "ORDER BY e.created_at {0}, e.entry_id {0} LIMIT ?".format("ASC" if newer else "DESC")
+        params.append(limit + 1)
+        rows = [HistoryEntry(*row) for row in self._connect().execute(query, params)]
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+        if not rows:
+            return HistoryPage([], None, None)
+        first, last = rows[0], rows[-1]
+        has_older = more if not newer else True
+        has_newer = more if newer else cursor is not None
+        return HistoryPage(
+            rows,
+            (last.created_at, last.entry_id) if has_older else None,
+            (first.created_at, first.entry_id) if has_newer else None,
+        )
+
+    async def get_history(self, phone: str, limit: int = 5, cursor: Optional[tuple] = None,
+                          newer: bool = False) -> HistoryPage:
+        """One page of an account's entries by (created_at, entry_id) keyset, newest first
+
+        Pages are located through the per-account time index, so every page
+        costs the same no matter how deep into the history it is.
+        """
+        return await self._run(self._get_history, phone, limit, cursor, newer)
+
+    def _pending_requests(self, phone: str, limit: int) -> List[PaymentRequest]:
+        return [PaymentRequest(*row) for row in self._connect().execute(
+            "SELECT t.tx_id, c.phone, t.amount, t.created_at FROM transactions t "
+            "JOIN accounts d ON d.account_id = t.debit_account "
+            "JOIN accounts c ON c.account_id = t.credit_account "
+            "WHERE d.phone = ? AND t.status = 'pending' ORDER BY t.created_at LIMIT ?",
+            (phone, limit)
+        )]
+
+    async def pending_requests(self, phone: str, limit: int = 5) -> List[PaymentRequest]:
+        """Oldest pending requests the account has been asked to pay"""
+        return await self._run(self._pending_requests, phone, limit)
+
+    # Writes
+
+    def _open_account(self, phone: str) -> Account:
+        summary = self._get_summary(phone)
+        if summary is not None:
+            return Account(*summary[:4])
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO accounts (phone, balance, created_at) VALUES (?, 0, ?)", (phone, now)
+            )
+            if cursor.rowcount:
+                account_id = cursor.lastrowid
+                conn.execute("INSERT INTO account_summaries (account_id) VALUES (?)", (account_id,))
+                if self.opening_balance > 0:
+                    system_id = conn.execute(
+                        "SELECT account_id FROM accounts WHERE phone = ?", (SYSTEM_ACCOUNT,)
+                    ).fetchone()[0]
+                    self._post(conn, f"open:{phone}", 'opening', system_id, account_id, self.opening_balance, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._invalidate(phone, SYSTEM_ACCOUNT)
+        return self._get_account(phone)
+
+    async def open_account(self, phone: str) -> Account:
+        """Return the account for a verified phone, creating and funding it if needed"""
+        return await self._run(self._open_account, phone)
+
+    async def transfer(self, key: str, from_phone: str, to_phone: str, amount: int) -> TransferResult:
+        """Move amount cents between accounts; replaying the same key returns the original result"""
+        return await self._submit('transfer', key, from_phone, to_phone, amount)
+
+    async def request_payment(self, key: str, requester_phone: str, payer_phone: str, amount: int) -> TransferResult:
+        """Record a pending request for payer to pay requester; no funds move"""
+        return await self._submit('request', key, payer_phone, requester_phone, amount)
+
+    async def pay_request(self, payer_phone: str, request_id: int) -> TransferResult:
+        """Pay a pending request with a transfer to the requester; paying it again returns the original result"""
+        return await self._submit('pay', f"pay:{request_id}", payer_phone, "", 0, request_id)
+
+    async def decline_request(self, payer_phone: str, request_id: int) -> TransferResult:
+        """Decline a pending request; no funds move"""
+        return await self._submit('decline', "", payer_phone, "", 0, request_id)
+
+    async def _submit(self, kind: str, key: str, debit_phone: str, credit_phone: str, amount: int,
+                      request_id: Optional[int] = None) -> TransferResult:
+        if request_id is None and (amount <= 0 or debit_phone == credit_phone):
+            return TransferResult('invalid_amount' if amount <= 0 else 'same_account', None, None)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Operation(kind, key, debit_phone, credit_phone, amount, future, request_id))
+        if self._commit_task is None:
+            self._commit_task = asyncio.create_task(self._commit_soon())
+        return await future
+
+    async def _commit_soon(self) -> None:
+        await asyncio.sleep(self.batch_window)
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                results = await self._run(self._apply_batch, batch)
+            except Exception as e:
+                logger.error("Ledger commit of %d operations failed: %s", len(batch), e)
+                for operation in batch:
+                    if not operation.future.done():
+                        operation.future.set_exception(e)
+                continue
+            self.commits += 1
+            self.operations += len(batch)
+            for operation, result in zip(batch, results):
+                if not operation.future.done():
+                    operation.future.set_result(result)
+        self._commit_task = None
+
+    def _apply_batch(self, batch: List[_Operation]) -> List[TransferResult]:
+        conn = self._connect()
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for operation in batch:
+                results.append(self._apply(conn, operation))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            for operation in batch:
+                self._invalidate(operation.debit_phone, operation.credit_phone)
+        return results
+
+    def _invalidate(self, *phones: str) -> None:
+        for phone in phones:
+            self._cache.pop(phone, None)
+
+    def _apply(self, conn: sqlite3.Connection, operation: _Operation) -> TransferResult:
+        if operation.kind == 'decline':
+            return self._settle(conn, operation)
+        existing = conn.execute(
+            "SELECT tx_id, debit_account FROM transactions WHERE idempotency_key = ?", (operation.key,)
+        ).fetchone()
+        if existing:
+            balance = conn.execute(
+                "SELECT balance FROM accounts WHERE account_id = ?", (existing[1],)
+            ).fetchone()[0]
+            return TransferResult('duplicate', existing[0], balance)
+        if operation.kind == 'pay':
+            return self._settle(conn, operation)
+
+        debit = conn.execute(
+            "SELECT account_id, balance FROM accounts WHERE phone = ?", (operation.debit_phone,)
+        ).fetchone()
+        credit = conn.execute(
+            "SELECT account_id FROM accounts WHERE phone = ?", (operation.credit_phone,)
+        ).fetchone()
+        if debit is None or credit is None:
+            return TransferResult('unknown_account', None, debit[1] if debit else None)
+
+        now = time.time()
+        if operation.kind == 'request':
+            cursor = conn.execute(
+                "INSERT INTO transactions (idempotency_key, kind, status, debit_account, credit_account, amount, created_at) "
+                "VALUES (?, 'request', 'pending', ?, ?, ?, ?)",
+                (operation.key, debit[0], credit[0], operation.amount, now)
+            )
+            conn.executemany(
+                "UPDATE account_summaries SET pending_requests = pending_requests + ?, "
+                "last_activity_at = MAX(COALESCE(last_activity_at, 0), ?) WHERE account_id = ?",
+                ((1, now, debit[0]), (0, now, credit[0]))
+            )
+            return TransferResult('ok', cursor.lastrowid, debit[1])
+
+        if debit[1] < operation.amount:
+            return TransferResult('insufficient_funds', None, debit[1])
+        tx_id = self._post(conn, operation.key, 'transfer', debit[0], credit[0], operation.amount, now)
+        return TransferResult('ok', tx_id, debit[1] - operation.amount)
+
+    def _settle(self, conn: sqlite3.Connection, operation: _Operation) -> TransferResult:
+        """Pay or decline one of the payer's pending requests and take it off their pending count"""
+        payer = conn.execute(
+            "SELECT account_id, balance FROM accounts WHERE phone = ?", (operation.debit_phone,)
+        ).fetchone()
+        if payer is None:
+            return TransferResult('unknown_account', None, None)
+        request = conn.execute(
+            "SELECT t.credit_account, t.amount, c.phone FROM transactions t "
+            "JOIN accounts c ON c.account_id = t.credit_account "
+            "WHERE t.tx_id = ? AND t.kind = 'request' AND t.status = 'pending' AND t.debit_account = ?",
+            (operation.request_id, payer[0])
+        ).fetchone()
+        if request is None:
+            return TransferResult('not_pending', None, payer[1])
+        requester_id, amount, requester_phone = request
+        tx_id, balance = None, payer[1]
+        if operation.kind == 'pay':
+            if balance < amount:
+                return TransferResult('insufficient_funds', None, balance)
+            tx_id = self._post(conn, operation.key, 'transfer', payer[0], requester_id, amount, time.time())
+            balance -= amount
+        conn.execute(
+            "UPDATE transactions SET status = ? WHERE tx_id = ?",
+            ('paid' if operation.kind == 'pay' else 'declined', operation.request_id)
+        )
+        conn.execute(
+            "UPDATE account_summaries SET pending_requests = pending_requests - 1 WHERE account_id = ?", (payer[0],)
+        )
+        self._invalidate(requester_phone)
+        return TransferResult('ok', tx_id, balance)
+
+    def _expire_requests(self, max_age: float) -> int:
+        conn = self._connect()
+        cutoff = time.time() - max_age
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute(
+                "SELECT debit_account, COUNT(*) FROM transactions WHERE status = 'pending' AND created_at < ? "
+                "GROUP BY debit_account", (cutoff,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE account_summaries SET pending_requests = pending_requests - ? WHERE account_id = ?",
+                ((count, account_id) for account_id, count in expired)
+            )
+            conn.execute(
+                "UPDATE transactions SET status = 'expired' WHERE status = 'pending' AND created_at < ?", (cutoff,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if expired:
+            self._cache.clear()
+        return sum(count for _, count in expired)
+
+    async def expire_requests(self, max_age: float) -> int:
+        """Expire requests left pending for more than max_age seconds; returns how many"""
+        return await self._run(self._expire_requests, max_age)
+
+    def _post(self, conn: sqlite3.Connection, key: str, kind: str, debit_id: int, credit_id: int,
+              amount: int, now: float) -> int:
+        """Write a posted transaction, its two entries and both balance and summary updates"""
+        tx_id = conn.execute(
+            "INSERT INTO transactions (idempotency_key, kind, status, debit_account, credit_account, amount, created_at) "
+            "VALUES (?, ?, 'posted', ?, ?, ?, ?)",
+            (key, kind, debit_id, credit_id, amount, now)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO entries (tx_id, account_id, amount, created_at) VALUES (?, ?, ?, ?)",
+            ((tx_id, debit_id, -amount, now), (tx_id, credit_id, amount, now))
+        )
+        conn.executemany(
+            "UPDATE accounts SET balance = balance + ? WHERE account_id = ?",
+            ((-amount, debit_id), (amount, credit_id))
+        )
+        transfer = kind == 'transfer'
+        conn.executemany(
+            "UPDATE account_summaries SET total_sent = total_sent + ?, total_received = total_received + ?, "
+            "last_transfer_at = CASE WHEN ? THEN MAX(COALESCE(last_transfer_at, 0), ?) ELSE last_transfer_at END, "
+            "last_activity_at = MAX(COALESCE(last_activity_at, 0), ?) WHERE account_id = ?",
+            ((amount, 0, transfer, now, now, debit_id),
+             (0, amount if transfer else 0, transfer, now, now, credit_id))
+        )
+        return tx_id
+
+    # Summaries
+
+    @staticmethod
+    def _summaries_from_history(conn: sqlite3.Connection) -> Dict[int, tuple]:
+        """Account id -> (total_sent, total_received, pending_requests, last_transfer_at, last_activity_at)"""
+        summaries = {account_id: [0, 0, 0, None, None] for account_id, in conn.execute("SELECT account_id FROM accounts")}
+        for account_id, sent, received, last_transfer in conn.execute(
+            "SELECT e.account_id, SUM(CASE WHEN e.amount < 0 THEN -e.amount ELSE 0 END), "
+            "SUM(CASE WHEN e.amount > 0 AND t.kind = 'transfer' THEN e.amount ELSE 0 END), "
+            "MAX(CASE WHEN t.kind = 'transfer' THEN e.created_at END) "
+            "FROM entries e JOIN transactions t ON t.tx_id = e.tx_id GROUP BY e.account_id"
+        ):
+            summaries[account_id][0:2] = sent, received
+            summaries[account_id][3] = last_transfer
+        for account_id, pending in conn.execute(
+            "SELECT debit_account, COUNT(*) FROM transactions WHERE status = 'pending' GROUP BY debit_account"
+        ):
+            summaries[account_id][2] = pending
+        for account_id, last_activity in conn.execute(
+            "SELECT account_id, MAX(created_at) FROM ("
+            "SELECT debit_account AS account_id, created_at FROM transactions UNION ALL "
+            "SELECT credit_account, created_at FROM transactions) GROUP BY account_id"
+        ):
+            summaries[account_id][4] = last_activity
+        return {account_id: tuple(values) for account_id, values in summaries.items()}
+
+    @staticmethod
+    def _write_summaries(conn: sqlite3.Connection, summaries: Dict[int, tuple]) -> int:
+        conn.execute("DELETE FROM account_summaries")
+        conn.executemany(
+            "INSERT INTO account_summaries (account_id, total_sent, total_received, pending_requests, "
+            "last_transfer_at, last_activity_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((account_id, *values) for account_id, values in summaries.items())
+        )
+        return len(summaries)
+
+    def _check_summaries(self, repair: bool) -> List[tuple]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE" if repair else "BEGIN")
+        try:
+            expected = self._summaries_from_history(conn)
+            stored = {
+                row[0]: tuple(row[1:]) for row in conn.execute(
+                    "SELECT account_id, total_sent, total_received, pending_requests, last_transfer_at, "
+                    "last_activity_at FROM account_summaries"
+                )
+            }
+            mismatches = [
+                (account_id, stored.get(account_id), expected.get(account_id))
+                for account_id in sorted(expected.keys() | stored.keys())
+                if stored.get(account_id) != expected.get(account_id)
+            ]
+            if repair and mismatches:
+                self._write_summaries(conn, expected)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if repair and mismatches:
+            self._cache.clear()
+        return mismatches
+
+    async def check_summaries(self, repair: bool = False) -> List[tuple]:
+        """Recompute every summary from the history; returns (account_id, stored, expected) for each mismatch
+
+        Reads the whole history, so it is meant for offline runs
+        (`python -m ledger ledger.db`). With `repair`, summaries are rewritten
+        from history when any differ.
+        """
+        return await self._run(self._check_summaries, repair)
+
+    def stats(self) -> dict:
+        return {
+            'commits': self.commits,
+            'operations': self.operations,
+            'pending': len(self._pending),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+async def _check(path: str, repair: bool) -> int:
+    ledger = Ledger(path)
+    await ledger.start()
+    try:
+        mismatches = await ledger.check_summaries(repair)
+    finally:
+        await ledger.stop()
+    for account_id, stored, expected in mismatches:
+        print(f"account {account_id}: stored {stored}, history {expected}")
+    print(f"{len(mismatches)} account summaries differ from history" + (", repaired" if repair and mismatches else ""))
+    return 1 if mismatches and not repair else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the materialized account summaries against the ledger history")
+    parser.add_argument("path", nargs="?", default="ledger.db")
+    parser.add_argument("--repair", action="store_true", help="rewrite the summaries from history if any differ")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_check(args.path, args.repair)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+LEVEL_BITS = {'DEBUG': 1, 'INFO': 2, 'WARNING': 4, 'ERROR': 8, 'CRITICAL': 16}
+OTHER_LEVEL = 32
+ALL_LEVELS = 63
+
+# Sidecar layout: header (magic, inode of the indexed log) then one record per block
+_HEADER = struct.Struct('<8sQ')
+_MAGIC = b'B8LOGIX1'
+# offset, length, min ts, max ts, level mask
+_RECORD = struct.Struct('<QIddB3x')
+
+# Lines from the JSON formatter and from the old text formatter
+_JSON_LINE = re.compile(rb'^\{"ts": "([^"]+)", "level": "([A-Z]+)"')
+_TEXT_LINE = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - .*? - ([A-Z]+) - ')
+
+
+def parse_entry(line: bytes, offset: int) -> dict:
+    """Decode one log line for the API; text lines are split into the same fields as JSON ones"""
+    text = line.decode('utf-8', 'replace')
+    if text.startswith('{'):
+        try:
+            entry = json.loads(text)
+            entry['offset'] = offset
+            return entry
+        except ValueError:
+            pass
+    parts = text.split(' - ', 3)
+    if len(parts) == 4 and _TEXT_LINE.match(line):
+        return {'offset': offset, 'ts': parts[0], 'logger': parts[1], 'level': parts[2], 'msg': parts[3]}
+    return {'offset': offset, 'msg': text}
+
+
+class LogIndex:
+    """Sparse sidecar index of a log file for time-range and level queries
+
+    The log is cut into blocks of about `block_size` bytes; each block's
+    offset, timestamp range and a bitmask of the levels it contains are
+    appended to `<log>.idx`. Queries skip blocks outside the time range or
+    whose mask lacks the requested levels and scan only the rest through
+    mmap. Refreshing indexes just the complete blocks appended since the last
+    refresh; the unindexed tail is scanned directly. Continuation lines such
+    as tracebacks inherit the time and level of the line they follow.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None, block_size: int = 64 * 1024):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._inode = None
+        self.offsets: List[int] = []
+        self.lengths: List[int] = []
+        self.min_ts: List[float] = []
+        self.max_ts: List[float] = []
+        self.masks: List[int] = []
+        self._ts_cache = (b'', 0.0)
+
+    @property
+    def indexed_end(self) -> int:
+        return self.offsets[-1] + self.lengths[-1] if self.offsets else 0
+
+    def _parse_ts(self, raw: bytes) -> float:
+        # Consecutive lines usually share a timestamp
+        if raw == self._ts_cache[0]:
+            return self._ts_cache[1]
+        try:
+            ts = datetime.fromisoformat(raw.decode()).timestamp()
+        except ValueError:
+            return 0.0
+        self._ts_cache = (raw, ts)
+        return ts
+
+    def _classify(self, line: bytes, previous: Tuple[float, int]) -> Tuple[float, int]:
+        match = _JSON_LINE.match(line) or _TEXT_LINE.match(line)
+        if match is None:
+            return previous
+        return self._parse_ts(match.group(1)), LEVEL_BITS.get(match.group(2).decode(), OTHER_LEVEL)
+
+    def _lines(self, mm, start: int, end: int) -> Iterable[Tuple[int, bytes]]:
+        """(offset, line) for the complete lines in [start, end)"""
+        position = start
+        while position < end:
+            newline = mm.find(b'\n', position, end)
+            if newline < 0:
+                return
+            yield position, mm[position:newline]
+            position = newline + 1
+
+    def _load(self, inode: int) -> None:
+        self.offsets, self.lengths, self.min_ts, self.max_ts, self.masks = [], [], [], [], []
+        self._inode = inode
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        if len(data) >= _HEADER.size and _HEADER.unpack_from(data) == (_MAGIC, inode):
+            usable = (len(data) - _HEADER.size) // _RECORD.size * _RECORD.size
+            for offset, length, low, high, mask in _RECORD.iter_unpack(data[_HEADER.size:_HEADER.size + usable]):
+                self.offsets.append(offset)
+                self.lengths.append(length)
+                self.min_ts.append(low)
+                self.max_ts.append(high)
+                self.masks.append(mask)
+            return
+        with open(self.index_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, inode))
+
+    def refresh(self) -> int:
+        """Index complete blocks appended since the last call; returns bytes indexed"""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return 0
+            if stat.st_ino != self._inode:
+                self._load(stat.st_ino)
+            if stat.st_size < self.indexed_end:
+                # Truncated in place: start over
+                os.remove(self.index_path)
+                self._load(stat.st_ino)
+            start = self.indexed_end
+            if stat.st_size - start < self.block_size:
+                return 0
+            records = []
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = mm.rfind(b'\n', start, stat.st_size) + 1
+                block_start = start
+                low, high, mask = float('inf'), 0.0, 0
+                previous = (self.max_ts[-1] if self.max_ts else 0.0, OTHER_LEVEL)
+                for offset, line in self._lines(mm, start, end):
+                    previous = ts, level = self._classify(line, previous)
+                    low, high, mask = min(low, ts), max(high, ts), mask | level
+                    block_end = offset + len(line) + 1
+                    if block_end - block_start >= self.block_size:
+                        records.append((block_start, block_end - block_start, low, high, mask))
+                        block_start = block_end
+                        low, high, mask = float('inf'), 0.0, 0
+            with open(self.index_path, 'ab') as f:
+                f.write(b''.join(_RECORD.pack(*record) for record in records))
+            for offset, length, low, high, mask in records:
+                self.offsets.append(offset)
+                self.lengths.append(length)
+                self.min_ts.append(low)
+                self.max_ts.append(high)
+                self.masks.append(mask)
+            return sum(record[1] for record in records)
+
+    def _regions(self, since: float, until: float, mask: int, size: int) -> List[Tuple[int, int]]:
+        """Byte ranges, in file order, that may hold matching lines (the unindexed tail always may)"""
+        regions = [
+            (offset, offset + length)
+            for offset, length, low, high, level_mask in zip(self.offsets, self.lengths, self.min_ts, self.max_ts, self.masks)
+            if level_mask & mask and low <= until and high >= since
+        ]
+        if self.indexed_end < size:
+            regions.append((self.indexed_end, size))
+        return regions
+
+    def search(self, since: float = 0.0, until: float = float('inf'), levels: Optional[Iterable[str]] = None,
+               cursor: Optional[int] = None, limit: int = 100, newest_first: bool = True) -> dict:
+        """Return a page of matching entries and the cursor (byte offset) for the next page"""
+        self.refresh()
+        mask = ALL_LEVELS if not levels else 0
+        for level in levels or ():
+            mask |= LEVEL_BITS.get(level.upper(), OTHER_LEVEL)
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return {'entries': [], 'cursor': None}
+        if size == 0:
+            return {'entries': [], 'cursor': None}
+
+        with self._lock:
+            regions = self._regions(since, until, mask, size)
+        if cursor is not None:
+            if newest_first:
+                regions = [(start, min(end, cursor)) for start, end in regions if start < cursor]
+            else:
+                regions = [(max(start, cursor), end) for start, end in regions if end > cursor]
+        if newest_first:
+            regions.reverse()
+
+        found = []
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start, end in regions:
+                # Continuation lines take their time and level from the line before the region
+                previous = self._context_before(mm, start)
+                matches = []
+                for offset, line in self._lines(mm, start, end):
+                    previous = ts, level = self._classify(line, previous)
+                    if level & mask and since <= ts <= until:
+                        matches.append((offset, line))
+                if newest_first:
+                    matches.reverse()
+                found.extend(matches[:limit + 1 - len(found)])
+                if len(found) > limit:
+                    break
+
+        next_cursor = None
+        if len(found) > limit:
+            found = found[:limit]
+            offset, line = found[-1]
+            # Pages never overlap: the next one starts just before/after the last line returned
+            next_cursor = offset if newest_first else offset + len(line) + 1
+        return {'entries': [parse_entry(line, offset) for offset, line in found], 'cursor': next_cursor}
+
+    def _context_before(self, mm, start: int, max_lines: int = 1000) -> Tuple[float, int]:
+        """Time and level of the nearest line before `start` that carries them"""
+        end = start - 1
+        for _ in range(max_lines):
+            if end <= 0:
+                break
+            line_start = mm.rfind(b'\n', 0, end) + 1
+            context = self._classify(mm[line_start:end], None)
+            if context is not None:
+                return context
+            end = line_start - 1
+        return 0.0, OTHER_LEVEL
+
+    def stats(self) -> dict:
+        return {'blocks': len(self.offsets), 'indexed_bytes': self.indexed_end}
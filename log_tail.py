@@ -0,0 +1,261 @@
+import os
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# (event id, line) where the id is "<inode>:<byte offset just past the line>"
+LogLine = Tuple[str, str]
+
+
+def format_event_id(inode: int, offset: int) -> str:
+    return f"{inode}:{offset}"
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse a Last-Event-ID header into (inode, offset), or None"""
+    try:
+        inode, offset = value.split(':')
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+def split_lines(data: bytes, start: int) -> List[Tuple[int, bytes]]:
+    """Split complete lines read from offset `start` into (end offset, line); a trailing fragment is dropped"""
+    result = []
+    offset = start
+    for line in data.split(b'\n')[:-1]:
+        offset += len(line) + 1
+        result.append((offset, line))
+    return result
+
+
+def read_last_lines(f, end: int, count: int, block_size: int = 8192) -> List[Tuple[int, bytes]]:
+    """Return up to `count` complete lines ending at or before `end` as (end offset, line), oldest first
+
+    Reads backwards from `end` in blocks, so the cost depends on the lines
+    returned rather than the file size.
+    """
+    if count <= 0 or end <= 0:
+        return []
+    data = b''
+    position = end
+    while position > 0 and data.count(b'\n') <= count:
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        data = f.read(step) + data
+    lines = data.split(b'\n')
+    # The last element is what follows the final newline (empty for complete lines)
+    lines.pop()
+    if position > 0:
+        # The first element may be the tail of an earlier line
+        lines = lines[1:]
+    lines = lines[-count:]
+    result = []
+    offset = end
+    for line in reversed(lines):
+        result.append((offset, line))
+        offset -= len(line) + 1
+    result.reverse()
+    return result
+
+
+class Subscription:
+    """Bounded buffer of lines for one client; the oldest lines are dropped when it falls behind"""
+
+    def __init__(self, buffer_size: int):
+        self.lines = queue.Queue(maxsize=buffer_size)
+        self.dropped = 0
+
+    def push(self, item: LogLine) -> None:
+        while True:
+            try:
+                self.lines.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.lines.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float) -> Optional[LogLine]:
+        try:
+            return self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LogTailer:
+    """One polling reader per file that broadcasts appended lines to any number of subscribers
+
+    The reader only touches the file when stat() shows it grew or was
+    replaced. On rotation the rest of the old file is drained before the new
+    one is opened from the start.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.25, buffer_size: int = 1000):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._file = None
+        self._inode = None
+        self._position = 0
+        self._partial = b''
+        self._thread = None
+        self._stopped = threading.Event()
+        self.lines_read = 0
+        self.rotations = 0
+
+    def _open(self, from_start: bool) -> bool:
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        if self._file is not None:
+            self._file.close()
+        self._file = f
+        self._inode = os.fstat(f.fileno()).st_ino
+        self._position = 0
+        self._partial = b''
+        if not from_start:
+            # Start at the end, keeping an unfinished last line to complete later
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - 65536))
+            tail = f.read()
+            self._partial = tail[tail.rfind(b'\n') + 1:]
+            self._position = end
+        return True
+
+    def _read_new(self) -> None:
+        chunk = self._file.read()
+        if not chunk:
+            return
+        start = self._position - len(self._partial)
+        data = self._partial + chunk
+        self._position += len(chunk)
+        self._partial = data[data.rfind(b'\n') + 1:]
+        items = [
+            (format_event_id(self._inode, offset), line.decode('utf-8', 'replace'))
+            for offset, line in split_lines(data, start)
+        ]
+        self.lines_read += len(items)
+        for subscription in self._subscribers:
+            for item in items:
+                subscription.push(item)
+
+    def _poll(self) -> None:
+        # Runs under the lock so subscribe() always sees a consistent position
+        if self._file is None:
+            self._open(from_start=True)
+            return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._position:
+            self._read_new()
+            self.rotations += 1
+            self._open(from_start=True)
+            stat = os.fstat(self._file.fileno())
+        if stat.st_size > self._position:
+            self._read_new()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                with self._lock:
+                    self._poll()
+            except OSError:
+                pass
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._open(from_start=False)
+            self._thread = threading.Thread(target=self._run, name=f"log-tail:{self.path}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._file is not None:
+            self._file.close()
+
+    def subscribe(self, backfill: int = 0, last_event_id: Optional[str] = None) -> Tuple[Subscription, List[LogLine]]:
+        """Register a subscriber; returns it with the lines it missed or asked to backfill
+
+        With a Last-Event-ID from the current file, everything after that offset
+        is replayed; otherwise the last `backfill` lines are. Live lines are
+        delivered through the subscription from exactly where the replay ends.
+        """
+        self.start()
+        subscription = Subscription(self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+            inode, end = self._inode, self._position - len(self._partial)
+        if inode is None:
+            return subscription, []
+        resume = parse_event_id(last_event_id)
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return subscription, []
+        with f:
+            if os.fstat(f.fileno()).st_ino != inode:
+                return subscription, []
+            if resume is not None and resume[0] == inode and resume[1] <= end:
+                f.seek(resume[1])
+                replay = split_lines(f.read(end - resume[1]), resume[1])
+            elif resume is not None and resume[0] != inode:
+                # Rotated since the client disconnected: everything here is new to it
+                replay = split_lines(f.read(end), 0)
+            else:
+                replay = read_last_lines(f, end, backfill)
+        return subscription, [(format_event_id(inode, offset), line.decode('utf-8', 'replace')) for offset, line in replay]
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'lines_read': self.lines_read,
+            'rotations': self.rotations,
+            'position': self._position,
+        }
+
+
+_tailers: Dict[str, LogTailer] = {}
+_tailers_lock = threading.Lock()
+
+
+def get_tailer(path: str) -> LogTailer:
+    """Shared tailer for a file, so every client of the same log uses one reader"""
+    path = os.path.abspath(path)
+    with _tailers_lock:
+        tailer = _tailers.get(path)
+        if tailer is None:
+            tailer = _tailers[path] = LogTailer(path)
+        return tailer
+
+
+def stream(tailer: LogTailer, backfill: int = 0, last_event_id: Optional[str] = None,
+           keepalive: float = 15.0) -> Iterator[Optional[LogLine]]:
+    """Yield replayed then live lines; yields None every `keepalive` seconds of silence"""
+    subscription, replay = tailer.subscribe(backfill, last_event_id)
+    try:
+        yield from replay
+        while True:
+            if subscription.dropped:
+                dropped, subscription.dropped = subscription.dropped, 0
+                yield None, f"[{dropped} log lines skipped, client too slow]"
+            yield subscription.get(keepalive)
+    finally:
+        tailer.unsubscribe(subscription)
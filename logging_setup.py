@@ -0,0 +1,143 @@
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+from typing import Optional
+
+# Per-update context stamped onto every record logged while handling it
+current_user_id: contextvars.ContextVar = contextvars.ContextVar('log_user_id', default=None)
+current_handler: contextvars.ContextVar = contextvars.ContextVar('log_handler', default=None)
+
+# Libraries that log one line per request at INFO
+NOISY_LOGGERS = ('httpx',)
+
+
+def bind_log_context(user_id=None, handler: Optional[str] = None) -> tuple:
+    """Set the user/handler for records logged by the current task; returns tokens for reset_log_context"""
+    return current_user_id.set(user_id), current_handler.set(handler)
+
+
+def reset_log_context(tokens: tuple) -> None:
+    current_user_id.reset(tokens[0])
+    current_handler.reset(tokens[1])
+
+
+class ContextFilter(logging.Filter):
+    """Copy the per-update context onto records unless passed explicitly via `extra`"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'user_id'):
+            record.user_id = current_user_id.get()
+        if not hasattr(record, 'handler'):
+            record.handler = current_handler.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg and user_id/handler/latency_ms when known"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in ('user_id', 'handler', 'latency_ms'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queues records as they are, so %-style messages are only built on the listener thread
+
+    The stock QueueHandler formats on the caller's thread; here the only work
+    left on the event loop is creating the record. Arguments are read when the
+    listener formats them, so avoid logging objects that are mutated right after.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """Rotates when the file exceeds `max_bytes` or at every `interval` seconds boundary; backups are gzipped"""
+
+    def __init__(self, filename: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 10,
+                 interval: float = 24 * 3600):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.interval = interval
+        self.namer = _gzip_namer
+        self.rotator = _gzip_rotator
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now: float) -> float:
+        # Aligned to interval boundaries so restarts don't postpone rotation
+        return (now // self.interval + 1) * self.interval if self.interval else float('inf')
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = self._next_rollover(time.time())
+
+
+def setup_logging(path: str = "bot.log", level: str = "INFO", max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 10, rotate_interval: float = 24 * 3600, rotate: bool = True) -> QueueListener:
+    """Route all logging through a queue to a JSON file writer on a background thread
+
+    With rotate=False the file is only appended to and reopened after another
+    process rotates it, for processes sharing one log file with a rotating owner.
+    """
+    if rotate:
+        file_handler = CompressingRotatingFileHandler(path, max_bytes, backup_count, rotate_interval)
+    else:
+        file_handler = WatchedFileHandler(path, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener: QueueListener) -> None:
+    """Flush queued records and stop the writer thread; safe to call more than once"""
+    if listener._thread is not None:
+        listener.stop()
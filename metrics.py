@@ -0,0 +1,283 @@
+import glob
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Shared-memory layout, written by the bot and read by the dashboard:
+#   header | series table | float64 value slots | recent-activity ring
+_MAGIC = b'B8METR01'
+# magic, max series, series count, max slots, ring size, ring next, started at
+_HEADER = struct.Struct('<8sIIIIQd')
+_HEADER_SIZE = 64
+_COUNT_OFFSET = 12
+_RING_NEXT_OFFSET = 24
+# name (with labels), kind, first slot, slot count
+_SERIES = struct.Struct('<112sB3xII4x')
+# time, user_id, action
+_ACTIVITY = struct.Struct('<dq48s')
+_RING_NEXT = struct.Struct('<Q')
+
+COUNTER, GAUGE, HISTOGRAM = 1, 2, 3
+KIND_NAMES = {COUNTER: 'counter', GAUGE: 'gauge', HISTOGRAM: 'histogram'}
+
+# Seconds; handler latencies from sub-millisecond menus to slow provider calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    """Label value escaped as in the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def series_name(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + '}'
+
+
+class Counter:
+    __slots__ = ('_values', '_slot')
+
+    def __init__(self, values, slot: int):
+        self._values = values
+        self._slot = slot
+
+    def inc(self, amount: float = 1) -> None:
+        self._values[self._slot] += amount
+
+
+class Gauge(Counter):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self._values[self._slot] = value
+
+
+class Histogram:
+    """Bucket counts (the last is +Inf), then sum, then count"""
+    __slots__ = ('_values', '_slot', '_bounds', '_sum', '_count')
+
+    def __init__(self, values, slot: int, bounds: Tuple[float, ...]):
+        self._values = values
+        self._slot = slot
+        self._bounds = bounds
+        self._sum = slot + len(bounds) + 1
+        self._count = self._sum + 1
+
+    def observe(self, value: float) -> None:
+        values = self._values
+        values[self._slot + bisect_left(self._bounds, value)] += 1
+        values[self._sum] += value
+        values[self._count] += 1
+
+    def add(self, counts: List[float]) -> None:
+        """Add bucket counts tallied elsewhere, followed by the sum of their values"""
+        values = self._values
+        for index, count in enumerate(counts[:-1], self._slot):
+            if count:
+                values[index] += count
+        values[self._sum] += counts[-1]
+        values[self._count] += sum(counts[:-1])
+
+
+class MetricsWriter:
+    """Records metrics into a memory-mapped file that other processes read without locks
+
+    There is a single writer (the bot's event loop). Series are registered
+    once and return handles whose updates are a float64 store into the
+    mapping, so recording costs a few hundred nanoseconds and never blocks.
+    Readers may see a histogram mid-update, which only skews one scrape. An
+    empty path keeps the metrics in anonymous memory.
+    """
+
+    def __init__(self, path: str = "bot_metrics.bin", max_series: int = 512, max_slots: int = 8192,
+                 ring_size: int = 32):
+        self.path = path
+        self.max_series = max_series
+        self.max_slots = max_slots
+        self.ring_size = ring_size
+        self._series_offset = _HEADER_SIZE
+        self._values_offset = self._series_offset + max_series * _SERIES.size
+        self._ring_offset = self._values_offset + max_slots * 8
+        size = self._ring_offset + ring_size * _ACTIVITY.size
+        if path:
+            # A fresh file per run, so readers never mix two layouts
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.truncate(size)
+            self._file = open(tmp_path, 'r+b')
+            self._mm = mmap.mmap(self._file.fileno(), size)
+            os.replace(tmp_path, path)
+        else:
+            self._file = None
+            self._mm = mmap.mmap(-1, size)
+        self.values = memoryview(self._mm)[self._values_offset:self._ring_offset].cast('d')
+        self._series: Dict[str, object] = {}
+        self._next_slot = 0
+        self._ring_next = 0
+        self._write_header()
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(self._mm, 0, _MAGIC, self.max_series, len(self._series), self.max_slots,
+                          self.ring_size, self._ring_next, time.time())
+
+    def _register(self, name: str, kind: int, slots: int) -> int:
+        encoded = name.encode()
+        if len(encoded) > 112:
+            # Cutting it would split a character or drop the closing quote
+            raise ValueError(f"Metrics series name longer than 112 bytes: {name[:60]}...")
+        if len(self._series) >= self.max_series or self._next_slot + slots > self.max_slots:
+            raise ValueError(f"Metrics segment full, cannot add {name}")
+        slot = self._next_slot
+        self._next_slot += slots
+        _SERIES.pack_into(self._mm, self._series_offset + len(self._series) * _SERIES.size,
+                          encoded, kind, slot, slots)
+        # Publish after the entry is complete; readers only look at the first `count` entries
+        struct.pack_into('<I', self._mm, _COUNT_OFFSET, len(self._series) + 1)
+        return slot
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = series_name(name, labels)
+        handle = self._series.get(key)
+        if handle is None:
+            handle = Counter(self.values, self._register(key, COUNTER, 1))
+            self._series[key] = handle
+        return handle
+
+    def gauge(self, name: str, **labels) -> Gauge:
+        key = series_name(name, labels)
+        handle = self._series.get(key)
+        if handle is None:
+            handle = Gauge(self.values, self._register(key, GAUGE, 1))
+            self._series[key] = handle
+        return handle
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """Histogram over DEFAULT_BUCKETS, which is also what readers assume"""
+        key = series_name(name, labels)
+        handle = self._series.get(key)
+        if handle is None:
+            handle = Histogram(self.values, self._register(key, HISTOGRAM, len(DEFAULT_BUCKETS) + 3), DEFAULT_BUCKETS)
+            self._series[key] = handle
+        return handle
+
+    def activity(self, user_id: int, action: str, at: Optional[float] = None) -> None:
+        """Append to the ring of recent user actions shown on the dashboard"""
+        index = self._ring_next % self.ring_size
+        _ACTIVITY.pack_into(self._mm, self._ring_offset + index * _ACTIVITY.size,
+                            at or time.time(), user_id or 0, action.encode()[:48])
+        self._ring_next += 1
+        _RING_NEXT.pack_into(self._mm, _RING_NEXT_OFFSET, self._ring_next)
+
+    def close(self) -> None:
+        self.values.release()
+        self._mm.close()
+        if self._file is not None:
+            self._file.close()
+
+
+class Series(NamedTuple):
+    name: str
+    labels: str     # '' or 'key="value",...'
+    kind: int
+    values: Tuple[float, ...]
+
+
+class Activity(NamedTuple):
+    time: float
+    user_id: int
+    action: str
+
+
+class MetricsSnapshot(NamedTuple):
+    started_at: float
+    series: List[Series]
+    activities: List[Activity]     # newest first
+
+    def value(self, name: str, **labels) -> float:
+        """Current value of a counter or gauge, summed over series matching the given labels"""
+        wanted = [f'{key}="{_escape(value)}"' for key, value in labels.items()]
+        return sum(
+            series.values[0] for series in self.series
+            if series.name == name and all(label in series.labels for label in wanted)
+        )
+
+
+def read_metrics(path: str) -> Optional[MetricsSnapshot]:
+    """Snapshot the bot's metrics file, or None if it is missing or not a metrics file"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < _HEADER_SIZE:
+        return None
+    magic, max_series, count, max_slots, ring_size, ring_next, started_at = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        return None
+    values_offset = _HEADER_SIZE + max_series * _SERIES.size
+    ring_offset = values_offset + max_slots * 8
+    series = []
+    for i in range(count):
+        raw_name, kind, slot, slots = _SERIES.unpack_from(data, _HEADER_SIZE + i * _SERIES.size)
+        full_name = raw_name.rstrip(b'\0').decode(errors='replace')
+        name, _, labels = full_name.partition('{')
+        start = values_offset + slot * 8
+        series.append(Series(name, labels.rstrip('}'), kind, struct.unpack_from(f'<{slots}d', data, start)))
+    activities = []
+    for n in range(ring_next - 1, max(-1, ring_next - 1 - ring_size), -1):
+        at, user_id, action = _ACTIVITY.unpack_from(data, ring_offset + (n % ring_size) * _ACTIVITY.size)
+        activities.append(Activity(at, user_id, action.rstrip(b'\0').decode(errors='replace')))
+    return MetricsSnapshot(started_at, series, activities)
+
+
+def merge_snapshots(snapshots: List[MetricsSnapshot]) -> MetricsSnapshot:
+    """Combine the files of several processes: counters, histograms and gauges add up, quantiles take the max"""
+    merged: Dict[Tuple[str, str], Series] = {}
+    for snapshot in snapshots:
+        for series in snapshot.series:
+            key = (series.name, series.labels)
+            previous = merged.get(key)
+            if previous is None:
+                merged[key] = series
+            elif series.kind == GAUGE and 'quantile=' in series.labels:
+                merged[key] = series._replace(values=tuple(map(max, previous.values, series.values)))
+            else:
+                merged[key] = series._replace(values=tuple(map(sum, zip(previous.values, series.values))))
+    activities = sorted((a for snapshot in snapshots for a in snapshot.activities), reverse=True)
+    return MetricsSnapshot(min(snapshot.started_at for snapshot in snapshots), list(merged.values()), activities)
+
+
+def read_all_metrics(path: str) -> Optional[MetricsSnapshot]:
+    """Snapshot `path` merged with the `path.shardN` files written by shard workers"""
+    paths = [path] + sorted(glob.glob(glob.escape(path) + ".shard*"))
+    snapshots = [snapshot for snapshot in map(read_metrics, paths) if snapshot is not None]
+    return merge_snapshots(snapshots) if snapshots else None
+
+
+def render_prometheus(snapshot: MetricsSnapshot) -> str:
+    """Prometheus text exposition format"""
+    lines = []
+    typed = set()
+    for series in snapshot.series:
+        if series.name not in typed:
+            typed.add(series.name)
+            lines.append(f"# TYPE {series.name} {KIND_NAMES.get(series.kind, 'untyped')}")
+        labels = series.labels
+        if series.kind != HISTOGRAM:
+            lines.append(f"{series.name}{{{labels}}} {series.values[0]:g}" if labels
+                         else f"{series.name} {series.values[0]:g}")
+            continue
+        bounds = [f"{bound:g}" for bound in DEFAULT_BUCKETS] + ["+Inf"]
+        cumulative = 0.0
+        prefix = labels + ',' if labels else ''
+        for bound, count in zip(bounds, series.values):
+            cumulative += count
+            lines.append(f'{series.name}_bucket{{{prefix}le="{bound}"}} {cumulative:g}')
+        suffix = f"{{{labels}}}" if labels else ''
+        lines.append(f"{series.name}_sum{suffix} {series.values[-2]:g}")
+        lines.append(f"{series.name}_count{suffix} {series.values[-1]:g}")
+    return "\n".join(lines) + "\n"
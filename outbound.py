@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from rate_limiter import TokenBucketLimit
+from tracing import TELEGRAM, Tracer
+
+logger = logging.getLogger(__name__)
+
+# Lower sends first. Non-zero because PTB drops falsy rate_limit_args
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+PRIORITY_LOW = 3
+
+# Endpoints that post or change messages and so count against flood limits
+THROTTLED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+# Edits that may be merged while still queued: only the last one is sent
+COALESCED_ENDPOINTS = ('editMessageText', 'editMessageReplyMarkup', 'editMessageCaption')
+
+
+class _Outbound:
+    __slots__ = ('priority', 'seq', 'chat_id', 'callback', 'args', 'kwargs', 'future',
+                 'enqueued', 'coalesce_key', 'attempts')
+
+    def __init__(self, priority, seq, chat_id, callback, args, kwargs, future, coalesce_key):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = time.perf_counter()
+        self.coalesce_key = coalesce_key
+        self.attempts = 0
+
+    def __lt__(self, other: "_Outbound") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Throttles outgoing messages below Telegram's flood limits
+
+    Message-sending requests wait in one priority queue. A single pump task
+    releases them through a global token bucket and a per-chat bucket (groups
+    get a stricter one), with at most one request per chat in flight so each
+    chat sees its messages in order. Queued edits of the same message are
+    coalesced, and a 429 pauses sending for its `retry_after` before the
+    request is retried. Everything else, e.g. answerCallbackQuery, bypasses
+    the queue. Priorities come from `rate_limit_args` (PRIORITY_*). With a
+    tracer, every Bot API call is recorded as seen by its caller, queueing
+    included.
+    """
+
+    def __init__(self, max_per_second: int = 30, max_per_chat: float = 1, chat_burst: int = 3,
+                 max_per_group_minute: int = 20, max_retries: int = 3, latency_samples: int = 4096,
+                 tracer: Optional[Tracer] = None):
+        self.max_retries = max_retries
+        self.tracer = tracer
+        self._global = TokenBucketLimit(max_per_second, 1.0)
+        self._chats = TokenBucketLimit(chat_burst, chat_burst / max_per_chat)
+        self._groups = TokenBucketLimit(max_per_group_minute, 60)
+        self._queue = []
+        self._seq = itertools.count()
+        self._pending_edits: Dict[tuple, _Outbound] = {}
+        self._in_flight = set()
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+        self._send_tasks = set()
+        self._latencies = deque(maxlen=latency_samples)
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+
+    async def initialize(self) -> None:
+        if self._pump_task is None:
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def shutdown(self) -> None:
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+        if self._send_tasks:
+            await asyncio.gather(*self._send_tasks, return_exceptions=True)
+        for entry in self._queue:
+            if not entry.future.done():
+                entry.future.set_exception(RuntimeError("Outbound scheduler shut down"))
+        self._queue.clear()
+        self._pending_edits.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        if self.tracer is None:
+            return await self._process(callback, args, kwargs, endpoint, data, rate_limit_args)
+        started = time.perf_counter()
+        try:
+            return await self._process(callback, args, kwargs, endpoint, data, rate_limit_args)
+        finally:
+            self.tracer.record(TELEGRAM, time.perf_counter() - started, endpoint)
+
+    async def _process(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(THROTTLED_PREFIXES) or self._pump_task is None:
+            return await callback(*args, **kwargs)
+
+        priority = rate_limit_args or PRIORITY_NORMAL
+        coalesce_key = None
+        if endpoint in COALESCED_ENDPOINTS:
+            coalesce_key = (endpoint, data.get('chat_id'), data.get('message_id'), data.get('inline_message_id'))
+            queued = self._pending_edits.get(coalesce_key)
+            # Only merge into an edit that will not be sent later than this one would be
+            if queued is not None and queued.priority <= priority:
+                queued.callback, queued.args, queued.kwargs = callback, args, kwargs
+                self.coalesced += 1
+                return await asyncio.shield(queued.future)
+
+        entry = _Outbound(priority, next(self._seq), data.get('chat_id'), callback, args, kwargs,
+                          asyncio.get_running_loop().create_future(), coalesce_key)
+        if coalesce_key is not None:
+            self._pending_edits[coalesce_key] = entry
+        heapq.heappush(self._queue, entry)
+        self._wakeup.set()
+        return await asyncio.shield(entry.future)
+
+    def _chat_limit(self, chat_id) -> TokenBucketLimit:
+        if isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0):
+            return self._groups
+        return self._chats
+
+    def _take_next(self) -> Tuple[bool, Optional[float]]:
+        """Start the first sendable request; returns (started, seconds until a blocked chat frees up)"""
+        skipped = []
+        wait = None
+        started = False
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            chat_id = entry.chat_id
+            if chat_id in self._in_flight:
+                skipped.append(entry)
+                continue
+            if chat_id is not None:
+                limit = self._chat_limit(chat_id)
+                decision = limit.hit(chat_id)
+                if not decision.allowed:
+                    wait = decision.retry_after if wait is None else min(wait, decision.retry_after)
+                    skipped.append(entry)
+                    continue
+                self._in_flight.add(chat_id)
+            self._global.hit(None)
+            self._start(entry)
+            started = True
+            break
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return started, wait
+
+    def _start(self, entry: _Outbound) -> None:
+        if entry.coalesce_key is not None and self._pending_edits.get(entry.coalesce_key) is entry:
+            del self._pending_edits[entry.coalesce_key]
+        if entry.attempts == 0:
+            self._latencies.append(time.perf_counter() - entry.enqueued)
+        task = asyncio.get_running_loop().create_task(self._send(entry))
+        self._send_tasks.add(task)
+        task.add_done_callback(self._send_tasks.discard)
+
+    async def _send(self, entry: _Outbound) -> None:
+        try:
+            result = await entry.callback(*entry.args, **entry.kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            entry.attempts += 1
+            if entry.attempts > self.max_retries:
+                self.failed += 1
+                entry.future.set_exception(e)
+            else:
+                self.retries += 1
+                logger.warning("Flood limit hit, pausing outbound messages for %ss", retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                heapq.heappush(self._queue, entry)
+        except Exception as e:
+            self.failed += 1
+            entry.future.set_exception(e)
+        else:
+            self.sent += 1
+            entry.future.set_result(result)
+        finally:
+            self._in_flight.discard(entry.chat_id)
+            self._wakeup.set()
+
+    async def _pump(self) -> None:
+        while True:
+            timeout = None
+            if self._queue:
+                paused = self._paused_until - time.monotonic()
+                decision = self._global.peek(None)
+                if paused > 0:
+                    timeout = paused
+                elif not decision.allowed:
+                    timeout = decision.retry_after
+                else:
+                    started, timeout = self._take_next()
+                    if started:
+                        continue
+            # Woken by new requests and finished sends (which free their chat)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def purge(self) -> int:
+        """Drop refilled per-chat buckets; returns how many were removed"""
+        return self._chats.purge_expired() + self._groups.purge_expired()
+
+    def stats(self) -> dict:
+        """Queue depth, counters and send-queue latency percentiles (seconds)"""
+        latencies = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+        return {
+            'queued': len(self._queue),
+            'in_flight': len(self._in_flight),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'failed': self.failed,
+            'latency_p50': pct(0.50),
+            'latency_p95': pct(0.95),
+            'latency_p99': pct(0.99),
+            'latency_max': latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Write-behind user_data persistence on SQLite in WAL mode
+
+    PTB hands us deep copies of every user_data touched since its last
+    persistence run; those are coalesced in memory and written in one
+    transaction per `max_batch` sessions. Users are
+    loaded lazily through refresh_user_data the first time one of their
+    updates is handled, so startup never deserializes the whole table. All
+    SQLite work runs on a single background thread that owns the connection.
+
+    Which users are already loaded is remembered for the `max_loaded` most
+    recently seen; a user who dropped out of that set is read again on their
+    next update, which only fills in keys their in-memory user_data lacks.
+    """
+
+    def __init__(self, path: str = "bot_state.db", update_interval: float = 10, max_batch: int = 5000,
+                 max_loaded: int = 100000):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.max_batch = max_batch
+        self.max_loaded = max_loaded
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-persistence")
+        self._conn = None
+        # user_id -> serialized user_data (None marks a deletion)
+        self._dirty: Dict[int, Optional[str]] = {}
+        # The batch being written, so a reload doesn't read rows it is about to replace
+        self._writing: Dict[int, Optional[str]] = {}
+        self._loaded: OrderedDict = OrderedDict()
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_data ("
+                "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load_user(self, user_id: int) -> Optional[str]:
+        row = self._connect().execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _write_batch(self, batch: Dict[int, Optional[str]]) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(user_id, data, now) for user_id, data in batch.items() if data is not None]
+            )
+            conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in batch.items() if data is None]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def _flush_dirty(self) -> None:
+        async with self._flush_lock:
+            if self._dirty:
+                await self._write_dirty()
+
+    async def _write_dirty(self) -> None:
+        pending, self._dirty = self._dirty, {}
+        self._writing = pending
+        items = list(pending.items())
+        try:
+            for start in range(0, len(items), self.max_batch):
+                batch = dict(items[start:start + self.max_batch])
+                started = time.perf_counter()
+                try:
+                    await self._run(self._write_batch, batch)
+                except Exception as e:
+                    logger.error("Failed to persist %d sessions: %s", len(batch), e)
+                    # Keep unwritten sessions for the next attempt unless newer data arrived meanwhile
+                    for user_id, data in items[start:]:
+                        self._dirty.setdefault(user_id, data)
+                    return
+                self.flushes += 1
+                self.rows_written += len(batch)
+                self.last_flush_seconds = time.perf_counter() - started
+        finally:
+            self._writing = {}
+
+    async def _flush_soon(self) -> None:
+        # PTB gathers all update_user_data calls of one persistence run; yielding
+        # once lets the whole run land in the same batch
+        await asyncio.sleep(0)
+        self._flush_task = None
+        await self._flush_dirty()
+
+    def _mark_dirty(self, user_id: int, data: Optional[str]) -> None:
+        self._dirty[user_id] = data
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def get_user_data(self) -> dict:
+        # Sessions are loaded lazily in refresh_user_data
+        await self._run(self._connect)
+        return {}
+
+    def _mark_loaded(self, user_id: int) -> None:
+        self._loaded[user_id] = None
+        self._loaded.move_to_end(user_id)
+        if len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded:
+            self._loaded.move_to_end(user_id)
+            return
+        self._mark_loaded(user_id)
+        if user_id in self._dirty or user_id in self._writing:
+            return
+        stored = await self._run(self._load_user, user_id)
+        if stored:
+            for key, value in json.loads(stored).items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark_loaded(user_id)
+        self._mark_dirty(user_id, json.dumps(data, separators=(',', ':'), default=str))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded.pop(user_id, None)
+        self._mark_dirty(user_id, None)
+
+    async def flush(self) -> None:
+        await self._flush_dirty()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+        logger.info("Persistence flushed: %d session writes in %d batches", self.rows_written, self.flushes)
+
+    def stats(self) -> dict:
+        return {
+            'dirty': len(self._dirty),
+            'loaded': len(self._loaded),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'last_flush_seconds': self.last_flush_seconds,
+        }
+
+    # Only user_data is persisted
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
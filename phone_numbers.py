@@ -0,0 +1,105 @@
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+# Country calling code -> (min, max) digits of the national number that follows it.
+# Calling codes are prefix-free, so at most one of the first 1-3 digits matches.
+COUNTRY_LENGTHS = {
+    # North American Numbering Plan, Russia/Kazakhstan
+    '1': (10, 10), '7': (10, 10),
+    # Africa
+    '20': (8, 10), '27': (9, 9), '211': (9, 9), '212': (9, 9), '213': (8, 9), '216': (8, 8), '218': (8, 9),
+    '220': (7, 7), '221': (9, 9), '222': (8, 8), '223': (8, 8), '224': (8, 9), '225': (8, 10), '226': (8, 8),
+    '227': (8, 8), '228': (8, 8), '229': (8, 10), '230': (7, 8), '231': (7, 9), '232': (8, 8), '233': (9, 9),
+    '234': (8, 10), '235': (8, 8), '236': (8, 8), '237': (8, 9), '238': (7, 7), '239': (7, 7), '240': (9, 9),
+    '241': (7, 8), '242': (9, 9), '243': (7, 9), '244': (9, 9), '245': (7, 9), '246': (7, 7), '248': (7, 7),
+    '249': (9, 9), '250': (9, 9), '251': (9, 9), '252': (7, 9), '253': (8, 8), '254': (9, 10), '255': (9, 9),
+    '256': (9, 9), '257': (8, 8), '258': (8, 9), '260': (9, 9), '261': (9, 9), '262': (9, 9), '263': (9, 10),
+    '264': (8, 10), '265': (7, 9), '266': (8, 8), '267': (7, 8), '268': (8, 8), '269': (7, 7), '290': (4, 5),
+    '291': (7, 7), '297': (7, 7), '298': (6, 6), '299': (6, 6),
+    # Europe
+    '30': (10, 10), '31': (9, 11), '32': (8, 9), '33': (9, 9), '34': (9, 9), '36': (8, 9), '39': (6, 11),
+    '40': (9, 9), '41': (9, 12), '43': (4, 13), '44': (7, 10), '45': (8, 8), '46': (7, 13), '47': (5, 8),
+    '48': (9, 9), '49': (6, 15), '350': (8, 8), '351': (9, 9), '352': (4, 11), '353': (7, 9), '354': (7, 9),
+    '355': (8, 9), '356': (8, 8), '357': (8, 8), '358': (5, 12), '359': (7, 9), '370': (8, 8), '371': (8, 8),
+    '372': (7, 8), '373': (8, 8), '374': (8, 8), '375': (9, 10), '376': (6, 9), '377': (8, 9), '378': (6, 10),
+    '380': (9, 9), '381': (8, 12), '382': (8, 9), '383': (8, 9), '385': (8, 9), '386': (8, 8), '387': (8, 9),
+    '389': (8, 8), '420': (9, 9), '421': (9, 9), '423': (7, 9),
+    # Latin America
+    '51': (8, 9), '52': (10, 10), '53': (6, 8), '54': (10, 11), '55': (10, 11), '56': (9, 9), '57': (8, 10),
+    '58': (10, 10), '500': (5, 5), '501': (7, 7), '502': (8, 8), '503': (8, 8), '504': (8, 8), '505': (8, 8),
+    '506': (8, 8), '507': (7, 8), '508': (6, 6), '509': (8, 8), '590': (9, 9), '591': (8, 8), '592': (7, 7),
+    '593': (8, 9), '594': (9, 9), '595': (9, 9), '596': (9, 9), '597': (6, 7), '598': (8, 8), '599': (7, 8),
+    # Asia and Oceania
+    '60': (8, 10), '61': (9, 9), '62': (8, 12), '63': (8, 10), '64': (8, 10), '65': (8, 8), '66': (8, 9),
+    '81': (9, 10), '82': (8, 10), '84': (9, 10), '86': (7, 11), '90': (10, 10), '91': (10, 10), '92': (9, 10),
+    '93': (9, 9), '94': (9, 9), '95': (7, 10), '98': (10, 10), '670': (7, 8), '672': (6, 6), '673': (7, 7),
+    '674': (7, 7), '675': (7, 8), '676': (5, 7), '677': (5, 7), '678': (5, 7), '679': (7, 7), '680': (7, 7),
+    '681': (6, 9), '682': (5, 5), '683': (4, 7), '685': (5, 7), '686': (5, 8), '687': (6, 6), '688': (5, 6),
+    '689': (8, 8), '690': (4, 7), '691': (7, 7), '692': (7, 7), '850': (8, 10), '852': (8, 8), '853': (8, 8),
+    '855': (8, 9), '856': (8, 10), '880': (8, 10), '886': (8, 9), '960': (7, 7), '961': (7, 8), '962': (8, 9),
+    '963': (8, 9), '964': (8, 10), '965': (8, 8), '966': (8, 9), '967': (7, 9), '968': (8, 8), '970': (8, 9),
+    '971': (8, 9), '972': (8, 9), '973': (8, 8), '974': (7, 8), '975': (7, 8), '976': (8, 8), '977': (8, 10),
+    '992': (9, 9), '993': (8, 8), '994': (9, 9), '995': (9, 9), '996': (9, 9), '998': (9, 9),
+}
+
+# Separators people type inside numbers, deleted in one pass
+_SEPARATORS = str.maketrans('', '', ' \t\u00a0-.()/')
+
+
+def _parse(phone: str) -> Optional[str]:
+    if len(phone) > 40:
+        # Longer than any formatted number; don't spend time (or cache space) on pasted text
+        return None
+    canonical = phone[:1] == '+'
+    if canonical:
+        digits = phone[1:]
+    else:
+        digits = phone.strip()
+        if digits[:1] == '+':
+            digits = digits[1:]
+        elif digits[:2] == '00':
+            # International dialling prefix used outside North America
+            digits = digits[2:]
+    if not (digits.isascii() and digits.isdigit()):
+        # Only formatted input pays for removing separators
+        canonical = False
+        digits = digits.translate(_SEPARATORS)
+        if not (digits.isascii() and digits.isdigit()):
+            return None
+    size = len(digits)
+    if not 7 <= size <= 15:
+        return None
+    for code_size in (1, 2, 3):
+        lengths = COUNTRY_LENGTHS.get(digits[:code_size])
+        if lengths is not None:
+            if not lengths[0] <= size - code_size <= lengths[1]:
+                return None
+            return phone if canonical else '+' + digits
+    return None
+
+
+@lru_cache(maxsize=65536)
+def normalize(phone: str) -> Optional[str]:
+    """Canonical E.164 form of a typed number ('+1 (415) 555-2671' -> '+14155552671'), None if invalid
+
+    Spaces, dashes, dots, slashes and brackets are ignored, and '00' or a
+    missing '+' are accepted in front of the country code. The national
+    number's length must fit its country calling code.
+    """
+    return _parse(phone)
+
+
+def is_valid(phone: str) -> bool:
+    return normalize(phone) is not None
+
+
+def normalize_many(phones: Iterable[str]) -> List[Optional[str]]:
+    """normalize() for a large list such as a contact import, without churning the shared cache"""
+    seen = {}
+    result = []
+    for phone in phones:
+        normalized = seen.get(phone, seen)
+        if normalized is seen:
+            normalized = seen[phone] = _parse(phone)
+        result.append(normalized)
+    return result
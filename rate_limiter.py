@@ -0,0 +1,214 @@
+import math
+import os
+import time
+from typing import Callable, Dict, Hashable, NamedTuple, Optional
+
+
+class RateDecision(NamedTuple):
+    """Outcome of a rate-limit check"""
+    allowed: bool
+    remaining: int      # hits still allowed right now
+    retry_after: float  # seconds until the next hit is allowed (0 if allowed)
+    reset_after: float  # seconds until the key's state is empty again
+
+
+ALLOW_ALL = RateDecision(True, math.inf, 0.0, 0.0)
+
+
+class GcraLimit:
+    """Sliding-window limit using the generic cell rate algorithm
+
+    Allows `count` hits per `window` seconds with the hits spread over a true
+    sliding window. State is a single float per key (the theoretical arrival
+    time), so each check is O(1) with no per-hit allocation.
+    """
+
+    def __init__(self, count: int, window: float, clock: Callable[[], float] = time.monotonic):
+        self.count = count
+        self.window = window
+        self.clock = clock
+        self._interval = window / count
+        self._tat: Dict[Hashable, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def hit(self, key: Hashable) -> RateDecision:
+        now = self.clock()
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + self._interval
+        if new_tat - now > self.window:
+            return RateDecision(False, 0, new_tat - self.window - now, tat - now)
+        self._tat[key] = new_tat
+        return RateDecision(True, int((self.window - (new_tat - now)) / self._interval + 1e-9), 0.0, new_tat - now)
+
+    def peek(self, key: Hashable) -> RateDecision:
+        now = self.clock()
+        tat = max(self._tat.get(key, now), now)
+        remaining = int((self.window - (tat - now)) / self._interval + 1e-9)
+        retry_after = 0.0 if remaining else tat + self._interval - self.window - now
+        return RateDecision(remaining > 0, remaining, retry_after, tat - now)
+
+    def expire(self, key: Hashable) -> bool:
+        """Drop the key's state if it has fully drained"""
+        tat = self._tat.get(key)
+        if tat is None or tat > self.clock():
+            return False
+        del self._tat[key]
+        return True
+
+    def purge_expired(self) -> int:
+        now = self.clock()
+        expired = [key for key, tat in self._tat.items() if tat <= now]
+        for key in expired:
+            del self._tat[key]
+        return len(expired)
+
+    def reset(self, key: Hashable) -> None:
+        self._tat.pop(key, None)
+
+    def drained_at(self, key: Hashable) -> Optional[float]:
+        """Clock time at which the key's state is empty again; this fully describes the state"""
+        return self._tat.get(key)
+
+    def restore(self, key: Hashable, drained_at: float) -> None:
+        self._tat[key] = drained_at
+
+    def export(self) -> Dict[Hashable, float]:
+        """Copy of every key's drained_at"""
+        return dict(self._tat)
+
+
+class TokenBucketLimit:
+    """Token bucket holding up to `count` tokens, refilled at count/window per second"""
+
+    def __init__(self, count: int, window: float, clock: Callable[[], float] = time.monotonic):
+        self.count = count
+        self.window = window
+        self.clock = clock
+        self._rate = count / window
+        # key -> [tokens, last_refill]; the list is mutated in place on every hit
+        self._buckets: Dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _refill(self, key: Hashable, now: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.count), now]
+        else:
+            bucket[0] = min(self.count, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+        return bucket
+
+    def hit(self, key: Hashable) -> RateDecision:
+        now = self.clock()
+        bucket = self._refill(key, now)
+        if bucket[0] < 1.0:
+            return RateDecision(False, 0, (1.0 - bucket[0]) / self._rate, (self.count - bucket[0]) / self._rate)
+        bucket[0] -= 1.0
+        return RateDecision(True, int(bucket[0]), 0.0, (self.count - bucket[0]) / self._rate)
+
+    def peek(self, key: Hashable) -> RateDecision:
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        tokens = self.count if bucket is None else min(self.count, bucket[0] + (now - bucket[1]) * self._rate)
+        retry_after = 0.0 if tokens >= 1.0 else (1.0 - tokens) / self._rate
+        return RateDecision(tokens >= 1.0, int(tokens), retry_after, (self.count - tokens) / self._rate)
+
+    def expire(self, key: Hashable) -> bool:
+        """Drop the key's bucket if it has refilled completely"""
+        if key not in self._buckets or self.peek(key).reset_after > 0:
+            return False
+        del self._buckets[key]
+        return True
+
+    def purge_expired(self) -> int:
+        expired = [key for key in self._buckets if self.peek(key).reset_after <= 0]
+        for key in expired:
+            del self._buckets[key]
+        return len(expired)
+
+    def reset(self, key: Hashable) -> None:
+        self._buckets.pop(key, None)
+
+    def drained_at(self, key: Hashable) -> Optional[float]:
+        """Clock time at which the bucket is full again; with linear refill this fully describes it"""
+        bucket = self._buckets.get(key)
+        return None if bucket is None else bucket[1] + (self.count - bucket[0]) / self._rate
+
+    def restore(self, key: Hashable, drained_at: float) -> None:
+        now = self.clock()
+        self._buckets[key] = [self.count - max(0.0, drained_at - now) * self._rate, now]
+
+    def export(self) -> Dict[Hashable, float]:
+        """Every key's drained_at"""
+        return {key: self.drained_at(key) for key in self._buckets}
+
+
+def load_limits_from_env() -> Dict[str, tuple]:
+    """Read the OTP limits from RATE_LIMIT_WINDOW, MAX_OTP_REQUESTS and MAX_OTP_ATTEMPTS"""
+    window = float(os.getenv("RATE_LIMIT_WINDOW", "300"))
+    return {
+        'otp_request': (int(os.getenv("MAX_OTP_REQUESTS", "3")), window),
+        'otp_verify': (int(os.getenv("MAX_OTP_ATTEMPTS", "5")), window),
+    }
+
+
+ALGORITHMS = {
+    'gcra': GcraLimit,
+    'sliding_window': GcraLimit,
+    'token_bucket': TokenBucketLimit,
+}
+
+
+class RateLimiter:
+    """Named limits declared once; actions without a limit are always allowed"""
+
+    def __init__(self, limits: Dict[str, tuple], algorithm: str = 'gcra', clock: Callable[[], float] = time.monotonic):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        limit_class = ALGORITHMS[algorithm]
+        self.limits = {
+            action: limit_class(count, window, clock)
+            for action, (count, window) in limits.items()
+        }
+
+    def __len__(self) -> int:
+        return sum(len(limit) for limit in self.limits.values())
+
+    def hit(self, action: str, key: Hashable) -> RateDecision:
+        """Consume one hit for key under the named limit"""
+        limit = self.limits.get(action)
+        return ALLOW_ALL if limit is None else limit.hit(key)
+
+    def peek(self, action: str, key: Hashable) -> RateDecision:
+        """Report the current state without consuming a hit"""
+        limit = self.limits.get(action)
+        return ALLOW_ALL if limit is None else limit.peek(key)
+
+    def expire(self, action: str, key: Hashable) -> bool:
+        limit = self.limits.get(action)
+        return limit is not None and limit.expire(key)
+
+    def purge_expired(self) -> int:
+        """Drop all drained keys; returns how many were removed"""
+        return sum(limit.purge_expired() for limit in self.limits.values())
+
+    def reset(self, action: str, key: Hashable) -> None:
+        limit = self.limits.get(action)
+        if limit is not None:
+            limit.reset(key)
+
+    def drained_at(self, action: str, key: Hashable) -> Optional[float]:
+        limit = self.limits.get(action)
+        return None if limit is None else limit.drained_at(key)
+
+    def restore(self, action: str, key: Hashable, drained_at: float) -> None:
+        """Reinstate saved state; ignored for actions that no longer have a limit"""
+        limit = self.limits.get(action)
+        if limit is not None:
+            limit.restore(key, drained_at)
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+RouteHandler = Callable[[Update, Any, str], Awaitable[None]]
+
+
+class CallbackRouter:
+    """Dispatches callback queries by the prefix of their data through a dict
+
+    Callback data has the form `route` or `route:payload`; the handler is
+    awaited as `handler(update, context, payload)`, so the same function can
+    also back a command (called with an empty payload). The query is answered
+    concurrently with the handler rather than before it.
+    """
+
+    def __init__(self, fallback: Optional[RouteHandler] = None):
+        self.routes: Dict[str, RouteHandler] = {}
+        self.fallback = fallback
+        self.dispatched = 0
+        self.unrouted = 0
+
+    def add(self, prefix: str, handler: RouteHandler) -> None:
+        if ':' in prefix:
+            raise ValueError(f"Route prefix may not contain ':': {prefix}")
+        if prefix in self.routes:
+            raise ValueError(f"Route already registered: {prefix}")
+        self.routes[prefix] = handler
+
+    def route(self, *prefixes: str):
+        """Decorator registering a handler under one or more prefixes"""
+        def decorator(handler: RouteHandler) -> RouteHandler:
+            for prefix in prefixes:
+                self.add(prefix, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[Optional[RouteHandler], str]:
+        """Return (handler, payload) for callback data; handler is the fallback if unrouted"""
+        prefix, _, payload = data.partition(':')
+        handler = self.routes.get(prefix)
+        if handler is None:
+            return self.fallback, payload
+        return handler, payload
+
+    async def dispatch(self, update: Update, context) -> None:
+        query = update.callback_query
+        handler, payload = self.resolve(query.data or "")
+        answering = asyncio.create_task(query.answer())
+        try:
+            if handler is None:
+                self.unrouted += 1
+                logger.warning("No route for callback data %r", query.data)
+            else:
+                self.dispatched += 1
+                await handler(update, context, payload)
+        finally:
+            try:
+                await answering
+            except Exception as e:
+                logger.error("Failed to answer callback query: %s", e)
+
+    def stats(self) -> dict:
+        return {'routes': len(self.routes), 'dispatched': self.dispatched, 'unrouted': self.unrouted}
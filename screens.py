@@ -0,0 +1,121 @@
+# Static screens, built once at import. PTB's keyboard objects are immutable,
+# so the same instances are shared by every update.
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👤 My Profile", callback_data="profile")],
+    [InlineKeyboardButton("💰 Check Balance", callback_data="balance")],
+    [InlineKeyboardButton("📤 Transfer Money", callback_data="transfer")]
+])
+
+VERIFY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📱 Verify Phone Number", callback_data="verify_phone")]
+])
+
+PROFILE_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📊 Transaction History", callback_data="transfer_history"),
+        InlineKeyboardButton("✏️ Edit Profile", callback_data="edit_profile")
+    ],
+    [InlineKeyboardButton("⏳ Pending Requests", callback_data="requests")],
+    [InlineKeyboardButton("« Back to Menu", callback_data="back_to_main")]
+])
+
+TRANSFER_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💸 Send Money", callback_data="send_money")],
+    [InlineKeyboardButton("📥 Request Money", callback_data="request_money")],
+    [InlineKeyboardButton("« Back to Menu", callback_data="back_to_main")]
+])
+
+CONFIRM_TRANSFER_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("✅ Confirm", callback_data="transfer_confirm"),
+        InlineKeyboardButton("❌ Cancel", callback_data="transfer_cancel")
+    ]
+])
+
+BACK_TO_MENU_BUTTON = InlineKeyboardButton("« Back to Menu", callback_data="back_to_main")
+BACK_TO_MENU_KEYBOARD = InlineKeyboardMarkup([[BACK_TO_MENU_BUTTON]])
+
+WELCOME_TEXT = (
+    "🎉 *Welcome to B8NKR!*\n\n"
+    "To get started, please verify your identity:\n\n"
+    "1️⃣ Click the button below to verify your phone number\n\n"
+    "💡 Your security is our priority."
+)
+
+WELCOME_BACK_TEXT = (
+    "👋 Welcome back!\n\n"
+    "🏦 *B8NKR Main Menu*\n"
+    "What would you like to do?"
+)
+
+MENU_TEXT = (
+    "🏦 *Welcome to B8NKR*\n"
+    "What would you like to do?"
+)
+
+HELP_TEXT = (
+    "🔍 *Available Commands*\n\n"
+    "/start - Begin verification process\n"
+    "/menu - Show main menu\n"
+    "/profile - View your profile\n"
+    "/balance - Check your balance\n"
+    "/transfer - Send or request money\n"
+    "/history - View transaction history\n"
+    "/requests - Pay or decline money requests\n"
+    "/cancel - Cancel current operation\n"
+    "/help - Show this help message\n\n"
+    "💡 *Tips*:\n"
+    "• Keep your phone number up to date\n"
+    "• Never share your OTP with anyone\n"
+    "• Contact support if you notice suspicious activity"
+)
+
+TRANSFER_TEXT = (
+    "💸 *Transfer Money*\n\n"
+    "Choose an option:"
+)
+
+NOT_VERIFIED_TEXT = (
+    "⚠️ Please verify your phone number first!\n"
+    "Use /start to begin verification."
+)
+
+ENTER_PHONE_TEXT = (
+    "📱 Please send your phone number in international format\n"
+    "Example: +14155552671\n\n"
+    "ℹ️ Your number will only be used for verification."
+)
+
+ENTER_RECIPIENT_TEXT = (
+    "📱 Enter recipient's phone number:\n"
+    "Example: +14155552671\n\n"
+    "Type /cancel to cancel"
+)
+
+ENTER_SENDER_TEXT = (
+    "📱 Enter sender's phone number:\n"
+    "Example: +14155552671\n\n"
+    "Type /cancel to cancel"
+)
+
+CANCELLED_TEXT = (
+    "🔄 Current operation cancelled.\n"
+    "Type /menu to see available options."
+)
+
+TRANSFER_CANCELLED_TEXT = (
+    "🔄 Transfer cancelled.\n"
+    "Type /menu to see available options."
+)
+
+UNKNOWN_MESSAGE_TEXT = (
+    "❓ I don't understand that command.\n"
+    "Use /menu to see available options."
+)
+
+ERROR_TEXT = (
+    "❌ An error occurred.\n"
+    "Please try again or contact support if the problem persists."
+)
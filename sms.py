@@ -0,0 +1,503 @@
+import asyncio
+import logging
+import random
+from collections import deque
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from logging_setup import bind_log_context, current_handler, current_user_id, reset_log_context
+from tracing import SMS, Tracer
+
+logger = logging.getLogger(__name__)
+
+# Called with True once the SMS was accepted by the gateway, False after all retries failed
+SendCallback = Callable[[bool], Awaitable[None]]
+
+
+class SmsGateway:
+    """Base class for SMS transports used by the dispatcher"""
+
+    name = 'sms'
+
+    async def start(self) -> None:
+        """Open connections (called from inside the running event loop)"""
+
+    async def send(self, to: str, body: str) -> None:
+        """Send a single SMS, raising on failure"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release connections"""
+
+
+class TwilioSmsGateway(SmsGateway):
+    """Twilio transport using the native async HTTP client with a pooled keep-alive session"""
+
+    name = 'twilio'
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str, timeout: float = 10.0):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.timeout = timeout
+        self._http_client = None
+        self._client = None
+
+    async def start(self) -> None:
+        # The aiohttp session must be created inside the running loop
+        from twilio.http.async_http_client import AsyncTwilioHttpClient
+        from twilio.rest import Client
+
+        self._http_client = AsyncTwilioHttpClient(pool_connections=True, timeout=self.timeout)
+        self._client = Client(self.account_sid, self.auth_token, http_client=self._http_client)
+
+    async def send(self, to: str, body: str) -> None:
+        if self._client is None:
+            await self.start()
+        await self._client.messages.create_async(to=to, from_=self.from_number, body=body)
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.close()
+            self._http_client = None
+            self._client = None
+
+
+class HttpSmsGateway(SmsGateway):
+    """Generic HTTP provider: POSTs {"to", "from", "body"} as JSON with a bearer token, any 2xx is an ack"""
+
+    def __init__(self, url: str, token: str = '', from_number: str = '', timeout: float = 10.0, name: str = 'http'):
+        self.url = url
+        self.token = token
+        self.from_number = from_number
+        self.timeout = timeout
+        self.name = name
+        self._client = None
+
+    async def start(self) -> None:
+        headers = {'Authorization': f"Bearer {self.token}"} if self.token else {}
+        self._client = httpx.AsyncClient(timeout=self.timeout, headers=headers)
+
+    async def send(self, to: str, body: str) -> None:
+        if self._client is None:
+            await self.start()
+        response = await self._client.post(self.url, json={'to': to, 'from': self.from_number, 'body': body})
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class FakeSmsGateway(SmsGateway):
+    """Local gateway for offline benchmarks: simulates latency and failures without network I/O
+
+    A `slow_rate` share of sends takes `slow_latency` instead of `latency`.
+    All knobs can be changed while running to inject brownouts and outages.
+    """
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0, keep_last: int = 1000,
+                 slow_rate: float = 0.0, slow_latency: float = 0.0, name: str = 'fake'):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.name = name
+        self.sent = 0
+        self.failed = 0
+        self.outbox = deque(maxlen=keep_last)
+
+    async def send(self, to: str, body: str) -> None:
+        latency = self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failed += 1
+            raise RuntimeError("Simulated SMS gateway failure")
+        self.sent += 1
+        self.outbox.append((to, body))
+
+
+class ProviderHealth:
+    """Recent latencies and outcomes of one provider, with a circuit breaker
+
+    The breaker opens when the error rate over the last `window` sends
+    reaches `error_threshold` (once there are `min_requests` of them). An
+    open provider is skipped; after `open_seconds` a single probe send is let
+    through, which closes the breaker or reopens it for twice as long, up
+    to `open_max`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, window: int = 100, min_requests: int = 10, error_threshold: float = 0.5,
+                 open_seconds: float = 5.0, open_max: float = 120.0, clock=time.monotonic):
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.open_max = open_max
+        self.clock = clock
+        self.state = self.CLOSED
+        self.sent = 0
+        self.failed = 0
+        self.opened = 0
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._errors = 0
+        self._cooldown = open_seconds
+        self._retry_at = 0.0
+
+    def acquire(self) -> bool:
+        """Whether a send may go to this provider now; claims the probe of an open breaker"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.clock() >= self._retry_at:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def release(self) -> None:
+        """An acquired send was cancelled before it finished"""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+    def record(self, seconds: float, ok: bool) -> None:
+        if ok:
+            self.sent += 1
+            self._latencies.append(seconds)
+        else:
+            self.failed += 1
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self.state = self.CLOSED
+                self._cooldown = self.open_seconds
+                self._outcomes.clear()
+                self._errors = 0
+            else:
+                self._open(min(self.open_max, self._cooldown * 2))
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._errors -= not self._outcomes[0]
+        self._outcomes.append(ok)
+        self._errors += not ok
+        if self.state == self.CLOSED and len(self._outcomes) >= self.min_requests \
+                and self._errors >= self.error_threshold * len(self._outcomes):
+            self._open(self.open_seconds)
+
+    def _open(self, cooldown: float) -> None:
+        self.state = self.OPEN
+        self.opened += 1
+        self._cooldown = cooldown
+        self._retry_at = self.clock() + cooldown
+
+    @property
+    def error_rate(self) -> float:
+        return self._errors / len(self._outcomes) if self._outcomes else 0.0
+
+    def latency(self, p: float) -> Optional[float]:
+        """Latency percentile of recent acked sends, None without enough samples"""
+        if len(self._latencies) < self.min_requests:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'sent': self.sent,
+            'failed': self.failed,
+            'opened': self.opened,
+            'error_rate': self.error_rate,
+            'p95': self.latency(0.95) or 0.0,
+        }
+
+
+class FailoverSmsGateway(SmsGateway):
+    """Sends through several providers in priority order, hedging slow sends and failing over on errors
+
+    Providers whose breaker is open are skipped (if all are, the first one
+    is tried anyway). When a send hasn't been acked within its provider's
+    recent p95 latency, clamped to `hedge_min`..`hedge_max`, the same message
+    goes to the next provider as well; the first ack wins and the other
+    sends are cancelled. Since every attempt carries the same body, the user
+    gets the same code whichever SMS arrives. A failed send moves on to the
+    next provider straight away, and an error is raised once all have failed.
+
+    Identical messages (same number and body) are deduplicated: a message
+    already in flight is awaited rather than sent again, and one acked in
+    the last `dedup_seconds` is not resent.
+    """
+
+    def __init__(self, providers: List[SmsGateway], hedge: bool = True, hedge_min: float = 0.2,
+                 hedge_max: float = 5.0, hedge_default: float = 2.0, dedup_seconds: float = 60.0,
+                 clock=time.monotonic, **health_options):
+        if not providers:
+            raise ValueError("At least one SMS provider is required")
+        if len({provider.name for provider in providers}) != len(providers):
+            raise ValueError("SMS provider names must be unique")
+        self.providers = providers
+        self.health = {provider.name: ProviderHealth(clock=clock, **health_options) for provider in providers}
+        self.hedge = hedge
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.hedge_default = hedge_default
+        self.dedup_seconds = dedup_seconds
+        self.clock = clock
+        self.hedged = 0
+        self.failovers = 0
+        self.deduplicated = 0
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._acked: Dict[Tuple[str, str], float] = {}
+
+    @property
+    def name(self) -> str:
+        return '+'.join(provider.name for provider in self.providers)
+
+    async def start(self) -> None:
+        for provider in self.providers:
+            await provider.start()
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            try:
+                await provider.close()
+            except Exception as e:
+                logger.error("Failed to close SMS provider %s: %s", provider.name, e)
+
+    async def send(self, to: str, body: str) -> None:
+        key = (to, body)
+        now = self.clock()
+        # Acks expire in insertion order
+        while self._acked:
+            oldest = next(iter(self._acked))
+            if self._acked[oldest] > now:
+                break
+            del self._acked[oldest]
+        if key in self._acked:
+            self.deduplicated += 1
+            return
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.deduplicated += 1
+            await asyncio.shield(pending)
+            return
+
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting on the future, so don't warn about an unretrieved error
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            await self._send(to, body)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(None)
+            self._acked[key] = self.clock() + self.dedup_seconds
+        finally:
+            del self._in_flight[key]
+
+    def _hedge_delay(self, provider: SmsGateway) -> float:
+        p95 = self.health[provider.name].latency(0.95)
+        return min(self.hedge_max, max(self.hedge_min, self.hedge_default if p95 is None else p95))
+
+    async def _send(self, to: str, body: str) -> None:
+        remaining = iter(self.providers)
+
+        def next_provider() -> Optional[SmsGateway]:
+            for provider in remaining:
+                if self.health[provider.name].acquire():
+                    return provider
+            return None
+
+        attempts: Dict[asyncio.Task, Tuple[SmsGateway, float]] = {}
+
+        def attempt(provider: SmsGateway) -> None:
+            task = asyncio.create_task(provider.send(to, body), name=f"sms-{provider.name}")
+            attempts[task] = (provider, self.clock())
+
+        provider = next_provider()
+        if provider is None:
+            logger.warning("All SMS provider breakers are open, trying the primary anyway")
+            provider = self.providers[0]
+        attempt(provider)
+        last_error = None
+        exhausted = len(self.providers) == 1
+        try:
+            while attempts:
+                timeout = self._hedge_delay(provider) if self.hedge and not exhausted else None
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    provider = next_provider()
+                    if provider is None:
+                        exhausted = True
+                    else:
+                        self.hedged += 1
+                        attempt(provider)
+                    continue
+                for task in done:
+                    sender, started = attempts.pop(task)
+                    error = task.exception()
+                    self.health[sender.name].record(self.clock() - started, error is None)
+                    if error is None:
+                        return
+                    last_error = error
+                    logger.warning("SMS provider %s failed: %s", sender.name, error)
+                if not attempts and not exhausted:
+                    provider = next_provider()
+                    if provider is None:
+                        exhausted = True
+                    else:
+                        self.failovers += 1
+                        attempt(provider)
+            raise last_error
+        finally:
+            for task, (sender, _) in attempts.items():
+                task.cancel()
+                self.health[sender.name].release()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Hedge, failover and dedup counters plus health per provider"""
+        return {
+            'hedged': self.hedged,
+            'failovers': self.failovers,
+            'deduplicated': self.deduplicated,
+            'providers': {name: health.stats() for name, health in self.health.items()},
+        }
+
+
+class _SmsJob:
+    __slots__ = ("to", "body", "callback", "user_id", "handler")
+
+    def __init__(self, to: str, body: str, callback: Optional[SendCallback]):
+        self.to = to
+        self.body = body
+        self.callback = callback
+        # The submitting update, so worker logs and spans are attributed to it
+        self.user_id = current_user_id.get()
+        self.handler = current_handler.get()
+
+
+class SmsDispatcher:
+    """Bounded pool of async workers delivering SMS off the update handlers' critical path"""
+
+    def __init__(
+        self,
+        gateway: SmsGateway,
+        concurrency: int = 8,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        queue_size: int = 1000,
+        tracer: Optional[Tracer] = None,
+    ):
+        self.gateway = gateway
+        self.tracer = tracer
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_size = queue_size
+        self._queue = None
+        self._workers = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        """Open the gateway and spawn the worker pool"""
+        if self.running:
+            return
+        await self.gateway.start()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"sms-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info("SMS dispatcher started with %d workers", self.concurrency)
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Let queued messages drain, then stop the workers and close the gateway"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("SMS dispatcher stopped with %d messages undelivered", self.pending)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.gateway.close()
+        logger.info("SMS dispatcher stopped")
+
+    def submit(self, to: str, body: str, callback: Optional[SendCallback] = None) -> bool:
+        """Queue an SMS for delivery; returns False if the dispatcher is not running or is full"""
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait(_SmsJob(to, body, callback))
+            return True
+        except asyncio.QueueFull:
+            logger.warning("SMS queue full, rejecting message")
+            return False
+
+    async def send(self, to: str, body: str) -> bool:
+        """Queue an SMS and wait for its delivery outcome"""
+        future = asyncio.get_running_loop().create_future()
+
+        async def _resolve(success: bool) -> None:
+            if not future.done():
+                future.set_result(success)
+
+        if not self.submit(to, body, _resolve):
+            return False
+        return await future
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            log_context = bind_log_context(job.user_id, job.handler)
+            try:
+                success = await self._deliver(job)
+                if job.callback is not None:
+                    try:
+                        await job.callback(success)
+                    except Exception as e:
+                        logger.error("SMS completion callback failed: %s", e)
+            finally:
+                reset_log_context(log_context)
+                self._queue.task_done()
+
+    def _trace(self, started: float, outcome: str) -> None:
+        if self.tracer is not None:
+            self.tracer.record(SMS, time.perf_counter() - started, outcome)
+
+    async def _deliver(self, job: _SmsJob) -> bool:
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                await self.gateway.send(job.to, job.body)
+                self._trace(started, "sent")
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._trace(started, "failed")
+                logger.error("Failed to send SMS (attempt %d/%d): %s", attempt + 1, self.max_retries + 1, e)
+                if attempt < self.max_retries:
+                    delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                    await asyncio.sleep(delay * (0.5 + random.random() / 2))
+        return False
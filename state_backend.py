@@ -0,0 +1,485 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from array import array
+from functools import partial
+from typing import Dict, Optional, Tuple
+
+from compact_state import ColdKeys, OtpTable, PhoneIndex, pack_otp, pack_phone, unpack_phone
+from expiry import ExpiryEngine
+from rate_limiter import RateDecision, RateLimiter, ALLOW_ALL
+from state_snapshot import (OP_OTP_DROP, OP_OTP_PUT, OP_PHONE_DROP, OP_PHONE_SET, OP_RATE, Snapshot, StateJournal,
+                            read_snapshot, wall_offset, write_snapshot)
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """Storage for pending OTPs, the phone uniqueness index and rate-limit state
+
+    Every operation is a single atomic step so several bot processes sharing a
+    backend see a consistent view.
+    """
+
+    async def start(self) -> None:
+        """Open connections and start background work"""
+
+    async def stop(self) -> None:
+        """Stop background work and close connections"""
+
+    async def store_otp(self, user_id: int, phone: str, otp: str, ttl: float) -> bool:
+        """Store an OTP and claim the phone as pending; False if another user holds the phone"""
+        raise NotImplementedError
+
+    async def verify_otp(self, user_id: int, otp: str) -> Optional[str]:
+        """Consume a matching OTP and mark its phone verified; returns the phone or None"""
+        raise NotImplementedError
+
+    async def cancel_otp(self, user_id: int, otp: str) -> bool:
+        """Drop the user's OTP if it is still `otp` and release its pending phone; False if it was replaced or gone"""
+        raise NotImplementedError
+
+    async def get_phone_owner(self, phone: str) -> Optional[Tuple[int, bool]]:
+        """Return (user_id, verified) for the phone, or None"""
+        raise NotImplementedError
+
+    async def rate_limit(self, action: str, user_id: int) -> RateDecision:
+        """Consume one hit of the named rate limit"""
+        raise NotImplementedError
+
+    async def sweep(self) -> Tuple[int, int]:
+        """Drop expired OTPs and rate-limit state; returns (otps, rate_limits) removed"""
+        return 0, 0
+
+    async def stats(self) -> dict:
+        """Store sizes and backend counters"""
+        return {}
+
+
+class InMemoryStateBackend(StateBackend):
+    """Process-local backend in compact columns; expired entries are evicted by an ExpiryEngine
+
+    Phones must be E.164 and OTPs digit strings, which are packed into ints.
+    OTP deadlines are whole seconds on the monotonic clock, rounded up.
+
+    With a snapshot_path the state survives restarts: every change is appended
+    to a journal that is fsync'd every `journal_interval` seconds, and every
+    `snapshot_interval` seconds and on stop the whole state is written to a
+    snapshot and the journal restarted. On start the snapshot's columns are
+    mapped and copied in as they are (records move into the dicts when first
+    touched, expired ones are dropped then or by sweep) and the journal is
+    replayed on top.
+    """
+
+    def __init__(self, limits: Dict[str, tuple], algorithm: str = 'gcra', snapshot_path: Optional[str] = None,
+                 snapshot_interval: float = 60.0, journal_interval: float = 1.0):
+        self.expiry = ExpiryEngine()
+        self.clock = self.expiry.clock
+        self.rate_limiter = RateLimiter(limits, algorithm, clock=self.clock)
+        self._rate_evictors = {action: partial(self.rate_limiter.expire, action) for action in limits}
+        self.otp_store = OtpTable()
+        self.phone_index = PhoneIndex()
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.journal_interval = journal_interval
+        self.journal: Optional[StateJournal] = None
+        self._persist_task = None
+        self._writing = None
+        # action -> (user ids, drained_at, wall offset, last drained_at) from the snapshot
+        self._cold_rates = {}
+
+    async def start(self) -> None:
+        if self.snapshot_path:
+            self._restore()
+            self._persist_task = asyncio.create_task(self._persist(), name="state-snapshot")
+        self.expiry.start()
+
+    async def stop(self) -> None:
+        await self.expiry.stop()
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            await asyncio.gather(self._persist_task, return_exceptions=True)
+            self._persist_task = None
+        if self.journal is not None:
+            if self._writing is not None:
+                await asyncio.gather(self._writing, return_exceptions=True)
+            try:
+                size = await self.snapshot()
+                logger.info("Saved state snapshot (%d bytes, %d pending OTPs)", size, len(self.otp_store))
+            except Exception as e:
+                logger.error("Error saving state snapshot: %s", e)
+            self.journal.close()
+            self.journal = None
+
+    def _restore(self) -> None:
+        started = time.perf_counter()
+        self.journal = StateJournal(f"{self.snapshot_path}.journal", sorted(self.rate_limiter.limits), self.clock)
+        # Before reading anything: another process may still be writing its final snapshot
+        self.journal.lock()
+        snapshot = read_snapshot(self.snapshot_path)
+        offset = wall_offset(self.clock)
+        now = self.clock()
+        if snapshot is not None:
+            self.otp_store = OtpTable.from_columns(*snapshot.otp_columns, epoch=snapshot.otp_epoch - offset)
+            self.phone_index = PhoneIndex.from_columns(*snapshot.phone_columns)
+            # Looked up on each user's next hit; all of it has drained one window later
+            for action, (keys, drained, until) in snapshot.rates.items():
+                if action in self._rate_evictors and until - offset > now:
+                    self._cold_rates[action] = (ColdKeys(keys), drained, offset, until - offset)
+        records = self.journal.records(snapshot)
+        for op, _, owner, code, phone, at, action in records:
+            if op == OP_OTP_PUT:
+                self.otp_store.put(owner, code, phone, at - offset)
+                self.expiry.schedule_member(('otp',), owner, at - offset - now, self._evict_otp)
+            elif op == OP_OTP_DROP:
+                self.otp_store.pop(owner)
+            elif op == OP_PHONE_SET:
+                self.phone_index.set_packed(phone, owner)
+            elif op == OP_PHONE_DROP:
+                self.phone_index.drop(phone)
+            elif op == OP_RATE and action is not None:
+                self._restore_rate(action, owner, at - offset, now)
+        logger.info(
+            "Restored %d pending OTPs, %d phones and %d rate limits (%d journal records) in %.1fms",
+            len(self.otp_store), len(self.phone_index), len(self.rate_limiter), len(records),
+            (time.perf_counter() - started) * 1000
+        )
+
+    def _restore_rate(self, action: str, user_id: int, drained_at: float, now: float) -> None:
+        if drained_at > now and action in self._rate_evictors:
+            self.rate_limiter.restore(action, user_id, drained_at)
+            self.expiry.schedule_member(('rate', action), user_id, drained_at - now, self._rate_evictors[action])
+
+    async def _persist(self) -> None:
+        last_snapshot = self.clock()
+        while True:
+            await asyncio.sleep(self.journal_interval)
+            try:
+                await asyncio.to_thread(os.fsync, self.journal.flush())
+                if self.clock() - last_snapshot >= self.snapshot_interval:
+                    last_snapshot = self.clock()
+                    await self.snapshot()
+            except Exception as e:
+                logger.error("Error persisting state: %s", e)
+
+    async def snapshot(self) -> int:
+        """Write the whole state to the snapshot file and restart the journal; returns the file size
+
+        Only copying the columns and dicts happens on the event loop; sorting
+        and writing run on a thread.
+        """
+        started = time.perf_counter()
+        offset = wall_offset(self.clock)
+        log_id, log_offset = self.journal.log_id, self.journal.tell()
+        otp_capture = self.otp_store.capture()
+        phone_capture = self.phone_index.capture()
+        rates = {action: limit.export() for action, limit in self.rate_limiter.limits.items()}
+        cold_rates = {
+            action: (keys.keys, bytes(keys.dead), drained)
+            for action, (keys, drained, _, _) in self._cold_rates.items()
+        }
+        epoch = self.otp_store.epoch + offset
+        captured = time.perf_counter()
+
+        def rate_columns(action: str) -> Tuple[array, array, float]:
+            # Wall-clock drained_at per user: cold entries not yet touched, then live state
+            merged = {}
+            if action in cold_rates:
+                keys, dead, drained = cold_rates[action]
+                merged = {user_id: drained[row] for row, user_id in enumerate(keys) if not dead[row]}
+            merged.update((user_id, at + offset) for user_id, at in rates[action].items())
+            return array('q', merged), array('d', merged.values()), max(merged.values(), default=0.0)
+
+        def build_and_write() -> int:
+            return write_snapshot(self.snapshot_path, Snapshot(
+                log_id, log_offset, epoch, OtpTable.columns(otp_capture), PhoneIndex.columns(phone_capture),
+                {action: rate_columns(action) for action in rates}
+            ))
+
+        self._writing = asyncio.ensure_future(asyncio.to_thread(build_and_write))
+        size = await asyncio.shield(self._writing)
+        self._writing = None
+        self.journal.rotate(log_id, log_offset)
+        logger.debug(
+            "State snapshot: %d bytes, %.1fms on the loop, %.1fms total",
+            size, (captured - started) * 1000, (time.perf_counter() - started) * 1000
+        )
+        return size
+
+    async def store_otp(self, user_id: int, phone: str, otp: str, ttl: float) -> bool:
+        number, code = pack_phone(phone), pack_otp(otp)
+        if number is None or code is None:
+            raise ValueError("phone must be E.164 and the OTP a digit string")
+        owner = self.phone_index.get(number)
+        if owner is not None and owner[0] != user_id:
+            return False
+        journal = self.journal
+        previous = self.otp_store.get(user_id)
+        if previous is not None and previous.phone != number:
+            if self.phone_index.release_pending(previous.phone, user_id) and journal:
+                journal.phone_drop(previous.phone)
+        if owner is None:
+            self.phone_index.set(number, user_id, verified=False)
+            if journal:
+                journal.phone_set(number, user_id, False)
+        deadline = math.ceil(self.clock() + ttl)
+        self.otp_store.put(user_id, code, number, deadline)
+        if journal:
+            journal.otp_put(user_id, code, number, deadline)
+        self.expiry.schedule_member(('otp',), user_id, ttl, self._evict_otp)
+        return True
+
+    async def verify_otp(self, user_id: int, otp: str) -> Optional[str]:
+        record = self.otp_store.get(user_id)
+        if record is None:
+            return None
+        if self.clock() >= record.deadline:
+            self._drop_otp(user_id)
+            return None
+        if pack_otp(otp) != record.code:
+            return None
+        self.otp_store.pop(user_id)
+        self.phone_index.set(record.phone, user_id, verified=True)
+        if self.journal:
+            self.journal.otp_drop(user_id)
+            self.journal.phone_set(record.phone, user_id, True)
+        return unpack_phone(record.phone)
+
+    async def cancel_otp(self, user_id: int, otp: str) -> bool:
+        record = self.otp_store.get(user_id)
+        if record is None or record.code != pack_otp(otp):
+            return False
+        return self._drop_otp(user_id)
+
+    async def get_phone_owner(self, phone: str) -> Optional[Tuple[int, bool]]:
+        number = pack_phone(phone)
+        return None if number is None else self.phone_index.get(number)
+
+    async def rate_limit(self, action: str, user_id: int) -> RateDecision:
+        if self._cold_rates:
+            self._warm_rate(action, user_id)
+        decision = self.rate_limiter.hit(action, user_id)
+        if decision.allowed and decision.reset_after:
+            self.expiry.schedule_member(('rate', action), user_id, decision.reset_after, self._rate_evictors[action])
+            if self.journal:
+                self.journal.rate(action, user_id, self.rate_limiter.drained_at(action, user_id))
+        return decision
+
+    def _warm_rate(self, action: str, user_id: int) -> None:
+        cold = self._cold_rates.get(action)
+        if cold is None:
+            return
+        keys, drained, offset, last = cold
+        now = self.clock()
+        if now >= last:
+            del self._cold_rates[action]
+            return
+        row = keys.find(user_id)
+        if row >= 0:
+            keys.kill(row)
+            self._restore_rate(action, user_id, drained[row] - offset, now)
+
+    async def sweep(self) -> Tuple[int, int]:
+        now = self.clock()
+        for action in [action for action, cold in self._cold_rates.items() if now >= cold[3]]:
+            del self._cold_rates[action]
+        expired_otps = self.otp_store.expired(self.clock())
+        for user_id in expired_otps:
+            self._drop_otp(user_id)
+        return len(expired_otps), self.rate_limiter.purge_expired()
+
+    async def stats(self) -> dict:
+        return {
+            'otp_store': len(self.otp_store),
+            'rate_limiter': len(self.rate_limiter) + sum(cold[0].live for cold in self._cold_rates.values()),
+            'phone_index': len(self.phone_index),
+            'expiry': self.expiry.stats(),
+        }
+
+    def _drop_otp(self, user_id: int) -> bool:
+        record = self.otp_store.pop(user_id)
+        if record is None:
+            return False
+        released = self.phone_index.release_pending(record.phone, user_id)
+        if self.journal:
+            self.journal.otp_drop(user_id)
+            if released:
+                self.journal.phone_drop(record.phone)
+        return True
+
+    def _evict_otp(self, user_id: int) -> bool:
+        deadline = self.otp_store.deadline(user_id)
+        if deadline is None or deadline > self.clock():
+            return False
+        return self._drop_otp(user_id)
+
+
+# KEYS: otp key, phone key. ARGV: otp, phone, ttl_ms, user_id, phone key prefix
+_STORE_OTP_SCRIPT = """
+local owner = redis.call('GET', KEYS[2])
+if owner and owner ~= ARGV[4] .. ':0' and owner ~= ARGV[4] .. ':1' then
+    return 0
+end
+local previous = redis.call('HGET', KEYS[1], 'phone')
+if previous and previous ~= ARGV[2] then
+    local previous_key = ARGV[5] .. previous
+    if redis.call('GET', previous_key) == ARGV[4] .. ':0' then
+        redis.call('DEL', previous_key)
+    end
+end
+if owner ~= ARGV[4] .. ':1' then
+    redis.call('SET', KEYS[2], ARGV[4] .. ':0', 'PX', ARGV[3])
+end
+redis.call('HSET', KEYS[1], 'otp', ARGV[1], 'phone', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# KEYS: otp key. ARGV: otp, user_id, phone key prefix
+_VERIFY_OTP_SCRIPT = """
+local data = redis.call('HMGET', KEYS[1], 'otp', 'phone')
+if not data[1] or data[1] ~= ARGV[1] then
+    return false
+end
+redis.call('DEL', KEYS[1])
+redis.call('SET', ARGV[3] .. data[2], ARGV[2] .. ':1')
+return data[2]
+"""
+
+# KEYS: otp key. ARGV: otp, user_id, phone key prefix
+_CANCEL_OTP_SCRIPT = """
+local data = redis.call('HMGET', KEYS[1], 'otp', 'phone')
+if not data[1] or data[1] ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+local phone_key = ARGV[3] .. data[2]
+if redis.call('GET', phone_key) == ARGV[2] .. ':0' then
+    redis.call('DEL', phone_key)
+end
+return 1
+"""
+
+# GCRA on the server clock. KEYS: limit key. ARGV: interval_ms, window_ms
+# Returns {allowed, remaining, retry_after_ms, reset_after_ms}
+_GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+if new_tat - now > window then
+    return {0, 0, new_tat - window - now, tat - now}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, math.floor((window - (new_tat - now)) / interval), 0, new_tat - now}
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """Shared backend on any Redis-protocol server
+
+    Each operation runs as one server-side Lua script, so it is atomic and costs
+    a single round trip. Expiry is handled by server-side TTLs. Rate limits
+    always use GCRA on the server clock, whatever RATE_LIMIT_ALGORITHM says.
+    Pass `client` to run against a stand-in such as fakeredis.
+    """
+
+    def __init__(self, limits: Dict[str, tuple], url: str = "redis://localhost:6379/0",
+                 prefix: str = "b8nkr:", client=None):
+        self.limits = {
+            action: (int(window * 1000 / count), int(window * 1000))
+            for action, (count, window) in limits.items()
+        }
+        self.url = url
+        self.prefix = prefix
+        self.client = client
+        self._owns_client = client is None
+        self._scripts = {}
+
+    async def start(self) -> None:
+        if self.client is None:
+            # Optional dependency, only needed when STATE_BACKEND=redis
+            import redis.asyncio as redis
+            self.client = redis.from_url(self.url, decode_responses=True)
+        self._scripts = {
+            'store_otp': self.client.register_script(_STORE_OTP_SCRIPT),
+            'verify_otp': self.client.register_script(_VERIFY_OTP_SCRIPT),
+            'cancel_otp': self.client.register_script(_CANCEL_OTP_SCRIPT),
+            'gcra': self.client.register_script(_GCRA_SCRIPT),
+        }
+        await self.client.ping()
+        logger.info("Connected to Redis state backend")
+
+    async def stop(self) -> None:
+        if self.client is not None and self._owns_client:
+            await self.client.aclose()
+            self.client = None
+
+    def _otp_key(self, user_id: int) -> str:
+        return f"{self.prefix}otp:{user_id}"
+
+    def _phone_key(self, phone: str) -> str:
+        return f"{self.prefix}phone:{phone}"
+
+    async def store_otp(self, user_id: int, phone: str, otp: str, ttl: float) -> bool:
+        result = await self._scripts['store_otp'](
+            keys=[self._otp_key(user_id), self._phone_key(phone)],
+            args=[otp, phone, int(ttl * 1000), user_id, f"{self.prefix}phone:"],
+        )
+        return bool(result)
+
+    async def verify_otp(self, user_id: int, otp: str) -> Optional[str]:
+        result = await self._scripts['verify_otp'](
+            keys=[self._otp_key(user_id)],
+            args=[otp, user_id, f"{self.prefix}phone:"],
+        )
+        return _to_str(result) if result else None
+
+    async def cancel_otp(self, user_id: int, otp: str) -> bool:
+        result = await self._scripts['cancel_otp'](
+            keys=[self._otp_key(user_id)],
+            args=[otp, user_id, f"{self.prefix}phone:"],
+        )
+        return bool(result)
+
+    async def get_phone_owner(self, phone: str) -> Optional[Tuple[int, bool]]:
+        value = await self.client.get(self._phone_key(phone))
+        if value is None:
+            return None
+        user_id, verified = _to_str(value).rsplit(':', 1)
+        return int(user_id), verified == '1'
+
+    async def rate_limit(self, action: str, user_id: int) -> RateDecision:
+        limit = self.limits.get(action)
+        if limit is None:
+            return ALLOW_ALL
+        allowed, remaining, retry_after, reset_after = await self._scripts['gcra'](
+            keys=[f"{self.prefix}rl:{action}:{user_id}"],
+            args=list(limit),
+        )
+        return RateDecision(bool(allowed), int(remaining), retry_after / 1000, reset_after / 1000)
+
+    async def stats(self) -> dict:
+        return {'keys': await self.client.dbsize()}
+
+
+def _to_str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def create_state_backend(kind: str, limits: Dict[str, tuple], algorithm: str = 'gcra',
+                         redis_url: str = "redis://localhost:6379/0", snapshot_path: Optional[str] = None,
+                         snapshot_interval: float = 60.0) -> StateBackend:
+    """Create the backend selected by STATE_BACKEND ('memory' or 'redis'); Redis persists on its own"""
+    if kind == 'redis':
+        return RedisStateBackend(limits, url=redis_url)
+    if kind != 'memory':
+        raise ValueError(f"Unknown state backend: {kind}")
+    return InMemoryStateBackend(limits, algorithm, snapshot_path=snapshot_path, snapshot_interval=snapshot_interval)
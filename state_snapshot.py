@@ -0,0 +1,243 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SNAPSHOT_MAGIC = b'B8SNAP01'
+_JOURNAL_MAGIC = b'B8JRNL01'
+# magic, header length; a JSON header follows, padded to 8 bytes, then the columns
+_PREAMBLE = struct.Struct('<8sI4x')
+
+# op, limit index, user id / packed owner, code, phone, time (wall clock)
+RECORD = struct.Struct('<BB6xqQQd')
+OP_OTP_PUT, OP_OTP_DROP, OP_PHONE_SET, OP_PHONE_DROP, OP_RATE = 1, 2, 3, 4, 5
+
+
+def wall_offset(clock) -> float:
+    """Add to a `clock` time to get wall-clock time; times are saved as wall clock to survive reboots"""
+    return time.time() - clock()
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_file(path: str, preamble_magic: bytes, header: dict, chunks: List[bytes]) -> None:
+    """Write header and chunks to a temporary file, fsync it and rename it over path"""
+    encoded = json.dumps(header).encode()
+    encoded += b' ' * (-len(encoded) % 8)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_PREAMBLE.pack(preamble_magic, len(encoded)))
+        f.write(encoded)
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+class Snapshot(NamedTuple):
+    """Columns of a snapshot file; times are wall clock"""
+    log_id: int
+    log_offset: int
+    otp_epoch: float
+    otp_columns: Tuple[array, array, array, array]     # users, codes, phones, deadlines (seconds after epoch)
+    phone_columns: Tuple[array, array]                  # phones, packed owners
+    rates: Dict[str, Tuple[array, array, float]]        # action -> (user ids, drained_at, latest drained_at)
+
+
+def write_snapshot(path: str, snapshot: Snapshot) -> int:
+    """Write the snapshot atomically (fsync'd temporary file, rename); returns its size"""
+    columns = [*snapshot.otp_columns, *snapshot.phone_columns]
+    for action in sorted(snapshot.rates):
+        columns.extend(snapshot.rates[action][:2])
+    header = {
+        'log_id': snapshot.log_id,
+        'log_offset': snapshot.log_offset,
+        'otp_epoch': snapshot.otp_epoch,
+        'columns': [[column.typecode, len(column)] for column in columns],
+        'rates': sorted(snapshot.rates),
+        'rates_until': [snapshot.rates[action][2] for action in sorted(snapshot.rates)],
+        'written_at': time.time(),
+    }
+    chunks = []
+    for column in columns:
+        data = column.tobytes()
+        chunks.append(data + b'\0' * (-len(data) % 8))
+    _write_file(path, _SNAPSHOT_MAGIC, header, chunks)
+    return os.path.getsize(path)
+
+
+def read_snapshot(path: str) -> Optional[Snapshot]:
+    """Map a snapshot file and copy its columns out; None if missing or unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        magic, length = _PREAMBLE.unpack_from(mm)
+        if magic != _SNAPSHOT_MAGIC:
+            logger.warning("Ignoring %s: not a state snapshot", path)
+            return None
+        header = json.loads(mm[_PREAMBLE.size:_PREAMBLE.size + length])
+        offset = _PREAMBLE.size + length
+        columns = []
+        with memoryview(mm) as view:
+            for typecode, count in header['columns']:
+                column = array(typecode)
+                size = count * column.itemsize
+                column.frombytes(view[offset:offset + size])
+                columns.append(column)
+                offset += size + (-size % 8)
+    except (struct.error, ValueError, KeyError) as e:
+        logger.error("Ignoring unreadable state snapshot %s: %s", path, e)
+        return None
+    finally:
+        mm.close()
+    rates = {
+        action: (columns[6 + 2 * i], columns[7 + 2 * i], header['rates_until'][i])
+        for i, action in enumerate(header['rates'])
+    }
+    return Snapshot(header['log_id'], header['log_offset'], header['otp_epoch'],
+                    tuple(columns[:4]), tuple(columns[4:6]), rates)
+
+
+class StateJournal:
+    """Append-only log of state changes since the last snapshot
+
+    Records are buffered; the backend flushes and fsyncs them every second or
+    so, which bounds what a crash can lose. Each
+    journal has an id: a snapshot names the journal and offset it covers, and
+    after the snapshot is on disk rotate() moves the records written since
+    then into a fresh journal with the next id. lock() takes an exclusive
+    lock on a file next to the journal, which is replaced on every rotation,
+    so that two processes never restore from and append to the same state.
+    """
+
+    def __init__(self, path: str, actions: List[str], clock):
+        self.path = path
+        self.actions = actions
+        self.clock = clock
+        self.log_id = 0
+        self._file = None
+        self._lock = None
+        self._offset = 0.0
+
+    def lock(self) -> None:
+        """Lock the state against other processes until close(); raises RuntimeError if one holds it"""
+        self._lock = open(f"{self.path}.lock", 'ab')
+        try:
+            fcntl.flock(self._lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            self._lock = None
+            raise RuntimeError(f"State journal {self.path} is in use by another process")
+
+    def records(self, snapshot: Optional[Snapshot]) -> List[tuple]:
+        """Records to replay on top of `snapshot`, with action names resolved; opens the journal for appending"""
+        records = []
+        log_id, data_start, actions = self._read_header()
+        if log_id is not None and (snapshot is None or log_id in (snapshot.log_id, snapshot.log_id + 1)):
+            start = snapshot.log_offset if snapshot is not None and log_id == snapshot.log_id else data_start
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = f.read()
+            usable = len(data) - len(data) % RECORD.size
+            for record in RECORD.iter_unpack(data[:usable]):
+                action = actions[record[1]] if record[0] == OP_RATE and record[1] < len(actions) else None
+                records.append(record + (action,))
+            if usable == len(data) and actions == self.actions:
+                self._open(log_id)
+                return records
+            # Torn final record or different limits: carry the good records into a fresh journal
+            carried = []
+            for op, _, owner, code, phone, at, action in records:
+                if op != OP_RATE:
+                    carried.append(RECORD.pack(op, 0, owner, code, phone, at))
+                elif action in self.actions:
+                    carried.append(RECORD.pack(op, self.actions.index(action), owner, code, phone, at))
+            self._create(snapshot.log_id + 1 if snapshot is not None else log_id, carried)
+            return records
+        self._create(snapshot.log_id + 1 if snapshot is not None else 1, [])
+        return records
+
+    def _read_header(self) -> Tuple[Optional[int], int, List[str]]:
+        try:
+            with open(self.path, 'rb') as f:
+                magic, length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+                header = json.loads(f.read(length))
+        except (FileNotFoundError, struct.error, ValueError):
+            return None, 0, []
+        if magic != _JOURNAL_MAGIC:
+            return None, 0, []
+        return header['log_id'], _PREAMBLE.size + length, header['actions']
+
+    def _create(self, log_id: int, records: List[bytes]) -> None:
+        if self._file is not None:
+            self._file.close()
+        _write_file(self.path, _JOURNAL_MAGIC, {'log_id': log_id, 'actions': self.actions}, records)
+        self._open(log_id)
+
+    def _open(self, log_id: int) -> None:
+        self.log_id = log_id
+        self._file = open(self.path, 'ab')
+        self._offset = wall_offset(self.clock)
+
+    def tell(self) -> int:
+        self._file.flush()
+        return self._file.tell()
+
+    def otp_put(self, user_id: int, code: int, phone: int, deadline: float) -> None:
+        self._file.write(RECORD.pack(OP_OTP_PUT, 0, user_id, code, phone, deadline + self._offset))
+
+    def otp_drop(self, user_id: int) -> None:
+        self._file.write(RECORD.pack(OP_OTP_DROP, 0, user_id, 0, 0, 0.0))
+
+    def phone_set(self, phone: int, user_id: int, verified: bool) -> None:
+        self._file.write(RECORD.pack(OP_PHONE_SET, 0, user_id << 1 | verified, 0, phone, 0.0))
+
+    def phone_drop(self, phone: int) -> None:
+        self._file.write(RECORD.pack(OP_PHONE_DROP, 0, 0, 0, phone, 0.0))
+
+    def rate(self, action: str, user_id: int, drained_at: float) -> None:
+        self._file.write(RECORD.pack(OP_RATE, self.actions.index(action), user_id, 0, 0, drained_at + self._offset))
+
+    def flush(self) -> int:
+        """Hand buffered records to the OS; returns the file descriptor to fsync"""
+        self._file.flush()
+        return self._file.fileno()
+
+    def rotate(self, log_id: int, offset: int) -> None:
+        """Start journal log_id + 1 with the records written after `offset` of journal log_id"""
+        if log_id != self.log_id:
+            return
+        self._file.flush()
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        self._create(log_id + 1, [tail])
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if self._lock is not None:
+            # Closing the descriptor releases the lock
+            self._lock.close()
+            self._lock = None
@@ -0,0 +1,254 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerProcess:
+    """One bot process and what the supervisor knows about it"""
+
+    def __init__(self, slot: int, process: subprocess.Popen, held: bool):
+        self.slot = slot
+        self.process = process
+        self.held = held
+        self.started_at = time.time()
+        self.ready_at = None
+        self.last_heartbeat = None
+        self.draining = False
+        self._ps = None
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def release(self) -> None:
+        self.held = False
+        self.last_heartbeat = time.time()
+        self.process.send_signal(signal.SIGUSR1)
+
+    def usage(self) -> dict:
+        """CPU (since the previous call) and memory of the process"""
+        try:
+            if self._ps is None:
+                self._ps = psutil.Process(self.pid)
+            with self._ps.oneshot():
+                return {
+                    'cpu_percent': self._ps.cpu_percent(interval=None),
+                    'memory_mb': round(self._ps.memory_info().rss / 1024 / 1024, 1),
+                    'threads': self._ps.num_threads(),
+                }
+        except psutil.Error:
+            return {'cpu_percent': 0.0, 'memory_mb': 0.0, 'threads': 0}
+
+
+class BotSupervisor:
+    """Runs `workers` bot processes, restarting them with backoff and replacing them one at a time
+
+    Workers report over a pipe (see WorkerChannel): 'ready' once warmed up,
+    then a heartbeat. A worker that exits is restarted after an exponential
+    backoff; one whose heartbeat stops for `heartbeat_timeout` is killed and
+    restarted. A rolling restart starts each replacement held, waits until it
+    is ready, lets the old worker drain its queue on SIGTERM and only then
+    releases the replacement, so no update is dropped.
+    """
+
+    def __init__(self, command: Optional[List[str]] = None, workers: int = 1, heartbeat_timeout: float = 30.0,
+                 ready_timeout: float = 60.0, drain_timeout: float = 60.0, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, stable_after: float = 60.0):
+        self.command = command or [sys.executable, "bot.py"]
+        self.workers = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ready_timeout = ready_timeout
+        self.drain_timeout = drain_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self._lock = threading.RLock()
+        self.slots: List[Optional[WorkerProcess]] = [None] * workers
+        self._failures = [0] * workers
+        self._restart_at: List[Optional[float]] = [None] * workers
+        self.restarts = [0] * workers
+        self.running = False
+        self.rolling = False
+        self._monitor_thread = None
+
+    def _spawn(self, slot: int, held: bool) -> WorkerProcess:
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ, BOT_WORKER_ID=str(slot), BOT_STATUS_FD=str(write_fd), BOT_HOLD="1" if held else "0")
+        try:
+            process = subprocess.Popen(self.command, env=env, pass_fds=(write_fd,))
+        finally:
+            os.close(write_fd)
+        worker = WorkerProcess(slot, process, held)
+        threading.Thread(target=self._read_status, args=(worker, read_fd),
+                         name=f"bot-worker-{slot}-status", daemon=True).start()
+        logger.info("Started bot worker %d (pid %d%s)", slot, process.pid, ', held' if held else '')
+        return worker
+
+    def _read_status(self, worker: WorkerProcess, fd: int) -> None:
+        with os.fdopen(fd) as pipe:
+            for line in pipe:
+                status = line.strip()
+                if status == "ready":
+                    worker.ready_at = time.time()
+                    worker.last_heartbeat = worker.ready_at
+                elif status == "heartbeat":
+                    worker.last_heartbeat = time.time()
+
+    def start(self) -> bool:
+        with self._lock:
+            if self.running:
+                return True
+            self.running = True
+            for slot in range(self.workers):
+                self.slots[slot] = self._spawn(slot, held=False)
+                self._failures[slot] = 0
+                self._restart_at[slot] = None
+            if self._monitor_thread is None or not self._monitor_thread.is_alive():
+                self._monitor_thread = threading.Thread(target=self._monitor, name="bot-supervisor", daemon=True)
+                self._monitor_thread.start()
+        return True
+
+    def stop(self) -> bool:
+        """Ask every worker to drain and exit; stragglers are killed after `drain_timeout`"""
+        with self._lock:
+            self.running = False
+            workers = [worker for worker in self.slots if worker is not None]
+            self.slots = [None] * self.workers
+        for worker in workers:
+            self._retire(worker, wait=False)
+        return True
+
+    def _retire(self, worker: WorkerProcess, wait: bool = True) -> None:
+        """SIGTERM (the bot drains its queue), then SIGKILL after drain_timeout"""
+        worker.draining = True
+        if worker.alive:
+            worker.process.terminate()
+
+        def reap() -> None:
+            try:
+                worker.process.wait(self.drain_timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("Bot worker %d (pid %d) did not drain in time, killing", worker.slot, worker.pid)
+                worker.process.kill()
+                worker.process.wait()
+
+        if wait:
+            reap()
+        else:
+            threading.Thread(target=reap, name=f"bot-worker-{worker.slot}-reaper", daemon=True).start()
+
+    def _monitor(self) -> None:
+        while self.running:
+            now = time.time()
+            with self._lock:
+                for slot, worker in enumerate(self.slots):
+                    if worker is None:
+                        if self._restart_at[slot] is not None and now >= self._restart_at[slot]:
+                            self._restart_at[slot] = None
+                            self.restarts[slot] += 1
+                            self.slots[slot] = self._spawn(slot, held=False)
+                        continue
+                    if not worker.alive:
+                        self._schedule_restart(slot, worker, now)
+                    elif (not worker.held and worker.last_heartbeat is not None
+                          and now - worker.last_heartbeat > self.heartbeat_timeout):
+                        logger.error("Bot worker %d (pid %d) stopped responding, killing", slot, worker.pid)
+                        worker.process.kill()
+                    elif (worker.ready_at is None and not worker.held
+                          and now - worker.started_at > self.ready_timeout):
+                        logger.error("Bot worker %d (pid %d) never became ready, killing", slot, worker.pid)
+                        worker.process.kill()
+            time.sleep(1.0)
+
+    def _schedule_restart(self, slot: int, worker: WorkerProcess, now: float) -> None:
+        if now - worker.started_at >= self.stable_after:
+            self._failures[slot] = 0
+        self._failures[slot] += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self._failures[slot] - 1))
+        logger.error("Bot worker %d exited with code %s, restarting in %gs", slot, worker.process.returncode, delay)
+        self.slots[slot] = None
+        self._restart_at[slot] = now + delay
+
+    def rolling_restart(self) -> bool:
+        """Replace the workers one at a time in the background; False if not running or already rolling"""
+        with self._lock:
+            if not self.running or self.rolling:
+                return False
+            self.rolling = True
+        threading.Thread(target=self._roll, name="bot-rolling-restart", daemon=True).start()
+        return True
+
+    def _roll(self) -> None:
+        try:
+            for slot in range(self.workers):
+                if not self.running:
+                    return
+                replacement = self._spawn(slot, held=True)
+                deadline = time.time() + self.ready_timeout
+                while replacement.ready_at is None and replacement.alive and time.time() < deadline:
+                    time.sleep(0.1)
+                if replacement.ready_at is None or not self.running:
+                    if self.running:
+                        logger.error("Replacement for bot worker %d did not become ready, keeping the old one", slot)
+                    self._retire(replacement, wait=False)
+                    return
+                with self._lock:
+                    old = self.slots[slot]
+                    self.slots[slot] = replacement
+                    self._restart_at[slot] = None
+                    self._failures[slot] = 0
+                if old is not None:
+                    self._retire(old)
+                replacement.release()
+                self.restarts[slot] += 1
+                logger.info("Bot worker %d replaced (pid %s -> %d)", slot, old.pid if old else '-', replacement.pid)
+        finally:
+            self.rolling = False
+
+    def status(self) -> List[dict]:
+        """Per-worker state and resource usage"""
+        now = time.time()
+        result = []
+        with self._lock:
+            slots = list(enumerate(self.slots))
+        for slot, worker in slots:
+            if worker is None:
+                restart_at = self._restart_at[slot]
+                result.append({
+                    'slot': slot,
+                    'state': 'backoff' if restart_at else 'stopped',
+                    'restart_in': round(max(0.0, restart_at - now), 1) if restart_at else None,
+                    'restarts': self.restarts[slot],
+                })
+                continue
+            if worker.held:
+                state = 'warming' if worker.ready_at is None else 'held'
+            elif worker.ready_at is None:
+                state = 'starting'
+            elif worker.last_heartbeat is not None and now - worker.last_heartbeat > self.heartbeat_timeout:
+                state = 'unhealthy'
+            else:
+                state = 'ready'
+            result.append({
+                'slot': slot,
+                'pid': worker.pid,
+                'state': state,
+                'uptime': round(now - worker.started_at),
+                'last_heartbeat': round(now - worker.last_heartbeat, 1) if worker.last_heartbeat else None,
+                'restarts': self.restarts[slot],
+                **worker.usage(),
+            })
+        return result
@@ -0,0 +1,170 @@
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional, Tuple
+
+from logging_setup import current_handler
+
+logger = logging.getLogger(__name__)
+
+# Span kinds: handler execution, Bot API calls (as seen by the handler, including throttling) and SMS sends
+HANDLER = 'handler'
+TELEGRAM = 'telegram'
+SMS = 'sms'
+
+
+class Tracer:
+    """Rolling latency samples per (span kind, route)
+
+    The route is the handler label bound for the current update ('/start',
+    'callback:profile', 'message'), so Bot API and SMS spans land next to the
+    handler that caused them. With DEBUG logging each span is also logged,
+    tagged with the user and route by the logging context. Routes past
+    `max_spans` (callback data is user-controlled) share the 'other' route.
+    """
+
+    def __init__(self, samples: int = 1024, max_spans: int = 48):
+        self.samples = samples
+        self.max_spans = max_spans
+        self._spans: Dict[Tuple[str, str], deque] = {}
+        self._counts: Dict[Tuple[str, str], int] = {}
+
+    def record(self, kind: str, seconds: float, detail: Optional[str] = None) -> None:
+        key = (kind, current_handler.get() or '-')
+        samples = self._spans.get(key)
+        if samples is None and len(self._spans) >= self.max_spans:
+            key = (kind, 'other')
+            samples = self._spans.get(key)
+        if samples is None:
+            samples = self._spans[key] = deque(maxlen=self.samples)
+            self._counts[key] = 0
+        samples.append(seconds)
+        self._counts[key] += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Span %s %s", kind, detail or '', extra={'latency_ms': round(seconds * 1000, 2)})
+
+    def wrap(self, callback):
+        """Wrap a handler callback so its execution is recorded as a handler span"""
+        @functools.wraps(callback)
+        async def traced(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                self.record(HANDLER, time.perf_counter() - started)
+        return traced
+
+    def stats(self) -> Dict[Tuple[str, str], dict]:
+        """Count and p50/p95/p99/max (seconds) over the recent samples of each span"""
+        result = {}
+        for key, samples in list(self._spans.items()):
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+
+            def pct(p: float) -> float:
+                return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+            result[key] = {
+                'count': self._counts[key],
+                'p50': pct(0.50),
+                'p95': pct(0.95),
+                'p99': pct(0.99),
+                'max': ordered[-1],
+            }
+        return result
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread for a fixed window
+
+    Nothing runs unless a window was started. The result is written in the
+    folded format (`outer;inner;leaf count` per line) read by flamegraph.pl
+    and speedscope. Time the event loop spends waiting shows up under
+    select().
+    """
+
+    def __init__(self, output_dir: str = "profiles", interval: float = 0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._thread = None
+        self._stopped = threading.Event()
+        self.last_output = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, thread_id: Optional[int] = None) -> bool:
+        """Profile `thread_id` (default: the calling thread) for `duration` seconds; False if already running"""
+        if self.running:
+            return False
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(thread_id or threading.get_ident(), duration),
+            name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        logger.info("Profiling for %gs", duration)
+        return True
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, thread_id: int, duration: float) -> None:
+        stacks = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline and not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[';'.join(reversed(labels))] += 1
+        self._write(stacks)
+
+    def _write(self, stacks: Counter) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, path)
+        self.last_output = path
+        logger.info("Profile written to %s (%d samples)", path, sum(stacks.values()))
+
+
+def request_profile(output_dir: str, duration: float) -> None:
+    """Ask the bot (from another process) to profile for `duration` seconds"""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "request"), 'w') as f:
+        f.write(f"{duration:g}")
+
+
+def take_profile_request(output_dir: str) -> Optional[float]:
+    """Consume a pending request_profile(); returns its duration"""
+    path = os.path.join(output_dir, "request")
+    try:
+        with open(path) as f:
+            value = f.read()
+        os.remove(path)
+    except FileNotFoundError:
+        return None
+    try:
+        return max(1.0, min(float(value), 300.0))
+    except ValueError:
+        return None
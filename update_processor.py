@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from logging_setup import bind_log_context, reset_log_context
+from metrics import DEFAULT_BUCKETS, MetricsWriter
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes different users' updates in parallel and each user's updates in arrival order
+
+    Updates of the same user wait on a per-user FIFO lock before taking one of
+    `max_concurrent_updates` processing slots, so a user with a backlog never
+    occupies more than one slot and handlers can keep relying on
+    `context.user_data` flags without racing. `max_pending_updates` bounds
+    how many updates may be in flight (waiting or running) at once.
+
+    With a MetricsWriter, each update's latency is recorded per handler along
+    with the user's last activity. All of it is tallied in process and
+    written to the metrics file by publish(). Users can type any /command or callback
+    data, so once `known_handlers` is set, labels outside it become 'other';
+    handlers past `max_handler_series` share the 'other' series too.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 64, max_pending_updates: int = 4096,
+                 wait_samples: int = 1024, metrics: Optional[MetricsWriter] = None,
+                 max_handler_series: int = 64):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.concurrency_limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # user_id -> [lock, number of updates holding or waiting for it]
+        self._user_locks = {}
+        self._waits = deque(maxlen=wait_samples)
+        self.queued = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.processed = 0
+        self.metrics = metrics
+        self.max_handler_series = max_handler_series
+        # Labels of the registered commands and callback routes, set once handlers are added
+        self.known_handlers: Optional[frozenset] = None
+        # handler -> (label, bucket counts + sum), and label -> histogram they are published to
+        self._latency = {}
+        self._histograms = {}
+        # user_id -> time of their last update, for the active sessions gauge
+        self.last_seen = {}
+        if metrics is not None:
+            self._today = metrics.gauge('b8nkr_updates_today')
+            self._today_count = 0
+            self._day_end = 0.0
+            # (time, user_id, handler) since the last publish(), at most one ring's worth
+            self._recent = deque(maxlen=metrics.ring_size)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def _user_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        owner = update.effective_user or update.effective_chat
+        return owner.id if owner else None
+
+    def _handler_name(self, update: object) -> Optional[str]:
+        """Short label for log records and metrics: the command, the callback route, 'message' or 'other'"""
+        if not isinstance(update, Update):
+            return None
+        if update.callback_query is not None:
+            name = f"callback:{(update.callback_query.data or '').partition(':')[0]}"
+        else:
+            text = update.message.text if update.message else None
+            if not (text and text.startswith('/')):
+                return 'message'
+            # '/start@SomeBot' in groups
+            name = text.split(maxsplit=1)[0].partition('@')[0]
+        if self.known_handlers is not None and name not in self.known_handlers:
+            return 'other'
+        return name
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        enqueued = time.perf_counter()
+        key = self._user_key(update)
+        entry = None
+        if key is not None:
+            entry = self._user_locks.get(key)
+            if entry is None:
+                entry = self._user_locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        self.queued += 1
+        if self.queued > self.max_queue_depth:
+            self.max_queue_depth = self.queued
+        started = False
+        try:
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._slots:
+                    self.queued -= 1
+                    self.running += 1
+                    started = True
+                    self._waits.append(time.perf_counter() - enqueued)
+                    handler = self._handler_name(update)
+                    log_context = bind_log_context(key, handler)
+                    try:
+                        await coroutine
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+                        latency = time.perf_counter() - enqueued
+                        logger.debug("Update handled", extra={'latency_ms': round(latency * 1000, 2)})
+                        if self.metrics is not None:
+                            self._record(key, handler, latency)
+                        reset_log_context(log_context)
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started:
+                self.queued -= 1
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._user_locks[key]
+
+    def _record(self, user_id: Optional[int], handler: Optional[str], latency: float) -> None:
+        label, counts = self._latency.get(handler) or self._latency_entry(handler)
+        counts[bisect_left(DEFAULT_BUCKETS, latency)] += 1
+        counts[-1] += latency
+        self._today_count += 1
+        if user_id is not None:
+            now = time.time()
+            self.last_seen[user_id] = now
+            self._recent.append((now, user_id, label))
+
+    def _latency_entry(self, handler: Optional[str]) -> tuple:
+        """(label, bucket counts + sum) tallied for a handler until the next publish()"""
+        label = handler or 'other'
+        if label not in self._latency and len(self._latency) >= self.max_handler_series:
+            label = 'other'
+        entry = self._latency.get(label)
+        if entry is None:
+            entry = self._latency[label] = (label, [0] * (len(DEFAULT_BUCKETS) + 1) + [0.0])
+            self._histograms[label] = self.metrics.histogram('b8nkr_update_seconds', handler=label)
+        return entry
+
+    def publish(self) -> None:
+        """Write the latencies, the updates-today gauge and the activity tallied since the last call
+
+        Keeps the metrics file off the per-update path; the bot calls this
+        with its other gauges.
+        """
+        if self.metrics is None:
+            return
+        for label, counts in self._latency.values():
+            if any(counts):
+                self._histograms[label].add(counts)
+                counts[:] = [0] * (len(counts) - 1) + [0.0]
+        if time.time() >= self._day_end:
+            # Updates between midnight and this call still count towards the previous day
+            midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            if self._day_end:
+                self._today_count = 0
+            self._day_end = (midnight + timedelta(days=1)).timestamp()
+        self._today.set(self._today_count)
+        recent = self._recent
+        while recent:
+            at, user_id, handler = recent.popleft()
+            self.metrics.activity(user_id, handler, at)
+
+    def active_users(self, window: float) -> int:
+        """Users with an update in the last `window` seconds; forgets older ones"""
+        cutoff = time.time() - window
+        for user_id in [user_id for user_id, seen in self.last_seen.items() if seen < cutoff]:
+            del self.last_seen[user_id]
+        return len(self.last_seen)
+
+    def stats(self) -> dict:
+        """Queue depth, concurrency and wait-time percentiles (seconds)"""
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+        return {
+            'running': self.running,
+            'queued': self.queued,
+            'max_queue_depth': self.max_queue_depth,
+            'users_in_flight': len(self._user_locks),
+            'processed': self.processed,
+            'wait_p50': pct(0.50),
+            'wait_p95': pct(0.95),
+            'wait_max': waits[-1] if waits else 0.0,
+        }
@@ -1,73 +1,115 @@
+import atexit
 import json
 import os
 import logging
-from flask import Flask, render_template, jsonify, request, Response
+import time
+from flask import Flask, render_template, jsonify, request, Response, send_from_directory
 from datetime import datetime
-import subprocess
-import psutil
+
+from log_index import LogIndex
+from log_tail import get_tailer, stream
+from metrics import read_all_metrics, render_prometheus, HISTOGRAM
+from tracing import request_profile
+from supervisor import BotSupervisor
 
 app = Flask(__name__)
 
-# Configure logging
+# Configure logging; bot.log belongs to the bot, which rotates it
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()],
+    handlers=[logging.StreamHandler()],
 )
 logger = logging.getLogger(__name__)
 
+LOG_PATH = os.getenv("LOG_PATH", "bot.log")
+LOG_STREAM_BACKFILL = int(os.getenv("LOG_STREAM_BACKFILL", "100"))
+log_index = LogIndex(LOG_PATH)
+METRICS_PATH = os.getenv("METRICS_PATH", "bot_metrics.bin")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Dashboard wording for the handlers recorded in the activity feed
+ACTIVITY_LABELS = {
+    "/start": "Started the bot",
+    "/balance": "Checked balance",
+    "callback:balance": "Checked balance",
+    "/transfer": "Opened transfers",
+    "callback:transfer": "Opened transfers",
+    "callback:transfer_confirm": "Made transfer",
+    "/history": "Viewed history",
+    "callback:transfer_history": "Viewed history",
+    "callback:hist": "Viewed history",
+    "/help": "Requested help",
+    "/profile": "Viewed profile",
+    "callback:profile": "Viewed profile",
+    "callback:verify_phone": "Started verification",
+    "message": "Sent a message",
+}
+
 # Bot process management
-bot_process = None
+if int(os.getenv("BOT_WORKERS", "1")) != 1:
+    # Each worker would keep its own OTPs, sessions and per-user ordering, so a user's updates must
+    # all reach one process; the bot's ingress shards by user when BOT_SHARDS is above 1
+    raise ValueError("BOT_WORKERS must be 1: separate workers would split users' sessions; "
+                     "use BOT_SHARDS to spread updates over several processes")
+supervisor = BotSupervisor(
+    drain_timeout=float(os.getenv("BOT_DRAIN_TIMEOUT", "60")),
+    heartbeat_timeout=float(os.getenv("BOT_HEARTBEAT_TIMEOUT", "30")),
+)
+atexit.register(lambda: supervisor.stop())
 
 
 def get_bot_status():
-    global bot_process
-    if bot_process is None:
-        return False
-    return bot_process.poll() is None
+    return supervisor.running
 
 
 def start_bot():
-    global bot_process
     try:
-        bot_process = subprocess.Popen(["python", "bot.py"])
+        supervisor.start()
         logger.info("Bot started")
         return True
     except Exception as e:
-        logger.error(f"Error starting bot: {str(e)}")
+        logger.error("Error starting bot: %s", e)
         return False
 
 
 def stop_bot():
-    global bot_process
-    if bot_process:
-        try:
-            process = psutil.Process(bot_process.pid)
-            for proc in process.children(recursive=True):
-                proc.terminate()
-            process.terminate()
-            bot_process = None
-            logger.info("Bot stopped")
-            return True
-        except Exception as e:
-            logger.error(f"Error stopping bot: {str(e)}")
-            return False
-    return True
+    try:
+        supervisor.stop()
+        logger.info("Bot stopping")
+        return True
+    except Exception as e:
+        logger.error("Error stopping bot: %s", e)
+        return False
+
+
+def format_ago(seconds):
+    if seconds < 60:
+        return "just now"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} mins ago"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)} hours ago"
+    return f"{int(seconds // 86400)} days ago"
 
 
 # Routes
 @app.route("/")
 def index():
-    # Mock data for demonstration
+    snapshot = read_all_metrics(METRICS_PATH)
+    now = time.time()
     data = {
         "bot_running": get_bot_status(),
-        "total_users": 150,
-        "commands_today": 75,
-        "active_sessions": 12,
+        "total_users": int(snapshot.value("b8nkr_accounts")) if snapshot else 0,
+        "commands_today": int(snapshot.value("b8nkr_updates_today")) if snapshot else 0,
+        "active_sessions": int(snapshot.value("b8nkr_active_sessions")) if snapshot else 0,
         "recent_activities": [
-            {"time": "2 mins ago", "user": "User123", "action": "Checked balance"},
-            {"time": "5 mins ago", "user": "User456", "action": "Made transfer"},
-            {"time": "10 mins ago", "user": "User789", "action": "Requested help"},
+            {
+                "time": format_ago(now - activity.time),
+                "user": f"User{activity.user_id}",
+                "action": ACTIVITY_LABELS.get(activity.action, activity.action),
+            }
+            for activity in (snapshot.activities[:10] if snapshot else [])
         ],
     }
     return render_template("index.html", **data)
@@ -84,12 +126,76 @@ def toggle_bot():
     )
 
 
+@app.route("/restart_bot", methods=["POST"])
+def restart_bot():
+    """Rolling restart: each worker is replaced only after its successor is warmed up"""
+    return jsonify({"success": supervisor.rolling_restart()})
+
+
+@app.route("/workers")
+def workers():
+    return jsonify({"running": supervisor.running, "rolling": supervisor.rolling, "workers": supervisor.status()})
+
+
 @app.route("/command_stats")
 def command_stats():
-    # Mock data for demonstration
-    return jsonify(
-        {"labels": ["Balance", "Transfer", "Help", "Call"], "values": [45, 30, 20, 5]}
-    )
+    snapshot = read_all_metrics(METRICS_PATH)
+    counts = {}
+    for series in snapshot.series if snapshot else []:
+        if series.name == "b8nkr_update_seconds" and series.kind == HISTOGRAM:
+            handler = series.labels.partition('"')[2].rstrip('"')
+            label = ACTIVITY_LABELS.get(handler, handler)
+            counts[label] = counts.get(label, 0) + int(series.values[-1])
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:8]
+    return jsonify({"labels": [label for label, _ in top], "values": [count for _, count in top]})
+
+
+@app.route("/metrics")
+def metrics():
+    snapshot = read_all_metrics(METRICS_PATH)
+    if snapshot is None:
+        return Response("", mimetype="text/plain; version=0.0.4")
+    return Response(render_prometheus(snapshot), mimetype="text/plain; version=0.0.4")
+
+
+def parse_labels(labels):
+    return dict(part.split("=", 1) for part in labels.replace('"', "").split(",") if "=" in part)
+
+
+@app.route("/traces")
+def traces():
+    """Span latency percentiles per kind and route, slowest p95 first"""
+    snapshot = read_all_metrics(METRICS_PATH)
+    spans = {}
+    for series in snapshot.series if snapshot else []:
+        if series.name == "b8nkr_span_seconds":
+            labels = parse_labels(series.labels)
+            span = spans.setdefault((labels.get("kind"), labels.get("route")), {})
+            span[labels.get("quantile")] = round(series.values[0] * 1000, 2)
+    rows = [{"kind": kind, "route": route, **values} for (kind, route), values in spans.items()]
+    rows.sort(key=lambda row: row.get("p95", 0), reverse=True)
+    return jsonify({"spans": rows})
+
+
+@app.route("/profile", methods=["POST"])
+def profile():
+    seconds = request.form.get("seconds", 30, type=float)
+    request_profile(PROFILE_DIR, seconds)
+    return jsonify({"success": True, "seconds": seconds})
+
+
+@app.route("/profiles")
+def profiles():
+    try:
+        names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".folded")), reverse=True)
+    except FileNotFoundError:
+        names = []
+    return jsonify({"profiles": names[:20]})
+
+
+@app.route("/profiles/<name>")
+def download_profile(name):
+    return send_from_directory(os.path.abspath(PROFILE_DIR), name, as_attachment=True)
 
 
 @app.route("/logs")
@@ -97,6 +203,35 @@ def logs():
     return render_template("logs.html")
 
 
+def parse_time_arg(value):
+    """Accept epoch seconds or an ISO date/time from a query string"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+@app.route("/logs/search")
+def logs_search():
+    started = time.perf_counter()
+    try:
+        since = parse_time_arg(request.args.get("since")) or 0.0
+        until = parse_time_arg(request.args.get("until")) or float("inf")
+        cursor = request.args.get("cursor", type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    levels = [level for level in request.args.get("level", "").split(",") if level]
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    page = log_index.search(
+        since, until, levels, cursor=cursor, limit=limit,
+        newest_first=request.args.get("order", "desc") != "asc"
+    )
+    page["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(page)
+
+
 @app.route("/commands")
 def commands():
     return render_template("commands.html")
@@ -113,7 +248,7 @@ def config():
                 "twilio_phone_number": "",
             }
     except Exception as e:
-        logger.error(f"Error reading config: {str(e)}")
+        logger.error("Error reading config: %s", e)
         config_data = {}
 
     return render_template("config.html", config=config_data)
@@ -151,21 +286,44 @@ def save_config():
 
         return jsonify({"success": True})
     except Exception as e:
-        logger.error(f"Error saving config: {str(e)}")
+        logger.error("Error saving config: %s", e)
         return jsonify({"success": False, "error": str(e)})
 
 
+def format_log_line(line):
+    """Render a JSON log line in the viewer's text layout; other lines pass through"""
+    line = line.rstrip("\n")
+    if not line.startswith("{"):
+        return line
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return line
+    text = f"{entry.get('ts', '')} - {entry.get('logger', '')} - {entry.get('level', '')} - {entry.get('msg', '')}"
+    context = " ".join(
+        f"{field}={entry[field]}" for field in ("user_id", "handler", "latency_ms") if field in entry
+    )
+    return f"{text} [{context}]" if context else text
+
+
 @app.route("/log_stream")
 def log_stream():
+    # One shared reader per log file; each client gets a bounded buffer
+    tailer = get_tailer(LOG_PATH)
+    backfill = request.args.get("backfill", LOG_STREAM_BACKFILL, type=int)
+    last_event_id = request.headers.get("Last-Event-ID")
+
     def generate():
-        with open("bot.log", "r") as f:
-            while True:
-                line = f.readline()
-                if not line:
-                    continue
-                yield f"data: {line}\n\n"
-
-    return Response(generate(), mimetype="text/event-stream")
+        for item in stream(tailer, backfill, last_event_id):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            event_id, line = item
+            if event_id is not None:
+                yield f"id: {event_id}\n"
+            yield f"data: {format_log_line(line)}\n\n"
+
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import os
+import signal
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerChannel:
+    """Worker side of the supervisor protocol: status lines on an inherited pipe
+
+    The worker writes 'ready' once it is warmed up and 'heartbeat' while its
+    event loop is responsive. A worker started held (BOT_HOLD=1) waits after
+    'ready' for SIGUSR1 before it starts receiving updates, so it can take
+    over from a worker that is still draining.
+    """
+
+    def __init__(self, fd: int, worker_id: int = 0, held: bool = False):
+        self.worker_id = worker_id
+        self.held = held
+        self._pipe = os.fdopen(fd, 'w', buffering=1)
+
+    @classmethod
+    def from_env(cls) -> Optional["WorkerChannel"]:
+        """The channel when running under the supervisor, else None"""
+        fd = os.getenv("BOT_STATUS_FD")
+        if not fd:
+            return None
+        return cls(int(fd), int(os.getenv("BOT_WORKER_ID", "0")), os.getenv("BOT_HOLD") == "1")
+
+    def send(self, status: str) -> None:
+        try:
+            self._pipe.write(status + "\n")
+        except (BrokenPipeError, ValueError):
+            # The supervisor went away; keep serving
+            pass
+
+    async def ready(self) -> None:
+        """Report readiness and, if held, wait until the supervisor releases this worker"""
+        if not self.held:
+            self.send("ready")
+            return
+        released = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGUSR1, released.set)
+        self.send("ready")
+        logger.info("Worker %s warmed up, waiting for the previous worker to drain", self.worker_id)
+        await released.wait()
+        loop.remove_signal_handler(signal.SIGUSR1)
+        self.held = False
+        logger.info("Worker %s released", self.worker_id)